@@ -1,21 +1,81 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_request_context,
+    make_response,
+    render_template,
+    request,
+    jsonify,
+    redirect,
+    url_for,
+)
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import redis
 from minio import Minio
+from minio.deleteobjects import DeleteObject
 import requests
 import time
 import socket
 from werkzeug.utils import secure_filename
+from markupsafe import Markup
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag, unquote_etag
+from PIL import Image, ImageOps
 import uuid
+import hashlib
 import json
+import zlib
+import csv
+import codecs
+import io
+import shutil
+import tempfile
+from io import BytesIO
+import urllib3
+import base64
+import re
+import threading
+import functools
+import inspect
+import cProfile
+import pstats
+import marshal
+import hmac
+import sys
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+from json_logging import request_id_var, setup_logging
+
+# Serializadores opcionales para la caché (si no están, se usa json)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = Flask(__name__)
+logger = logging.getLogger("app")
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max
 
-metrics = PrometheusMetrics(app)
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    # Varios workers de gunicorn: /metrics agrega los ficheros de todos los
+    # procesos y las métricas propias no se registran en ningún registry
+    metrics = GunicornInternalPrometheusMetrics(app)
+    metrics_registry = None
+else:
+    metrics = PrometheusMetrics(app)
+    metrics_registry = metrics.registry
 metrics.info("app_info", "Application info", version="1.0.0")
 
 # Configuración desde variables de entorno
@@ -25,84 +85,1896 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# Pool de conexiones PostgreSQL
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(
+    os.getenv("DB_POOL_TIMEOUT", "5")
+)  # segundos esperando conexión
+# Edad máxima de una conexión del pool síncrono, esté ociosa o no
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+# Tiempo ocioso tras el que asyncpg cierra una conexión (asgi.py): asyncpg
+# no tiene edad máxima, así que es un límite distinto de DB_POOL_MAX_LIFETIME
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))  # 0 = siempre
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "0"))  # Default a 0 si no está configurado
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
 MINIO_USER = os.getenv("MINIO_USER")
 MINIO_PASSWORD = os.getenv("MINIO_PASSWORD")
 MINIO_PUBLIC_PORT = os.getenv("MINIO_PUBLIC_PORT")
+MINIO_HTTP_POOL_SIZE = int(os.getenv("MINIO_HTTP_POOL_SIZE", "10"))
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", "5"))
+MINIO_READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", "60"))
+# Imágenes de este tamaño o mayores se suben en segundo plano (0 = nunca)
+UPLOAD_ASYNC_THRESHOLD = int(os.getenv("UPLOAD_ASYNC_THRESHOLD", "0"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Importación masiva: filas por transacción (COPY + upsert)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Borrado masivo: máximo de usuarios por petición y reintento de objetos
+BULK_DELETE_MAX = int(os.getenv("BULK_DELETE_MAX", "10000"))
+DELETE_RETRY_INTERVAL = float(os.getenv("DELETE_RETRY_INTERVAL", "30"))
+# Endpoint de MinIO accesible desde el navegador (ingress)
+MINIO_PUBLIC_ENDPOINT = os.getenv(
+    "MINIO_PUBLIC_ENDPOINT",
+    f"minio-api.{os.getenv('ENVIRONMENT', 'dev')}.localhost:8080",
+)
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+PRESIGNED_UPLOAD_EXPIRES = int(os.getenv("PRESIGNED_UPLOAD_EXPIRES", "300"))
+# Tiempo extra, tras caducar la URL, para confirmar la subida; pasado ese
+# plazo el objeto sin usuario se borra
+UPLOAD_CONFIRM_WINDOW = int(os.getenv("UPLOAD_CONFIRM_WINDOW", "600"))
+# Clave HMAC de los tokens de subida; debe ser la misma en todos los pods
+UPLOAD_TOKEN_SECRET = (
+    os.getenv("UPLOAD_TOKEN_SECRET") or MINIO_PASSWORD or uuid.uuid4().hex
+)
+# Miniaturas: el doble del tamaño mostrado (60px) para pantallas HiDPI
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "120"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Píxeles máximos a decodificar por miniatura: con RGBA y la copia de
+# exif_transpose son ~8 bytes/píxel por hilo, a ajustar al límite de memoria
+# del pod (256Mi por defecto)
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", str(8 * 1000 * 1000)))
+# Segundos sin volver a intentar la miniatura perezosa de una imagen
+THUMBNAIL_RETRY_AFTER = float(os.getenv("THUMBNAIL_RETRY_AFTER", "300"))
+
+# Pool de conexiones Redis
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", "20"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "2"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+LB_HOST = os.getenv("LB_HOST", "dev-load-balancer")
+LB_PORT = int(os.getenv("LB_PORT", "80"))
+
+# Health checks: se ejecutan en paralelo y el resultado se reutiliza unos segundos
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "2"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+
+INSTANCE_ID = socket.gethostname()
+BUCKET_NAME = "user-images"
+CACHE_TTL = 300  # TTL duro: pasado este tiempo la página desaparece de Redis
+# TTL blando: pasado este tiempo la página se sirve obsoleta mientras se recalcula
+CACHE_SOFT_TTL = int(os.getenv("CACHE_SOFT_TTL", "60"))
+CACHE_LOCK_TTL = int(os.getenv("CACHE_LOCK_TTL", "10"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "2"))
+USERS_CACHE_KEY = "users_list"
+# Valor de `from_cache` cuando se sirve la copia obsoleta de una página
+CACHE_STALE = "stale"
+# Versión del formato de las páginas cacheadas: cambiarla evita que pods con
+# versiones distintas lean las páginas de los otros durante un despliegue
+USERS_PAGE_FORMAT = "v2"
+# Serialización de las páginas: orjson, msgpack o json; se comprimen con zlib
+# las que ocupan al menos CACHE_COMPRESS_MIN bytes (0 = nunca)
+CACHE_SERIALIZER = os.getenv("CACHE_SERIALIZER", "orjson" if orjson else "json")
+CACHE_COMPRESS_MIN = int(os.getenv("CACHE_COMPRESS_MIN", "4096"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "1"))
+# Índice (sorted set) de páginas cacheadas, puntuadas por la posición de su cursor
+USERS_PAGES_KEY = f"{USERS_CACHE_KEY}:pages"
+# Versión de los datos de usuarios (hash con contador "n" y marca "ts" en ms):
+# cambia con cada escritura y de ella salen el ETag y el Last-Modified de /users
+USERS_VERSION_KEY = f"{USERS_CACHE_KEY}:version"
+# Ficheros estáticos con huella en la URL: caché de un año en el navegador
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+# Resultados de búsqueda cacheados: {clave}:{versión}:{hash de la consulta}
+USERS_SEARCH_KEY = f"{USERS_CACHE_KEY}:search"
+# Canal pub/sub por el que se propagan las invalidaciones a la caché L1 de cada pod
+CACHE_INVALIDATION_CHANNEL = f"{USERS_CACHE_KEY}:invalidate"
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "256"))  # 0 = desactivada
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "5"))
+# Caché en memoria de la tabla de /users ya renderizada, por versión de datos y página
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "128"))  # 0 = desactivada
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL", "30"))
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "50"))
+USERS_PAGE_SIZE_MAX = int(os.getenv("USERS_PAGE_SIZE_MAX", "200"))
+# Exportación en streaming: filas que se traen del cursor de servidor por vez
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+# Búsqueda de usuarios: con menos de 3 caracteres no hay trigramas y el índice
+# no sirve; los resultados se cachean poco tiempo y por versión de los datos
+SEARCH_MIN_LENGTH = int(os.getenv("SEARCH_MIN_LENGTH", "3"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "30"))
+SEARCH_STATEMENT_TIMEOUT_MS = int(os.getenv("SEARCH_STATEMENT_TIMEOUT_MS", "2000"))
+# Perfilado bajo demanda en /debug/profile: desactivado si no hay token
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+PROFILER_MAX_REQUESTS = int(os.getenv("PROFILER_MAX_REQUESTS", "100"))
+
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+OBJECT_NAME_RE = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_[\w.-]+$"
+)
+
+
+def allowed_file(filename):
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def make_object_name(filename):
+    """Nombre único del objeto en MinIO para una imagen subida"""
+    return f"{uuid.uuid4()}_{secure_filename(filename)}"
+
+
+# Latencia por etapa (pool, consulta, Redis, MinIO, plantillas, serialización)
+# dentro de cada petición, etiquetada por ruta y por acierto de caché
+REQUEST_STAGE_DURATION = Histogram(
+    "request_stage_duration_seconds",
+    "Duración de cada etapa de una petición",
+    ["route", "stage", "cache"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    registry=metrics_registry,
+)
+
+
+class timed:
+    """
+    Mide una etapa con reloj monotónico, como bloque `with` o decorador.
+    Dentro de una petición la medida se guarda en `g` y se publica al
+    terminarla, cuando ya se sabe la ruta y si se sirvió desde caché; fuera
+    de una petición (hilos de fondo) se publica en el momento.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if has_request_context():
+            g.setdefault("stages", []).append((self.stage, elapsed))
+        else:
+            REQUEST_STAGE_DURATION.labels("-", self.stage, "none").observe(elapsed)
+
+    def __call__(self, func):
+        stage = self.stage
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def mark_cache_result(hit):
+    """Anota si la petición en curso se ha servido desde caché"""
+    g.cache_result = "hit" if hit else "miss"
+
+
+@app.teardown_request
+def observe_request_stages(exc):
+    stages = g.pop("stages", None)
+    if not stages:
+        return
+    route = request.url_rule.rule if request.url_rule else "other"
+    cache = g.get("cache_result", "none")
+    for stage, elapsed in stages:
+        REQUEST_STAGE_DURATION.labels(route, stage, cache).observe(elapsed)
+
+
+# Id de correlación: se respeta el X-Request-ID de entrada (ingress, otro
+# servicio) si es razonable, se añade a todos los logs y se devuelve
+REQUEST_ID_RE = re.compile(r"^[\w.-]{1,64}$")
+
+
+@app.before_request
+def assign_request_id():
+    request_id = request.headers.get("X-Request-ID", "")
+    if not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.request_id_token = request_id_var.set(request_id)
+
+
+@app.after_request
+def add_request_id_header(response):
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        request_id_var.reset(token)
+
+
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Conexiones PostgreSQL prestadas por el pool",
+    multiprocess_mode="livesum",
+    registry=metrics_registry,
+)
+DB_POOL_IDLE = Gauge(
+    "db_pool_connections_idle",
+    "Conexiones PostgreSQL libres en el pool",
+    multiprocess_mode="livesum",
+    registry=metrics_registry,
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Tiempo de espera para obtener una conexión del pool",
+    registry=metrics_registry,
+)
+DB_POOL_EVENTS = Counter(
+    "db_pool_events_total",
+    "Eventos del pool de conexiones PostgreSQL",
+    ["event"],
+    registry=metrics_registry,
+)
+
+
+class PoolTimeout(Exception):
+    """No se ha podido obtener una conexión del pool a tiempo"""
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones PostgreSQL thread-safe.
+    Reutiliza conexiones entre peticiones, limita el número máximo de
+    conexiones abiertas y descarta las caducadas o rotas al prestarlas.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, max_lifetime, check_idle, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._kwargs = kwargs
+        self._cond = threading.Condition()
+        self._idle = []  # (conexión, creada_en, devuelta_en)
+        self._created = {}  # id(conexión) -> creada_en
+        self._in_use = 0
+        self._closed = False
+
+        for _ in range(minconn):
+            conn, created_at = self._connect()
+            self._idle.append((conn, created_at, time.monotonic()))
+        self._update_gauges()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._kwargs)
+        created_at = time.monotonic()
+        self._created[id(conn)] = created_at
+        DB_POOL_EVENTS.labels("connect").inc()
+        return conn, created_at
+
+    def _discard(self, conn, event):
+        self._created.pop(id(conn), None)
+        DB_POOL_EVENTS.labels(event).inc()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _update_gauges(self):
+        DB_POOL_IN_USE.set(self._in_use)
+        DB_POOL_IDLE.set(len(self._idle))
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if now - returned_at >= self.check_idle:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self):
+        """Presta una conexión; espera como máximo `timeout` segundos"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("El pool de conexiones está cerrado")
+                if self._idle:
+                    # LIFO: la conexión más reciente es la que más probablemente sigue viva
+                    conn, created_at, returned_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use + len(self._idle) < self.maxconn:
+                    self._in_use += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    DB_POOL_EVENTS.labels("timeout").inc()
+                    raise PoolTimeout(
+                        f"Sin conexiones libres tras {self.timeout}s (max={self.maxconn})"
+                    )
+                self._cond.wait(remaining)
+            self._update_gauges()
+
+        # La conexión (o su comprobación) se hace fuera del lock
+        try:
+            if conn is not None and not self._is_healthy(conn, created_at, returned_at):
+                self._discard(conn, "discard")
+                conn = None
+            if conn is None:
+                conn, _ = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._update_gauges()
+                self._cond.notify()
+            raise
+
+        DB_POOL_WAIT.observe(time.monotonic() - start)
+        DB_POOL_EVENTS.labels("checkout").inc()
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Devuelve una conexión al pool (o la cierra si está rota)"""
+        if not discard and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._discard(conn, "discard")
+            else:
+                created_at = self._created.get(id(conn), time.monotonic())
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._update_gauges()
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _, _ in self._idle:
+                self._discard(conn, "close")
+            self._idle = []
+            self._update_gauges()
+            self._cond.notify_all()
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+# Pools heredados de un fork: no se cierran (sus sockets son del padre), pero
+# se mantiene la referencia para que el recolector no los cierre tampoco
+_inherited_db_pools = []
+
+
+def get_db_pool():
+    """
+    Devuelve el pool de conexiones del proceso, creándolo la primera vez.
+    Tras un fork (workers de gunicorn) el hijo crea su propio pool.
+    """
+    global _db_pool, _db_pool_pid
+    if _db_pool is None or _db_pool_pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is not None and _db_pool_pid != os.getpid():
+                _inherited_db_pools.append(_db_pool)
+                _db_pool = None
+            if _db_pool is None:
+                _db_pool_pid = os.getpid()
+                _db_pool = ConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    DB_POOL_TIMEOUT,
+                    DB_POOL_MAX_LIFETIME,
+                    DB_POOL_CHECK_IDLE,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    connect_timeout=DB_CONNECT_TIMEOUT,
+                )
+    return _db_pool
+
+
+def close_db_pool():
+    """Cierra todas las conexiones del pool (se recreará bajo demanda)"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.closeall()
+        _db_pool = None
+
+
+@contextmanager
+def get_db():
+    """
+    Presta una conexión del pool durante el bloque `with`.
+    Al salir se hace rollback de lo no confirmado y se devuelve al pool.
+    """
+    with timed("db.checkout"):
+        pool = get_db_pool()
+        conn = pool.getconn()
+    try:
+        yield conn
+    except psycopg2.errors.QueryCanceled:
+        # statement_timeout (subclase de OperationalError): la conexión sigue
+        # sana; putconn hace rollback y solo la descarta si está cerrada
+        pool.putconn(conn)
+        raise
+    except (psycopg2.InterfaceError, psycopg2.OperationalError):
+        # Error de conexión: no devolverla al pool
+        pool.putconn(conn, discard=True)
+        raise
+    except BaseException:
+        pool.putconn(conn)
+        raise
+    else:
+        pool.putconn(conn)
+
+
+REDIS_POOL_EVENTS = Counter(
+    "redis_pool_events_total",
+    "Eventos del pool de conexiones Redis (hit, miss, wait)",
+    ["event"],
+    registry=metrics_registry,
+)
+REDIS_POOL_WAIT = Histogram(
+    "redis_pool_checkout_wait_seconds",
+    "Tiempo de espera para obtener una conexión Redis del pool",
+    registry=metrics_registry,
+)
+
+
+class InstrumentedRedisPool(redis.BlockingConnectionPool):
+    """
+    Pool Redis compartido que cuenta reutilizaciones (hit), conexiones
+    nuevas (miss) y esperas por falta de conexiones libres (wait).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def make_connection(self):
+        self._local.created = True
+        return super().make_connection()
+
+    def get_connection(self, command_name, *keys, **options):
+        self._local.created = False
+        start = time.monotonic()
+        must_wait = self.pool.empty()
+        connection = super().get_connection(command_name, *keys, **options)
+        REDIS_POOL_WAIT.observe(time.monotonic() - start)
+        if must_wait:
+            REDIS_POOL_EVENTS.labels("wait").inc()
+        REDIS_POOL_EVENTS.labels("miss" if self._local.created else "hit").inc()
+        return connection
+
+
+_redis_clients = {}  # binary -> cliente
+_redis_lock = threading.Lock()
+
+
+def get_redis(binary=False):
+    """
+    Devuelve el cliente Redis del proceso (un pool compartido por tipo).
+    Con binary=True las respuestas llegan como bytes sin decodificar: es el
+    que se usa para los valores serializados de la caché.
+    """
+    if not REDIS_HOST or REDIS_PORT == 0:
+        return None
+    client = _redis_clients.get(binary)
+    if client is None:
+        with _redis_lock:
+            client = _redis_clients.get(binary)
+            if client is None:
+                pool = InstrumentedRedisPool(
+                    host=REDIS_HOST,
+                    port=REDIS_PORT,
+                    decode_responses=not binary,
+                    max_connections=REDIS_POOL_MAX,
+                    timeout=REDIS_POOL_TIMEOUT,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                    socket_keepalive=True,
+                    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                )
+                client = redis.Redis(connection_pool=pool)
+                _redis_clients[binary] = client
+    return client
+
+
+def close_redis_pool():
+    """Cierra las conexiones Redis (los clientes se recrearán bajo demanda)"""
+    with _redis_lock:
+        for client in _redis_clients.values():
+            try:
+                client.connection_pool.disconnect()
+            except Exception:
+                pass
+        _redis_clients.clear()
+
+
+_minio_client = None
+_minio_pid = None
+_minio_lock = threading.Lock()
+
+
+def get_minio():
+    """
+    Devuelve el cliente MinIO del proceso. Comparte un pool de conexiones
+    HTTP keep-alive en lugar de abrir una conexión nueva por petición.
+    """
+    global _minio_client, _minio_pid
+    if _minio_pid != os.getpid():
+        with _minio_lock:
+            if _minio_pid != os.getpid():
+                _minio_client = _make_minio_client(
+                    MINIO_HTTP_POOL_SIZE,
+                    urllib3.Timeout(
+                        connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT
+                    ),
+                    urllib3.Retry(
+                        total=3,
+                        backoff_factor=0.2,
+                        status_forcelist=[500, 502, 503, 504],
+                    ),
+                )
+                _minio_pid = os.getpid()
+    return _minio_client
+
+
+def _make_minio_client(maxsize, timeout, retries):
+    http_client = urllib3.PoolManager(maxsize=maxsize, timeout=timeout, retries=retries)
+    return Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_USER,
+        secret_key=MINIO_PASSWORD,
+        secure=False,
+        http_client=http_client,
+    )
+
+
+_minio_health_client = None
+_minio_health_pid = None
+
+
+def get_minio_health():
+    """
+    Cliente MinIO solo para el health check: timeouts de HEALTH_CHECK_TIMEOUT
+    y sin reintentos, para que un MinIO colgado no retenga el hilo del
+    check durante minutos (el cliente normal lee hasta 60 s y reintenta).
+    """
+    global _minio_health_client, _minio_health_pid
+    if _minio_health_pid != os.getpid():
+        with _minio_lock:
+            if _minio_health_pid != os.getpid():
+                _minio_health_client = _make_minio_client(
+                    1,
+                    urllib3.Timeout(
+                        connect=HEALTH_CHECK_TIMEOUT, read=HEALTH_CHECK_TIMEOUT
+                    ),
+                    False,
+                )
+                _minio_health_pid = os.getpid()
+    return _minio_health_client
+
+
+_minio_signer = None
+
+
+def get_minio_signer():
+    """
+    Cliente MinIO configurado con el endpoint público, solo para firmar URLs
+    que usará el navegador. Con la región fijada no hace ninguna petición.
+    """
+    global _minio_signer
+    if _minio_signer is None:
+        _minio_signer = Minio(
+            MINIO_PUBLIC_ENDPOINT,
+            access_key=MINIO_USER,
+            secret_key=MINIO_PASSWORD,
+            secure=False,
+            region=MINIO_REGION,
+        )
+    return _minio_signer
+
+
+MINIO_UPLOAD_DURATION = Histogram(
+    "minio_upload_duration_seconds",
+    "Duración de las subidas de imágenes a MinIO",
+    ["mode"],
+    registry=metrics_registry,
+)
+MINIO_UPLOAD_BYTES = Counter(
+    "minio_upload_bytes_total",
+    "Bytes subidos a MinIO",
+    ["mode"],
+    registry=metrics_registry,
+)
+MINIO_UPLOAD_FAILURES = Counter(
+    "minio_upload_failures_total",
+    "Subidas a MinIO fallidas",
+    ["mode"],
+    registry=metrics_registry,
+)
+
+_upload_executor = None
+_upload_executor_pid = None
+
+
+def _get_upload_executor():
+    global _upload_executor, _upload_executor_pid
+    if _upload_executor_pid != os.getpid():
+        _upload_executor = ThreadPoolExecutor(
+            max_workers=UPLOAD_WORKERS, thread_name_prefix="minio-upload"
+        )
+        _upload_executor_pid = os.getpid()
+    return _upload_executor
+
+
+def stream_size(stream):
+    """Bytes que quedan por leer en un stream con seek (sin leerlo)"""
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell() - position
+    stream.seek(position)
+    return size
+
+
+@timed("minio.upload")
+def upload_image(object_name, stream, length, content_type, mode="sync"):
+    """
+    Sube una imagen a MinIO en streaming. Con la longitud conocida se
+    hace un único PUT (o multipart solo si es muy grande) sin bufferizar.
+    """
+    start = time.monotonic()
+    try:
+        get_minio().put_object(
+            BUCKET_NAME, object_name, stream, length=length, content_type=content_type
+        )
+    except Exception:
+        MINIO_UPLOAD_FAILURES.labels(mode).inc()
+        raise
+    MINIO_UPLOAD_DURATION.labels(mode).observe(time.monotonic() - start)
+    MINIO_UPLOAD_BYTES.labels(mode).inc(length)
+
+
+def create_user(name, email, image_url):
+    """Inserta un usuario y lo añade a la caché; devuelve la fila serializada"""
+    with get_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        with timed("db.query"):
+            cur.execute(
+                "INSERT INTO users (name, email, image_url) VALUES (%s, %s, %s) "
+                "RETURNING *",
+                (name, email, image_url),
+            )
+            row = cur.fetchone()
+            conn.commit()
+        new_user = add_display_urls(serialize_user(row))
+        cur.close()
+
+    # Añadir el nuevo usuario a las páginas cacheadas en las que aparece
+    write_through_users_cache(added=new_user)
+    return new_user
+
+
+def image_in_use(object_name):
+    """Indica si algún usuario tiene ya asignado el objeto"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        with timed("db.query"):
+            cur.execute("SELECT 1 FROM users WHERE image_url = %s", (object_name,))
+            row = cur.fetchone()
+        cur.close()
+    return row is not None
+
+
+USERS_IMPORTED = Counter(
+    "users_import_rows_total",
+    "Filas procesadas por la importación masiva, por resultado",
+    ["result"],
+    registry=metrics_registry,
+)
+
+IMPORT_FORMATS = {"csv", "ndjson"}
+IMPORT_CONFLICT_POLICIES = {"skip", "update"}
+
+
+def import_format(filename=None, content_type=None):
+    """Deduce el formato de importación de la extensión o del Content-Type"""
+    ext = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if ext == "csv" or content_type == "text/csv":
+        return "csv"
+    if ext in ("ndjson", "jsonl") or content_type in (
+        "application/x-ndjson",
+        "application/jsonl",
+    ):
+        return "ndjson"
+    return None
+
+
+def _ndjson_records(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {}
+
+
+def _import_field(record, field):
+    """Valor de texto de un campo; None si falta y False si no es texto"""
+    value = record.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        return False
+    return value.strip() or None
+
+
+def parse_import_rows(lines, fmt):
+    """
+    Genera tuplas (name, email, image_url) a partir de líneas de texto en
+    CSV con cabecera o NDJSON. Las filas no válidas se devuelven como None;
+    image_url solo se acepta si es un nombre de objeto generado por la app.
+    """
+    if fmt == "csv":
+        records = csv.DictReader(lines)
+    elif fmt == "ndjson":
+        records = _ndjson_records(lines)
+    else:
+        raise ValueError(f"Formato de importación no soportado: {fmt}")
+
+    for record in records:
+        name = _import_field(record, "name")
+        email = _import_field(record, "email")
+        image_url = _import_field(record, "image_url")
+        if not name or not email or len(name) > 100 or len(email) > 100:
+            yield None
+        elif image_url is False or (image_url and not OBJECT_NAME_RE.match(image_url)):
+            yield None
+        else:
+            yield name, email, image_url
+
+
+def _import_batch(rows, on_conflict="skip"):
+    """
+    Carga un lote con COPY en una tabla temporal y lo vuelca a `users` con
+    un único INSERT ... ON CONFLICT (email). Devuelve (insertado, created_at)
+    por cada fila insertada o actualizada. Una imagen que ya pertenece a otro
+    email (en la tabla o en el propio lote) se descarta: al borrar ese
+    usuario se borraría la imagen ajena.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    if on_conflict == "update":
+        conflict = (
+            "DO UPDATE SET name = EXCLUDED.name, "
+            "image_url = COALESCE(EXCLUDED.image_url, users.image_url)"
+        )
+    else:
+        conflict = "DO NOTHING"
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "CREATE TEMP TABLE users_import (name VARCHAR(100), "
+            "email VARCHAR(100), image_url VARCHAR(500)) ON COMMIT DROP"
+        )
+        cur.copy_expert(
+            "COPY users_import (name, email, image_url) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        # DISTINCT ON: un mismo email repetido en el lote no puede
+        # actualizarse dos veces en la misma sentencia
+        cur.execute(
+            "INSERT INTO users (name, email, image_url) "
+            "SELECT DISTINCT ON (i.email) i.name, i.email, "
+            "CASE WHEN NOT EXISTS (SELECT 1 FROM users u "
+            "WHERE u.image_url = i.image_url AND u.email <> i.email) "
+            "AND NOT EXISTS (SELECT 1 FROM users_import o "
+            "WHERE o.image_url = i.image_url AND o.email <> i.email) "
+            "THEN i.image_url END "
+            "FROM users_import i ORDER BY i.email "
+            f"ON CONFLICT (email) {conflict} "
+            "RETURNING (xmax = 0), created_at"
+        )
+        results = cur.fetchall()
+        conn.commit()
+        cur.close()
+    return results
+
+
+def import_users(stream, fmt, on_conflict="skip", batch_size=None):
+    """
+    Importa usuarios desde un stream binario (CSV o NDJSON) en lotes de
+    IMPORT_BATCH_SIZE filas. La caché se invalida una vez por lote.
+    Devuelve un resumen con los contadores y las filas por segundo.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    start = time.monotonic()
+    stats = {"received": 0, "inserted": 0, "updated": 0, "skipped": 0, "invalid": 0}
+    batch = []
+
+    def flush():
+        results = _import_batch(batch, on_conflict)
+        inserted = sum(1 for is_new, _ in results if is_new)
+        counts = {
+            "inserted": inserted,
+            "updated": len(results) - inserted,
+            "skipped": len(batch) - len(results),
+        }
+        for result, count in counts.items():
+            stats[result] += count
+            USERS_IMPORTED.labels(result).inc(count)
+        if results:
+            created = [created_at for _, created_at in results]
+            invalidate_users_cache(None if None in created else min(created))
+        batch.clear()
+
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    for row in parse_import_rows(lines, fmt):
+        stats["received"] += 1
+        if row is None:
+            stats["invalid"] += 1
+            USERS_IMPORTED.labels("invalid").inc()
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.monotonic() - start
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["received"] / elapsed, 1) if elapsed else 0
+    return stats
+
+
+THUMBNAIL_DURATION = Histogram(
+    "thumbnail_generation_duration_seconds",
+    "Duración de la generación de miniaturas",
+    registry=metrics_registry,
+)
+THUMBNAIL_FAILURES = Counter(
+    "thumbnail_generation_failures_total",
+    "Miniaturas que no se han podido generar",
+    registry=metrics_registry,
+)
+
+_thumbnail_executor = None
+_thumbnail_executor_pid = None
+
+
+def _get_thumbnail_executor():
+    global _thumbnail_executor, _thumbnail_executor_pid
+    if _thumbnail_executor_pid != os.getpid():
+        _thumbnail_executor = ThreadPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail"
+        )
+        _thumbnail_executor_pid = os.getpid()
+    return _thumbnail_executor
+
+
+def thumbnail_key(object_name):
+    """Clave derivada de la miniatura de una imagen (incluye el tamaño)"""
+    return f"thumbnails/{THUMBNAIL_SIZE}/{os.path.splitext(object_name)[0]}.jpg"
+
+
+@timed("minio.thumbnail")
+def generate_thumbnail(object_name):
+    """Genera la miniatura JPEG de una imagen de MinIO y la guarda junto a ella"""
+    start = time.monotonic()
+    client = get_minio()
+    response = client.get_object(BUCKET_NAME, object_name)
+    try:
+        data = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+    with Image.open(BytesIO(data)) as image:
+        # En JPEG, draft() decodifica directamente a una escala reducida
+        image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        # Solo se ha leído la cabecera: se rechaza antes de decodificar
+        width, height = image.size
+        if width * height > THUMBNAIL_MAX_PIXELS:
+            raise ValueError(f"Imagen demasiado grande ({width}x{height} px)")
+        thumbnail = ImageOps.exif_transpose(image)
+        thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if thumbnail.mode != "RGB":
+            thumbnail = thumbnail.convert("RGB")
+        output = BytesIO()
+        thumbnail.save(
+            output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True
+        )
+
+    length = output.tell()
+    output.seek(0)
+    key = thumbnail_key(object_name)
+    client.put_object(
+        BUCKET_NAME, key, output, length=length, content_type="image/jpeg"
+    )
+    THUMBNAIL_DURATION.observe(time.monotonic() - start)
+    return key
+
+
+def _generate_thumbnail_safe(object_name):
+    try:
+        generate_thumbnail(object_name)
+    except Exception as e:
+        THUMBNAIL_FAILURES.inc()
+        logger.warning(
+            "Error generando miniatura: %s", e, extra={"object_name": object_name}
+        )
+
+
+def schedule_thumbnail(object_name):
+    """Encola la generación de la miniatura en el pool de segundo plano"""
+    _get_thumbnail_executor().submit(_generate_thumbnail_safe, object_name)
+
+
+def _upload_in_background(object_name, spool, length, content_type):
+    """Sube una imagen fuera de la petición; si falla, se desvincula del usuario"""
+    try:
+        with spool:
+            upload_image(object_name, spool, length, content_type, mode="async")
+        schedule_thumbnail(object_name)
+    except Exception as e:
+        logger.error(
+            "Error subiendo imagen en segundo plano: %s",
+            e,
+            extra={"object_name": object_name},
+        )
+        try:
+            with get_db() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE users SET image_url = NULL WHERE image_url = %s",
+                    (object_name,),
+                )
+                conn.commit()
+                cur.close()
+            invalidate_users_cache()
+        except Exception:
+            pass
+
+
+MINIO_DELETE_BATCH = 1000  # máximo de objetos por petición DeleteObjects de S3
+# Cola de objetos cuyo borrado ha fallado: lista en Redis, compartida por
+# todos los pods; sin Redis, cola en memoria del proceso
+DELETE_RETRY_KEY = "minio:delete_retry"
+# Subidas prefirmadas sin confirmar: ZSET objeto -> caducidad del token
+PENDING_UPLOADS_KEY = "minio:pending_uploads"
+_local_delete_queue = deque()
+_delete_retrier_pid = None
+_delete_retrier_lock = threading.Lock()
+
+MINIO_DELETED_OBJECTS = Counter(
+    "minio_deleted_objects_total",
+    "Objetos de MinIO borrados (removed) o encolados para reintentar (queued)",
+    ["result"],
+    registry=metrics_registry,
+)
+
+
+def user_object_names(image_urls):
+    """Objetos de MinIO de unos usuarios: la imagen original y su miniatura"""
+    names = []
+    for image_url in image_urls:
+        if image_url:
+            names.extend((image_url, thumbnail_key(image_url)))
+    return names
+
+
+@timed("minio.remove")
+def remove_objects(names):
+    """
+    Borra objetos con peticiones DeleteObjects de hasta 1000 objetos.
+    Devuelve los nombres que no se han podido borrar.
+    """
+    if not names:
+        return []
+    client = get_minio()
+    failed = []
+    for i in range(0, len(names), MINIO_DELETE_BATCH):
+        batch = names[i : i + MINIO_DELETE_BATCH]
+        try:
+            # remove_objects es perezoso: hay que recorrer los errores
+            errors = client.remove_objects(
+                BUCKET_NAME, [DeleteObject(name) for name in batch]
+            )
+            failed.extend(error.name for error in errors)
+        except Exception as e:
+            logger.warning(
+                "Error borrando objetos: %s", e, extra={"objects": len(batch)}
+            )
+            failed.extend(batch)
+    MINIO_DELETED_OBJECTS.labels("removed").inc(len(names) - len(failed))
+    return failed
+
+
+def queue_object_deletions(names):
+    """Encola objetos para reintentar su borrado más tarde"""
+    if not names:
+        return
+    MINIO_DELETED_OBJECTS.labels("queued").inc(len(names))
+    try:
+        r = get_redis()
+        if r:
+            r.rpush(DELETE_RETRY_KEY, *names)
+            return
+    except Exception:
+        pass
+    _local_delete_queue.extend(names)
+
+
+def retry_object_deletions(limit=MINIO_DELETE_BATCH):
+    """Reintenta hasta `limit` borrados pendientes; devuelve cuántos se borran"""
+    names = []
+    while _local_delete_queue and len(names) < limit:
+        names.append(_local_delete_queue.popleft())
+    try:
+        r = get_redis()
+        if r and len(names) < limit:
+            # LRANGE + LTRIM en una transacción: cada pod toma elementos distintos
+            pipe = r.pipeline()
+            pipe.lrange(DELETE_RETRY_KEY, 0, limit - len(names) - 1)
+            pipe.ltrim(DELETE_RETRY_KEY, limit - len(names), -1)
+            names.extend(pipe.execute()[0])
+    except Exception:
+        pass
+    failed = remove_objects(names)
+    queue_object_deletions(failed)
+    return len(names) - len(failed)
+
+
+def upload_token(object_name, expires_at):
+    """Token firmado que liga un objeto a la URL prefirmada que se emitió"""
+    message = f"{object_name}:{expires_at}".encode()
+    digest = hmac.new(UPLOAD_TOKEN_SECRET.encode(), message, "sha256").hexdigest()
+    return f"{expires_at}.{digest}"
+
+
+def verify_upload_token(object_name, token):
+    """Comprueba la firma y la caducidad de un token de subida"""
+    expires_at, _, _ = (token or "").partition(".")
+    if not expires_at.isdigit() or int(expires_at) < time.time():
+        return False
+    return hmac.compare_digest(upload_token(object_name, int(expires_at)), token)
+
+
+def track_pending_upload(object_name, expires_at):
+    """Registra una subida prefirmada para borrarla si nunca se confirma"""
+    try:
+        r = get_redis()
+        if r:
+            r.zadd(PENDING_UPLOADS_KEY, {object_name: expires_at})
+    except Exception:
+        pass
+
+
+def claim_pending_upload(object_name):
+    """
+    Reclama una subida pendiente: ZREM solo devuelve 1 a la primera
+    confirmación, así que el token no sirve dos veces ni dos peticiones
+    pueden asignar el mismo objeto. Devuelve None si Redis no está disponible.
+    """
+    try:
+        r = get_redis()
+        if r:
+            return r.zrem(PENDING_UPLOADS_KEY, object_name) == 1
+    except Exception:
+        pass
+    return None
+
+
+def sweep_pending_uploads(limit=MINIO_DELETE_BATCH):
+    """
+    Borra las subidas prefirmadas cuyo token ha caducado sin confirmarse.
+    Se conservan las que ya tienen usuario (confirmadas en el último momento).
+    Devuelve cuántos objetos se han borrado.
+    """
+    r = get_redis()
+    if not r:
+        return 0
+    # Un minuto de margen para las confirmaciones que estén en curso
+    cutoff = time.time() - 60
+    expired = r.zrangebyscore(PENDING_UPLOADS_KEY, "-inf", cutoff, start=0, num=limit)
+    if not expired:
+        return 0
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        with timed("db.query"):
+            cur.execute(
+                "SELECT image_url FROM users WHERE image_url = ANY(%s)", (expired,)
+            )
+            referenced = {row[0] for row in cur.fetchall()}
+        cur.close()
+    names = user_object_names(name for name in expired if name not in referenced)
+    failed = remove_objects(names)
+    queue_object_deletions(failed)
+    # Si otro pod barre a la vez, el borrado se repite sin efecto
+    r.zrem(PENDING_UPLOADS_KEY, *expired)
+    return len(names) - len(failed)
+
+
+def _deletion_retrier():
+    while True:
+        time.sleep(DELETE_RETRY_INTERVAL)
+        try:
+            retry_object_deletions()
+            sweep_pending_uploads()
+        except Exception as e:
+            logger.warning("Error reintentando borrados: %s", e)
+
+
+def start_deletion_retrier():
+    """Arranca (una vez por proceso) el hilo que reintenta borrados de MinIO"""
+    global _delete_retrier_pid
+    with _delete_retrier_lock:
+        if _delete_retrier_pid == os.getpid():
+            return
+        _delete_retrier_pid = os.getpid()
+        threading.Thread(
+            target=_deletion_retrier, name="minio-delete-retry", daemon=True
+        ).start()
+
+
+def delete_users(ids=None, id_min=None, id_max=None):
+    """
+    Borra usuarios por lista de ids o por rango [id_min, id_max] con una
+    sola sentencia, invalida la caché una vez y borra sus objetos en lote.
+    Los objetos que no se pueden borrar quedan en la cola de reintentos.
+    """
+    with get_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        with timed("db.query"):
+            if ids is not None:
+                cur.execute(
+                    "DELETE FROM users WHERE id = ANY(%s) "
+                    "RETURNING id, image_url, created_at",
+                    (list(ids),),
+                )
+            else:
+                cur.execute(
+                    "DELETE FROM users WHERE id BETWEEN %s AND %s "
+                    "RETURNING id, image_url, created_at",
+                    (id_min, id_max),
+                )
+            deleted = cur.fetchall()
+            conn.commit()
+        cur.close()
+
+    names, failed = [], []
+    if deleted:
+        created = [user["created_at"] for user in deleted]
+        invalidate_users_cache(None if None in created else min(created))
+        names = user_object_names(user["image_url"] for user in deleted)
+        failed = remove_objects(names)
+        queue_object_deletions(failed)
+
+    return {
+        "deleted": len(deleted),
+        "objects_removed": len(names) - len(failed),
+        "objects_queued": len(failed),
+    }
+
+
+def parse_page_size(value):
+    """Convierte el parámetro `limit` en un tamaño de página válido"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return USERS_PAGE_SIZE
+    return max(1, min(limit, USERS_PAGE_SIZE_MAX))
+
+
+def encode_cursor(created_at, user_id):
+    """Genera el cursor opaco de paginación a partir del último usuario de la página"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Devuelve (created_at, id) de un cursor; lanza ValueError si no es válido"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(user_id)
+    except Exception:
+        raise ValueError("Cursor de paginación no válido")
+
+
+def _cursor_score(created_at):
+    """Posición de un instante en el índice de páginas (segundos epoch)"""
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return created_at.timestamp()
+
+
+def users_page_key(cursor, limit):
+    return f"{USERS_CACHE_KEY}:page:{USERS_PAGE_FORMAT}:{limit}:{cursor or 'first'}"
+
+
+# Formato de los valores: CACHE_MAGIC + etiqueta del serializador + marca de
+# compresión + datos. Sin CACHE_MAGIC el valor es JSON plano.
+CACHE_MAGIC = b"\x00"
+CACHE_CODECS = {
+    # nombre: (etiqueta, dumps, loads)
+    "json": (
+        b"j",
+        lambda value: json.dumps(value, separators=(",", ":")).encode(),
+        json.loads,
+    ),
+}
+if orjson:
+    CACHE_CODECS["orjson"] = (b"o", orjson.dumps, orjson.loads)
+if msgpack:
+    CACHE_CODECS["msgpack"] = (
+        b"m",
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+    )
+_CACHE_DECODERS = {tag: loads for tag, _, loads in CACHE_CODECS.values()}
+
+if CACHE_SERIALIZER not in CACHE_CODECS:
+    logger.warning("Serializador %s no disponible, se usa json", CACHE_SERIALIZER)
+    CACHE_SERIALIZER = "json"
+
+
+@timed("cache.encode")
+def encode_cache_value(value, serializer=None):
+    """Serializa (y comprime si es grande) un valor para guardarlo en Redis"""
+    tag, dumps, _ = CACHE_CODECS[serializer or CACHE_SERIALIZER]
+    data = dumps(value)
+    if CACHE_COMPRESS_MIN and len(data) >= CACHE_COMPRESS_MIN:
+        return CACHE_MAGIC + tag + b"z" + zlib.compress(data, CACHE_COMPRESS_LEVEL)
+    return CACHE_MAGIC + tag + b"-" + data
+
+
+@timed("cache.decode")
+def decode_cache_value(data):
+    """Inverso de encode_cache_value; acepta también JSON plano"""
+    if isinstance(data, str) or data[:1] != CACHE_MAGIC:
+        return json.loads(data)
+    loads = _CACHE_DECODERS.get(data[1:2])
+    if loads is None:
+        raise ValueError("Valor de caché con un serializador no disponible")
+    payload = data[3:]
+    if data[2:3] == b"z":
+        payload = zlib.decompress(payload)
+    return loads(payload)
+
+
+def _page_score(cursor):
+    """Posición de una página en el índice: la de su cursor (+inf la primera)"""
+    if cursor is None:
+        return float("inf")
+    return _cursor_score(decode_cursor(cursor)[0])
+
+
+USERS_CACHE_REQUESTS = Counter(
+    "users_cache_requests_total",
+    "Consultas a la caché de usuarios por nivel (fragment, l1, redis) y resultado",
+    ["tier", "result"],
+    registry=metrics_registry,
+)
+
+
+class LRUCache:
+    """
+    Caché en memoria del proceso, acotada en número de entradas (LRU) y
+    con caducidad por TTL. Cada entrada guarda la posición (score) de su
+    página para poder invalidar por rangos igual que en Redis.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # clave -> (caduca_en, score, valor)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[2]
+
+    def set(self, key, value, score=float("inf")):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, score, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def evict_from(self, min_score):
+        """Elimina las entradas con score >= min_score"""
+        with self._lock:
+            for key in [k for k, item in self._data.items() if item[1] >= min_score]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# La L1 solo se usa mientras este proceso está suscrito al canal de
+# invalidación; si se pierde la suscripción se vacía y se desactiva. Cada
+# entrada es (versión de los datos, página): hasta que llega el mensaje de
+# invalidación, la versión de Redis delata las páginas antiguas.
+l1_cache = LRUCache(L1_CACHE_SIZE, min(L1_CACHE_TTL, CACHE_SOFT_TTL))
+_l1_active = threading.Event()
+_subscriber_pid = None
+_subscriber_lock = threading.Lock()
+
+
+def apply_cache_invalidation(data):
+    """Aplica a la L1 un mensaje del canal de invalidación"""
+    l1_cache.evict_from(float(data))
+
+
+def _cache_invalidation_listener():
+    while True:
+        try:
+            # Conexión dedicada y sin timeout de lectura: el listen() bloquea
+            client = redis.Redis(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                decode_responses=True,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                socket_keepalive=True,
+            )
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            l1_cache.clear()
+            _l1_active.set()
+            for message in pubsub.listen():
+                if message["type"] == "message":
+                    apply_cache_invalidation(message["data"])
+        except Exception:
+            pass
+        # Sin suscripción podríamos perder invalidaciones de otros pods
+        _l1_active.clear()
+        l1_cache.clear()
+        time.sleep(1)
+
+
+def start_cache_subscriber():
+    """Arranca (una vez por proceso) el hilo que escucha las invalidaciones"""
+    global _subscriber_pid
+    if not REDIS_HOST or REDIS_PORT == 0 or L1_CACHE_SIZE <= 0:
+        return
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+        _subscriber_pid = os.getpid()
+        threading.Thread(
+            target=_cache_invalidation_listener,
+            name="cache-invalidation",
+            daemon=True,
+        ).start()
+
+
+@timed("redis.invalidate")
+def invalidate_users_cache(created_at=None):
+    """
+    Marca como obsoletas las páginas de la caché afectadas por un cambio.
+    Con keyset, un usuario con fecha `created_at` solo puede aparecer en
+    páginas cuyo cursor es posterior a esa fecha; sin fecha se invalida todo.
+    Solo se borra la marca de frescura: el contenido se sigue sirviendo
+    mientras un único worker lo recalcula. La invalidación se publica para
+    que todos los pods limpien su caché L1.
+    """
+    try:
+        min_score = float("-inf") if created_at is None else _cursor_score(created_at)
+        l1_cache.evict_from(min_score)
+        r = get_redis()
+        if not r:
+            return
+        keys = r.zrangebyscore(USERS_PAGES_KEY, min_score, "+inf")
+        pipe = r.pipeline()
+        if keys:
+            pipe.delete(*[f"{key}:fresh" for key in keys])
+        bump_users_version(pipe)
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, repr(min_score))
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def bump_users_version(pipe):
+    """Añade a un pipeline el cambio de versión de los datos de usuarios"""
+    pipe.hincrby(USERS_VERSION_KEY, "n", 1)
+    pipe.hset(USERS_VERSION_KEY, "ts", int(time.time() * 1000))
+
+
+@timed("redis.version")
+def get_users_version():
+    """
+    Devuelve (n, ts) con la versión actual de los datos, o None sin Redis.
+    Si la clave no existe (Redis vacío o reiniciado) se crea con la hora
+    actual, de modo que nunca coincide con un ETag emitido antes.
+    """
+    try:
+        r = get_redis()
+        if not r:
+            return None
+        n, ts = r.hmget(USERS_VERSION_KEY, "n", "ts")
+        if n is None or ts is None:
+            pipe = r.pipeline()
+            pipe.hsetnx(USERS_VERSION_KEY, "n", 0)
+            pipe.hsetnx(USERS_VERSION_KEY, "ts", int(time.time() * 1000))
+            pipe.hmget(USERS_VERSION_KEY, "n", "ts")
+            n, ts = pipe.execute()[-1]
+        return int(n), int(ts)
+    except Exception:
+        return None
+
+
+@timed("redis.get_page")
+def get_users_from_cache(cursor=None, limit=USERS_PAGE_SIZE, version=None):
+    """
+    Obtiene una página de usuarios desde caché Redis con protección
+    contra estampidas (single-flight con lock en Redis):
+    - Página fresca: se devuelve.
+    - Página obsoleta: quien consigue el lock recibe (None, False) y la
+      recalcula; el resto recibe la copia obsoleta con CACHE_STALE en
+      lugar de True (no corresponde a la versión actual de los datos).
+    - Sin página: quien consigue el lock la recalcula; el resto espera
+      hasta CACHE_LOCK_WAIT segundos a que aparezca.
+    Delante de Redis hay una caché L1 en memoria con las páginas frescas;
+    con `version` (la de get_users_version) solo vale la página guardada
+    con esa misma versión.
+    """
+    key = users_page_key(cursor, limit)
+    if _l1_active.is_set():
+        entry = l1_cache.get(key)
+        if entry is not None and version in (None, entry[0]):
+            USERS_CACHE_REQUESTS.labels("l1", "hit").inc()
+            return entry[1], True
+        USERS_CACHE_REQUESTS.labels("l1", "miss").inc()
+
+    try:
+        r = get_redis(binary=True)
+        if not r:
+            return None, False
+        cached_data, fresh = r.mget(key, f"{key}:fresh")
+        if cached_data and fresh:
+            USERS_CACHE_REQUESTS.labels("redis", "hit").inc()
+            page = decode_cache_value(cached_data)
+            if _l1_active.is_set():
+                l1_cache.set(key, (version, page), _page_score(cursor))
+            return page, True  # True = desde caché
+
+        got_lock = r.set(f"{key}:lock", INSTANCE_ID, ex=CACHE_LOCK_TTL, nx=True)
+        if got_lock:
+            USERS_CACHE_REQUESTS.labels("redis", "miss").inc()
+            return None, False
+        if cached_data:
+            USERS_CACHE_REQUESTS.labels("redis", "stale").inc()
+            return decode_cache_value(cached_data), CACHE_STALE
+
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            cached_data = r.get(key)
+            if cached_data:
+                return decode_cache_value(cached_data), True
+    except Exception:
+        pass
+    return None, False
+
+
+@timed("redis.save_page")
+def save_users_to_cache(page, cursor=None, limit=USERS_PAGE_SIZE, version=None):
+    """
+    Guarda una página de usuarios en caché Redis, la registra en el índice
+    y libera el lock de recálculo. `version` es la versión de los datos
+    leída antes de consultar la página: si una escritura la ha cambiado
+    mientras tanto (y no ha encontrado esta página para parchearla), la
+    página se guarda sin marca :fresh, como copia obsoleta a recalcular.
+    """
+    try:
+        r = get_redis(binary=True)
+        if r:
+            key = users_page_key(cursor, limit)
+            score = _page_score(cursor)
+            with r.pipeline() as pipe:
+                for _ in range(3):
+                    try:
+                        fresh = True
+                        if version is not None:
+                            pipe.watch(USERS_VERSION_KEY)
+                            current = pipe.hmget(USERS_VERSION_KEY, "n", "ts")
+                            fresh = None not in current and (
+                                tuple(map(int, current)) == tuple(version)
+                            )
+                            pipe.multi()
+                        pipe.setex(key, CACHE_TTL, encode_cache_value(page))
+                        if fresh:
+                            pipe.setex(
+                                f"{key}:fresh", min(CACHE_SOFT_TTL, CACHE_TTL), 1
+                            )
+                        pipe.zadd(USERS_PAGES_KEY, {key: score})
+                        pipe.expire(USERS_PAGES_KEY, CACHE_TTL)
+                        pipe.delete(f"{key}:lock")
+                        pipe.execute()
+                        break
+                    except redis.WatchError:
+                        continue  # La versión ha cambiado: se vuelve a comparar
+                else:
+                    return
+            if fresh and _l1_active.is_set():
+                l1_cache.set(key, (version, page), score)
+    except Exception:
+        pass
+
+
+def _user_position(user):
+    """Posición keyset (created_at, id) de un usuario; NULL va primero como en SQL"""
+    created_at = user.get("created_at")
+    if created_at is None:
+        return datetime.max, user["id"]
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return created_at, user["id"]
+
+
+def patch_users_page(page, limit, cursor=None, added=None, deleted_id=None):
+    """
+    Aplica un alta o una baja a una página cacheada sin consultar la BD.
+    Devuelve False si el cambio no afecta a la página.
+    """
+    users_list = page["users"]
+    if deleted_id is not None:
+        remaining = [user for user in users_list if user["id"] != deleted_id]
+        if len(remaining) == len(users_list):
+            return False
+        # La página queda más corta, pero sigue sin saltarse ninguna fila
+        page["users"] = remaining
+        return True
+
+    position = _user_position(added)
+    if cursor and position >= decode_cursor(cursor):
+        return False
+    if page["next_cursor"] and position <= decode_cursor(page["next_cursor"]):
+        return False
+    index = next(
+        (i for i, user in enumerate(users_list) if _user_position(user) < position),
+        len(users_list),
+    )
+    users_list.insert(index, added)
+    if len(users_list) > limit:
+        # La última fila pasa a la página siguiente, que empieza tras el nuevo cursor
+        users_list.pop()
+        last = users_list[-1]
+        page["next_cursor"] = encode_cursor(last["created_at"], last["id"])
+    return True
+
+
+def _patch_cached_page(r, key, added=None, deleted_id=None):
+    """
+    Actualiza una página en Redis con WATCH/MULTI (optimista). Solo se
+    parchean páginas frescas: una página invalidada (p. ej. por una
+    importación) puede no contener otras filas y debe recalcularse.
+    """
+    _, _, limit, cursor = key.rsplit(":", 3)
+    cursor = None if cursor == "first" else cursor
+    with r.pipeline() as pipe:
+        for _ in range(3):
+            try:
+                pipe.watch(key, f"{key}:fresh")
+                cached_data, fresh = pipe.mget(key, f"{key}:fresh")
+                if not cached_data or not fresh:
+                    return  # Ya ha caducado o está pendiente de recalcular
+                page = decode_cache_value(cached_data)
+                if not patch_users_page(page, int(limit), cursor, added, deleted_id):
+                    return
+                pipe.multi()
+                pipe.setex(key, CACHE_TTL, encode_cache_value(page))
+                pipe.setex(f"{key}:fresh", min(CACHE_SOFT_TTL, CACHE_TTL), 1)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+    # Demasiada contención: que la recalcule el próximo lector
+    r.delete(f"{key}:fresh")
+
+
+@timed("redis.write_through")
+def write_through_users_cache(added=None, deleted=None):
+    """
+    Actualiza incrementalmente las páginas cacheadas tras un alta (`added`,
+    fila devuelta por RETURNING) o una baja (`deleted`), en lugar de
+    invalidarlas. Solo se tocan las páginas cuyo cursor es posterior al
+    usuario, así que el coste no depende del tamaño de la tabla.
+    """
+    user = added or deleted
+    if not user.get("created_at"):
+        invalidate_users_cache()
+        return
+    min_score = _cursor_score(user["created_at"])
+    try:
+        l1_cache.evict_from(min_score)
+        r = get_redis()
+        if not r:
+            return
+        binary = get_redis(binary=True)
+        for key in r.zrangebyscore(USERS_PAGES_KEY, min_score, "+inf"):
+            _patch_cached_page(
+                binary, key, added=added, deleted_id=deleted["id"] if deleted else None
+            )
+        pipe = r.pipeline()
+        bump_users_version(pipe)
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, repr(min_score))
+        pipe.execute()
+    except Exception:
+        invalidate_users_cache(user["created_at"])
+
+
+def serialize_user(row):
+    """Convierte una fila de la BD en un diccionario serializable en JSON"""
+    user = dict(row)
+    if user.get("created_at"):
+        user["created_at"] = user["created_at"].isoformat()
+    return user
+
+
+def fetch_users_page(cursor=None, limit=USERS_PAGE_SIZE):
+    """
+    Consulta una página de usuarios con paginación keyset sobre
+    (created_at, id), apoyada en el índice idx_users_created_at_id.
+    """
+    with get_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        with timed("db.query"):
+            if cursor:
+                created_at, last_id = decode_cursor(cursor)
+                cur.execute(
+                    "SELECT * FROM users WHERE (created_at, id) < (%s, %s) "
+                    "ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (created_at, last_id, limit + 1),
+                )
+            else:
+                cur.execute(
+                    "SELECT * FROM users ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (limit + 1,),
+                )
+            rows = cur.fetchall()
+        cur.close()
 
-LB_HOST = os.getenv("LB_HOST", "dev-load-balancer")
-LB_PORT = int(os.getenv("LB_PORT", "80"))
+    return build_users_page(rows, limit)
 
-INSTANCE_ID = socket.gethostname()
-BUCKET_NAME = "user-images"
-CACHE_TTL = 300
-USERS_CACHE_KEY = "users_list"
 
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+def add_display_urls(user):
+    """
+    Añade al usuario las URLs de su imagen y su miniatura. Se calculan al
+    construir la página, así que se guardan en caché con ella y un acierto
+    no necesita recorrer las filas. La tabla muestra la miniatura; si aún no
+    existe, el navegador pasa a la URL de generación perezosa.
+    """
+    urls = {
+        "image_display_url": None,
+        "thumbnail_url": None,
+        "thumbnail_fallback_url": None,
+    }
+    if user.get("image_url"):
+        minio_url = f"http://{MINIO_PUBLIC_ENDPOINT}/{BUCKET_NAME}"
+        urls["image_display_url"] = f"{minio_url}/{user['image_url']}"
+        urls["thumbnail_url"] = f"{minio_url}/{thumbnail_key(user['image_url'])}"
+        # Sin contexto de petición: la app se sirve en la raíz
+        urls["thumbnail_fallback_url"] = app.url_map.bind("").build(
+            "user_thumbnail", {"object_name": user["image_url"]}
+        )
+    user.update(urls)
+    return user
 
 
-def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+def build_users_page(rows, limit):
+    """Construye la página a partir de las filas (se pide una de más)"""
+    # Convertir a lista de diccionarios normales para JSON
+    users_list = [add_display_urls(serialize_user(user)) for user in rows[:limit]]
 
+    # Se pide una fila de más para saber si existe página siguiente
+    next_cursor = None
+    if len(rows) > limit and users_list[-1].get("created_at"):
+        last = users_list[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
 
-def get_db():
-    return psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD
-    )
+    return {"users": users_list, "next_cursor": next_cursor}
 
 
-def get_redis():
-    if not REDIS_HOST or REDIS_PORT == 0:
-        return None
-    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+SEARCH_MATCHES = {"contains", "prefix"}
 
 
-def get_minio():
-    return Minio(
-        MINIO_ENDPOINT, access_key=MINIO_USER, secret_key=MINIO_PASSWORD, secure=False
-    )
+def normalize_search(q):
+    """Texto de búsqueda sin espacios sobrantes y en minúsculas"""
+    return " ".join((q or "").split()).lower()
 
 
-def invalidate_users_cache():
-    """Invalida la caché de usuarios"""
-    try:
-        r = get_redis()
-        if r:
-            r.delete(USERS_CACHE_KEY)
-    except Exception:
-        pass
+def search_pattern(q, match="contains"):
+    """Patrón LIKE para `q`, con %, _ y \\ escapados"""
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if match == "prefix" else f"%{escaped}%"
 
 
-def get_users_from_cache():
-    """Obtiene usuarios desde caché Redis"""
-    try:
-        r = get_redis()
-        if not r:
-            return None, False
-        cached_data = r.get(USERS_CACHE_KEY)
-        if cached_data:
-            return json.loads(cached_data), True  # True = desde caché
-    except Exception:
-        pass
-    return None, False
+def users_search_key(version, q, match, cursor, limit):
+    n, ts = version
+    digest = hashlib.sha1(f"{match}:{limit}:{cursor or ''}:{q}".encode()).hexdigest()
+    return f"{USERS_SEARCH_KEY}:{n}:{ts}:{digest}"
+
+
+def fetch_users_search(q, match="contains", cursor=None, limit=USERS_PAGE_SIZE):
+    """
+    Busca `q` en nombre y email sin distinguir mayúsculas. Los LIKE sobre
+    lower(name) y lower(email) usan los índices GIN de trigramas; el orden y
+    la paginación keyset son los mismos que en /users.
+    """
+    pattern = search_pattern(q, match)
+    conditions = ["(lower(name) LIKE %s OR lower(email) LIKE %s)"]
+    params = [pattern, pattern]
+    if cursor:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(decode_cursor(cursor))
+
+    with get_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        with timed("db.query"):
+            # Una búsqueda patológica no debe ocupar una conexión del pool
+            cur.execute(
+                "SET LOCAL statement_timeout = %s", (SEARCH_STATEMENT_TIMEOUT_MS,)
+            )
+            cur.execute(
+                f"SELECT * FROM users WHERE {' AND '.join(conditions)} "
+                "ORDER BY created_at DESC, id DESC LIMIT %s",
+                (*params, limit + 1),
+            )
+            rows = cur.fetchall()
+        cur.close()
+
+    return build_users_page(rows, limit)
+
+
+def search_users(q, match="contains", cursor=None, limit=USERS_PAGE_SIZE):
+    """
+    Página de resultados de búsqueda y si viene de caché. La clave incluye
+    la versión de los datos, así que cualquier escritura deja obsoletas las
+    búsquedas cacheadas; SEARCH_CACHE_TTL solo limita la memoria en Redis.
+    """
+    version = get_users_version()
+    r = get_redis(binary=True) if version else None
+    key = users_search_key(version, q, match, cursor, limit) if r else None
+    if r:
+        try:
+            cached = r.get(key)
+            if cached:
+                USERS_CACHE_REQUESTS.labels("search", "hit").inc()
+                return decode_cache_value(cached), True
+            USERS_CACHE_REQUESTS.labels("search", "miss").inc()
+        except Exception:
+            r = None
+
+    page = fetch_users_search(q, match, cursor, limit)
+    if r:
+        try:
+            r.setex(key, SEARCH_CACHE_TTL, encode_cache_value(page))
+        except Exception:
+            pass
+    return page, False
+
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def stream_users(fmt="ndjson", since_id=None):
+    """
+    Generador con todos los usuarios (por id ascendente) en NDJSON o como
+    array JSON. Usa un cursor con nombre (de servidor), así que en memoria
+    solo hay EXPORT_FETCH_SIZE filas a la vez sea cual sea el tamaño de la
+    tabla. El primer elemento se produce tras lanzar la consulta, de modo
+    que los errores de conexión aparecen antes de empezar a responder.
+    """
+    with get_db() as conn:
+        cur = conn.cursor(name="users_export", cursor_factory=RealDictCursor)
+        if since_id is not None:
+            cur.execute("SELECT * FROM users WHERE id > %s ORDER BY id", (since_id,))
+        else:
+            cur.execute("SELECT * FROM users ORDER BY id")
+        # Primer bloque antes del primer yield: así fallan aquí los errores
+        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+        yield "[" if fmt == "json" else ""
+
+        first = True
+        while rows:
+            # Un chunk de la respuesta por cada bloque de filas
+            items = [json.dumps(serialize_user(row)) for row in rows]
+            if fmt == "ndjson":
+                yield "\n".join(items) + "\n"
+            else:
+                yield ("" if first else ",\n") + ",\n".join(items)
+            first = False
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+
+        if fmt == "json":
+            yield "]\n"
+        cur.close()
 
 
-def save_users_to_cache(users_list):
-    """Guarda usuarios en caché Redis"""
+def _prefetched(first, generator):
+    """Devuelve `first` y después el resto del generador, cerrándolo al final"""
     try:
-        r = get_redis()
-        if r:
-            r.setex(USERS_CACHE_KEY, CACHE_TTL, json.dumps(users_list))
-    except Exception:
-        pass
+        yield first
+        yield from generator
+    finally:
+        generator.close()
 
 
 def check_postgres():
     try:
-        conn = get_db()
-        conn.close()
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
         return True
     except Exception:
         return False
@@ -121,7 +1993,7 @@ def check_redis():
 
 def check_minio():
     try:
-        client = get_minio()
+        client = get_minio_health()
         client.list_buckets()
         return True
     except Exception:
@@ -130,12 +2002,110 @@ def check_minio():
 
 def check_load_balancer():
     try:
-        response = requests.get(f"http://{LB_HOST}:{LB_PORT}/health", timeout=3)
+        response = requests.get(
+            f"http://{LB_HOST}:{LB_PORT}/health", timeout=HEALTH_CHECK_TIMEOUT
+        )
         return response.status_code == 200
     except Exception:
         return False
 
 
+HEALTH_CHECK_DURATION = Histogram(
+    "health_check_duration_seconds",
+    "Duración de cada health check de dependencias",
+    ["check"],
+    registry=metrics_registry,
+)
+
+_health_executor = None
+_health_executor_pid = None
+_health_futures = {}  # check -> futuro de su última ejecución
+_health_snapshot = None  # {"results": {...}, "checked_at": monotonic}
+_health_lock = threading.Lock()
+
+
+def _get_health_executor():
+    global _health_executor, _health_executor_pid
+    if _health_executor_pid != os.getpid():
+        _health_executor = ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix="health-check"
+        )
+        _health_executor_pid = os.getpid()
+        _health_futures.clear()
+    return _health_executor
+
+
+def _timed_check(name, check):
+    start = time.monotonic()
+    try:
+        return check()
+    finally:
+        HEALTH_CHECK_DURATION.labels(name).observe(time.monotonic() - start)
+
+
+def run_health_checks():
+    """
+    Ejecuta los checks de dependencias en paralelo. Un check que no
+    termina en HEALTH_CHECK_TIMEOUT segundos cuenta como fallido. El hilo
+    de un check colgado sigue ocupado: mientras no termine no se lanza
+    otro igual (se vuelve a esperar al mismo), así una dependencia caída
+    no agota los hilos del pool ni retrasa al resto de checks.
+    """
+    checks = {
+        "postgres": check_postgres,
+        "minio": check_minio,
+        "load_balancer": check_load_balancer,
+    }
+    if REDIS_HOST and REDIS_PORT:
+        checks["redis"] = check_redis
+
+    executor = _get_health_executor()
+    futures = {}
+    for name, check in checks.items():
+        future = _health_futures.get(name)
+        if future is None or future.done():
+            future = _health_futures[name] = executor.submit(_timed_check, name, check)
+        futures[name] = future
+    deadline = time.monotonic() + HEALTH_CHECK_TIMEOUT
+    results = {}
+    for name, future in futures.items():
+        try:
+            remaining = max(0, deadline - time.monotonic())
+            results[name] = bool(future.result(timeout=remaining))
+        except Exception:
+            results[name] = False
+    return results
+
+
+def get_health_snapshot():
+    """
+    Devuelve el resultado de los checks, recalculándolo como mucho cada
+    HEALTH_CACHE_TTL segundos. Mientras un hilo refresca, el resto usa la
+    instantánea anterior en lugar de lanzar sus propios checks.
+    """
+    global _health_snapshot
+    snapshot = _health_snapshot
+    if snapshot and time.monotonic() - snapshot["checked_at"] < HEALTH_CACHE_TTL:
+        return snapshot["results"]
+    if not _health_lock.acquire(blocking=snapshot is None):
+        return snapshot["results"]
+    try:
+        current = _health_snapshot
+        if current is not snapshot and current is not None:
+            return current["results"]
+        results = run_health_checks()
+        _health_snapshot = {"results": results, "checked_at": time.monotonic()}
+        return results
+    finally:
+        _health_lock.release()
+
+
+def invalidate_health_cache():
+    """Descarta la instantánea de health checks"""
+    global _health_snapshot
+    _health_snapshot = None
+
+
 @app.route("/health")
 def health():
     """
@@ -157,97 +2127,269 @@ def health_ready():
     Endpoint para Kubernetes readinessProbe.
     Verifica que los servicios críticos estén disponibles.
     """
+    return readiness_response(get_health_snapshot())
+
+
+# Inicialización de BD y bucket (init_app.run_init) en segundo plano: el
+# servidor acepta conexiones desde el arranque y /health/ready devuelve 503
+# hasta que termina. None = este proceso no la lanza (p. ej. en los tests).
+_init_state = None  # None, "running", "done" o "failed"
+_init_pid = None
+_init_lock = threading.Lock()
+
+
+def _run_background_init():
+    global _init_state
+    from init_app import run_init
+
+    try:
+        # Sin límite de reintentos: el pod sigue sin estar listo mientras tanto
+        run_init(max_retries=0)
+        _init_state = "done"
+    except Exception:
+        _init_state = "failed"
+
+
+def start_background_init():
+    """Lanza (una vez por proceso) la inicialización en un hilo"""
+    global _init_state, _init_pid
+    with _init_lock:
+        if _init_pid == os.getpid():
+            return
+        _init_pid = os.getpid()
+        _init_state = "running"
+        threading.Thread(target=_run_background_init, name="init", daemon=True).start()
+
+
+def readiness_response(results):
+    """Cuerpo y código HTTP de /health/ready a partir de los checks"""
     health_status = {"status": "ready", "instance_id": INSTANCE_ID, "checks": {}}
 
     # Verificar PostgreSQL (crítico)
-    postgres_ok = check_postgres()
+    postgres_ok = results["postgres"]
     health_status["checks"]["postgres"] = "ok" if postgres_ok else "error"
 
     # Verificar MinIO (crítico)
-    minio_ok = check_minio()
+    minio_ok = results["minio"]
     health_status["checks"]["minio"] = "ok" if minio_ok else "error"
 
     # Verificar Redis (opcional - solo en pro)
     if REDIS_HOST and REDIS_PORT:
-        redis_ok = check_redis()
+        redis_ok = results["redis"]
         health_status["checks"]["redis"] = "ok" if redis_ok else "warning"
     else:
         health_status["checks"]["redis"] = "not_configured"
 
+    init_state = _init_state
+    if init_state is not None:
+        health_status["checks"]["init"] = {
+            "running": "pending",
+            "done": "ok",
+            "failed": "error",
+        }[init_state]
+
     # Si falla algo crítico, marcar como not ready
-    if not postgres_ok or not minio_ok:
+    if not postgres_ok or not minio_ok or init_state in ("running", "failed"):
         health_status["status"] = "not_ready"
-        return jsonify(health_status), 503
+        return health_status, 503
 
-    return jsonify(health_status), 200
+    return health_status, 200
+
+
+def index_context(results):
+    """Variables de la plantilla index.html a partir de los checks"""
+    redis_configured = REDIS_HOST and REDIS_PORT != 0
+    return {
+        "db_status": results["postgres"],
+        "cache_status": results["redis"] if redis_configured else None,
+        "redis_configured": redis_configured,
+        "minio_status": results["minio"],
+        "lb_status": results["load_balancer"],
+        "instance_id": INSTANCE_ID,
+    }
 
 
 @app.route("/")
 def index():
-    redis_configured = REDIS_HOST and REDIS_PORT != 0
-    return render_template(
-        "index.html",
-        db_status=check_postgres(),
-        cache_status=check_redis() if redis_configured else None,
-        redis_configured=redis_configured,
-        minio_status=check_minio(),
-        lb_status=check_load_balancer(),
-        instance_id=INSTANCE_ID,
-    )
+    return render_template("index.html", **index_context(get_health_snapshot()))
 
 
-@app.route("/users")
-def users():
-    from_cache = False
-    query_time = 0
+def _files_fingerprint(*folders):
+    """Huella del contenido de unas carpetas (plantillas y estáticos)"""
+    digest = hashlib.sha256()
+    for folder in folders:
+        for root, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                with open(os.path.join(root, name), "rb") as f:
+                    digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:8]
+
+
+# Forma parte del ETag: un despliegue con otras plantillas invalida las copias
+TEMPLATES_FINGERPRINT = _files_fingerprint(app.template_folder, app.static_folder)
+_static_fingerprints = {}  # fichero -> (mtime, huella)
 
+
+def static_fingerprint(filename):
+    """Huella del contenido de un fichero de static/ (None si no existe)"""
+    path = os.path.join(app.static_folder, filename)
     try:
-        start_time = time.time()
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _static_fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_fingerprints[filename] = (mtime, fingerprint)
+    return fingerprint
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """url_for('static', ...) añade ?v=<huella> para poder cachearlo sin límite"""
+    if endpoint == "static" and "v" not in values:
+        fingerprint = static_fingerprint(values.get("filename", ""))
+        if fingerprint:
+            values["v"] = fingerprint
+
+
+@app.after_request
+def static_cache_headers(response):
+    if request.endpoint == "static" and response.status_code == 200:
+        version = request.args.get("v")
+        if version and version == static_fingerprint(request.view_args["filename"]):
+            response.headers["Cache-Control"] = (
+                f"public, max-age={STATIC_MAX_AGE}, immutable"
+            )
+    return response
+
+
+def users_http_headers(version):
+    """Cabeceras de validación de /users para una versión de datos"""
+    if version is None:
+        return {}
+    n, ts = version
+    return {
+        "ETag": quote_etag(f"{n}-{ts}-{TEMPLATES_FINGERPRINT}", weak=True),
+        "Last-Modified": http_date(ts // 1000),
+        # Siempre se revalida, pero la respuesta puede ser un 304 vacío
+        "Cache-Control": "private, no-cache",
+    }
 
-        # Intentar obtener desde caché
-        users_list, from_cache = get_users_from_cache()
 
-        if users_list is None:
-            # Si no está en caché, consultar base de datos
-            conn = get_db()
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT * FROM users ORDER BY created_at DESC")
-            users_list = cur.fetchall()
-            cur.close()
-            conn.close()
+def is_not_modified(headers, if_none_match=None, if_modified_since=None):
+    """Indica si el cliente ya tiene la versión descrita por `headers`"""
+    if not headers:
+        return False
+    if if_none_match:
+        etag, _ = unquote_etag(headers["ETag"])
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(if_modified_since) if if_modified_since else None
+    return since is not None and parse_date(headers["Last-Modified"]) <= since
 
-            # Convertir a lista de diccionarios normales para JSON
-            users_list = [dict(user) for user in users_list]
 
-            # Convertir datetime a string para poder serializar en JSON
-            for user in users_list:
-                if user.get("created_at"):
-                    user["created_at"] = user["created_at"].isoformat()
+# La versión de los datos forma parte de la clave: tras una escritura las
+# entradas antiguas ya no se alcanzan y las expulsa el LRU o su TTL
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL)
 
-            # Guardar en caché
-            save_users_to_cache(users_list)
 
-        query_time = round((time.time() - start_time) * 1000, 2)
+def users_fragment_key(version, cursor, limit):
+    n, ts = version
+    return f"{n}:{ts}:{TEMPLATES_FINGERPRINT}:{limit}:{cursor or 'first'}"
 
-        # Generar URL completa para cada imagen
-        environment = os.getenv("ENVIRONMENT", "dev")
-        minio_host = f"minio-api.{environment}.localhost:8080"
 
-        for user in users_list:
-            if user.get("image_url"):
-                user["image_display_url"] = (
-                    f"http://{minio_host}/{BUCKET_NAME}/{user['image_url']}"
-                )
-            else:
-                user["image_display_url"] = None
+def get_users_fragment(version, cursor, limit):
+    """Tabla de usuarios ya renderizada, o None si no está en caché"""
+    if version is None:
+        return None
+    html = fragment_cache.get(users_fragment_key(version, cursor, limit))
+    USERS_CACHE_REQUESTS.labels("fragment", "hit" if html else "miss").inc()
+    return html
 
-        return render_template(
-            "users.html",
-            users=users_list,
-            instance_id=INSTANCE_ID,
-            from_cache=from_cache,
-            query_time=query_time,
+
+@timed("render.table")
+def render_users_table(page, version, cursor, limit):
+    """
+    Renderiza la tabla de una página de usuarios y la guarda en la caché de
+    fragmentos. Sin versión de datos (Redis caído, o una copia obsoleta que
+    no corresponde a la versión) no se cachea porque no habría forma de
+    saber cuándo deja de ser válida.
+    """
+    html = Markup(
+        render_template(
+            "_users_table.html",
+            users=page["users"],
+            cursor=cursor,
+            next_cursor=page["next_cursor"],
+            limit=limit,
         )
+    )
+    if version is not None:
+        fragment_cache.set(users_fragment_key(version, cursor, limit), html)
+    return html
+
+
+@app.route("/users")
+def users():
+    from_cache = False
+    query_time = 0
+    cursor = request.args.get("cursor") or None
+    limit = parse_page_size(request.args.get("limit"))
+
+    # Si el cliente tiene la versión actual, 304 sin consultar ni renderizar
+    version = get_users_version()
+    headers = users_http_headers(version)
+    if is_not_modified(
+        headers,
+        request.headers.get("If-None-Match"),
+        request.headers.get("If-Modified-Since"),
+    ):
+        return "", 304, headers
+
+    try:
+        start_time = time.perf_counter()
+
+        # La tabla ya renderizada para esta versión evita caché y plantilla
+        table = get_users_fragment(version, cursor, limit)
+        from_cache = table is not None
+
+        if table is None:
+            # Intentar obtener la página desde caché
+            page, from_cache = get_users_from_cache(cursor, limit, version)
+            page_version = version
+
+            if page is None:
+                # Si no está en caché, consultar base de datos
+                page = fetch_users_page(cursor, limit)
+
+                # Guardar en caché
+                save_users_to_cache(page, cursor, limit, version)
+            elif from_cache == CACHE_STALE:
+                # La copia obsoleta no es la versión del ETag: sin validadores,
+                # o el cliente la conservaría con 304 hasta la siguiente
+                # escritura, y sin guardar la tabla bajo esa versión
+                headers = users_http_headers(None)
+                page_version = None
+
+            table = render_users_table(page, page_version, cursor, limit)
+
+        query_time = round((time.perf_counter() - start_time) * 1000, 2)
+        mark_cache_result(from_cache)
+
+        with timed("render.page"):
+            response = make_response(
+                render_template(
+                    "users.html",
+                    users_table=table,
+                    instance_id=INSTANCE_ID,
+                    from_cache=from_cache,
+                    query_time=query_time,
+                )
+            )
+        response.headers.update(headers)
+        return response
     except Exception as e:
         return render_template(
             "users.html",
@@ -259,92 +2401,601 @@ def users():
         )
 
 
+@app.route("/api/users")
+def api_users():
+    """
+    Exporta todos los usuarios en streaming (respuesta chunked).
+    Parámetros: format (ndjson | json, por defecto según Accept) y since_id
+    para sincronizaciones incrementales.
+    """
+    fmt = request.args.get("format")
+    if fmt is None:
+        best = request.accept_mimetypes.best_match(
+            ["application/json", "application/x-ndjson"]
+        )
+        fmt = "ndjson" if best == "application/x-ndjson" else "json"
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Formato no soportado (ndjson o json)"}), 400
+
+    since_id = request.args.get("since_id")
+    if since_id is not None:
+        try:
+            since_id = int(since_id)
+        except ValueError:
+            return jsonify({"error": "since_id debe ser un entero"}), 400
+
+    generator = stream_users(fmt, since_id)
+    try:
+        first = next(generator)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
+    return Response(_prefetched(first, generator), mimetype=EXPORT_FORMATS[fmt])
+
+
+@app.route("/api/users/search")
+def api_users_search():
+    """
+    Búsqueda de usuarios por nombre o email. Parámetros: q (al menos
+    SEARCH_MIN_LENGTH caracteres), match (contains | prefix), cursor y limit.
+    """
+    q = normalize_search(request.args.get("q"))
+    match = request.args.get("match", "contains")
+    cursor = request.args.get("cursor") or None
+    limit = parse_page_size(request.args.get("limit"))
+    if len(q) < SEARCH_MIN_LENGTH:
+        return (
+            jsonify({"error": f"q debe tener al menos {SEARCH_MIN_LENGTH} caracteres"}),
+            400,
+        )
+    if match not in SEARCH_MATCHES:
+        return jsonify({"error": "match no soportado (contains o prefix)"}), 400
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    try:
+        page, from_cache = search_users(q, match, cursor, limit)
+    except Exception as e:
+        logger.exception("Error en la búsqueda")
+        return jsonify({"error": str(e)}), 503
+
+    mark_cache_result(from_cache)
+    return jsonify({"query": q, "match": match, "from_cache": from_cache, **page})
+
+
 @app.route("/users/add", methods=["POST"])
 def add_user():
     name = request.form.get("name")
     email = request.form.get("email")
     image = request.files.get("image")
 
-    print(
-        f"[ADD_USER] Recibido: name={name}, email={email}, image={image.filename if image else 'None'}"
-    )
-
     image_url = None
+    pending_upload = None
 
     try:
         # Subir imagen a MinIO si existe
         if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-
-            print(f"[ADD_USER] Subiendo imagen {unique_filename} a MinIO...")
-            client = get_minio()
-            client.put_object(
-                BUCKET_NAME,
-                unique_filename,
-                image,
-                length=-1,
-                part_size=10 * 1024 * 1024,
-                content_type=image.content_type,
-            )
+            unique_filename = make_object_name(image.filename)
+            length = stream_size(image.stream)
+
+            if UPLOAD_ASYNC_THRESHOLD and length >= UPLOAD_ASYNC_THRESHOLD:
+                # El stream de la petición se cierra al terminar: copiarlo aparte
+                pending_upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                shutil.copyfileobj(image.stream, pending_upload)
+                pending_upload.seek(0)
+            else:
+                upload_image(unique_filename, image.stream, length, image.content_type)
 
             image_url = unique_filename
-            print("[ADD_USER] Imagen subida correctamente")
 
         # Guardar en base de datos
-        print(f"[ADD_USER] Guardando en BD: {name}, {email}, {image_url}")
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO users (name, email, image_url) VALUES (%s, %s, %s)",
-            (name, email, image_url),
+        new_user = create_user(name, email, image_url)
+        logger.info(
+            "Usuario creado",
+            extra={
+                "user_id": new_user.get("id"),
+                "object_name": image_url,
+                "upload": "async" if pending_upload else "sync",
+            },
         )
-        conn.commit()
-        print("[ADD_USER] Usuario guardado correctamente")
-        cur.close()
-        conn.close()
 
-        # Invalidar caché para que se recargue con el nuevo usuario
-        invalidate_users_cache()
+        if image_url and not pending_upload:
+            schedule_thumbnail(image_url)
+
+        # La fila ya está confirmada: la subida grande sigue en segundo plano
+        if pending_upload:
+            _get_upload_executor().submit(
+                _upload_in_background,
+                image_url,
+                pending_upload,
+                length,
+                image.content_type,
+            )
+            pending_upload = None
 
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception("Error creando usuario")
+        if pending_upload:
+            pending_upload.close()
 
     return redirect(url_for("users"))
 
 
-@app.route("/users/delete/<int:user_id>")
-def delete_user(user_id):
+@app.route("/users/import", methods=["POST"])
+def import_users_endpoint():
+    """
+    Importación masiva de usuarios. Acepta un fichero en el campo `file` o
+    el cuerpo de la petición (text/csv o application/x-ndjson).
+    Parámetros: format (csv | ndjson) y on_conflict (skip | update).
+    """
+    upload = request.files.get("file")
+    if upload:
+        stream = upload.stream
+        fmt = import_format(upload.filename, upload.content_type)
+    else:
+        stream = request.stream
+        fmt = import_format(content_type=request.content_type)
+    fmt = request.args.get("format") or fmt
+    on_conflict = request.args.get("on_conflict", "skip")
+
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({"error": "Formato no soportado (csv o ndjson)"}), 400
+    if on_conflict not in IMPORT_CONFLICT_POLICIES:
+        return jsonify({"error": "on_conflict debe ser skip o update"}), 400
+
     try:
-        conn = get_db()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        stats = import_users(stream, fmt, on_conflict)
+    except Exception as e:
+        logger.exception("Error en la importación")
+        return jsonify({"error": str(e)}), 500
+
+    logger.info("Importación terminada", extra=stats)
+    return jsonify(stats), 200
+
+
+@app.route("/users/upload-url", methods=["POST"])
+def presigned_upload_url():
+    """
+    Devuelve una URL prefirmada para que el navegador suba la imagen
+    directamente a MinIO, sin pasar los bytes por la aplicación, y el
+    token firmado que /users/confirm exige para ese objeto.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    if not allowed_file(filename):
+        return jsonify({"error": "Tipo de archivo no permitido"}), 400
+
+    object_name = make_object_name(filename)
+    try:
+        with timed("minio.presign"):
+            upload_url = get_minio_signer().presigned_put_object(
+                BUCKET_NAME,
+                object_name,
+                expires=timedelta(seconds=PRESIGNED_UPLOAD_EXPIRES),
+            )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
+    expires_at = int(time.time()) + PRESIGNED_UPLOAD_EXPIRES + UPLOAD_CONFIRM_WINDOW
+    track_pending_upload(object_name, expires_at)
+    return jsonify(
+        {
+            "upload_url": upload_url,
+            "object_name": object_name,
+            "upload_token": upload_token(object_name, expires_at),
+            "expires_in": PRESIGNED_UPLOAD_EXPIRES,
+        }
+    )
 
-        # Obtener la imagen antes de eliminar
-        cur.execute("SELECT image_url FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
 
-        if user and user["image_url"]:
-            # Eliminar imagen de MinIO
+@app.route("/users/confirm", methods=["POST"])
+def confirm_upload():
+    """
+    Crea el usuario una vez que el navegador ha subido la imagen con la
+    URL prefirmada. El objeto debe venir con el token que emitió
+    /users/upload-url, no estar ya asignado a otro usuario, existir y ser
+    una imagen válida. Cada token confirma un único usuario.
+    """
+    data = request.get_json(silent=True) or {}
+    name = data.get("name")
+    email = data.get("email")
+    object_name = data.get("object_name")
+    if not name or not email:
+        return jsonify({"error": "Faltan nombre o email"}), 400
+    if object_name and not OBJECT_NAME_RE.match(object_name):
+        return jsonify({"error": "Objeto no válido"}), 400
+    if object_name and not verify_upload_token(object_name, data.get("upload_token")):
+        return jsonify({"error": "Token de subida no válido o caducado"}), 403
+
+    claimed = False
+    try:
+        if object_name:
+            claimed = claim_pending_upload(object_name)
+            if claimed is None:
+                # Sin Redis no hay reclamación atómica: se comprueba en la BD
+                claimed = not image_in_use(object_name)
+            if not claimed:
+                return jsonify({"error": "La imagen ya está asignada"}), 409
             client = get_minio()
             try:
-                client.remove_object(BUCKET_NAME, user["image_url"])
+                with timed("minio.stat"):
+                    stat = client.stat_object(BUCKET_NAME, object_name)
             except Exception:
-                pass
+                return jsonify({"error": "La imagen no se ha subido"}), 400
+            too_large = stat.size > app.config["MAX_CONTENT_LENGTH"]
+            content_type = stat.content_type or ""
+            if too_large or not content_type.startswith("image/"):
+                client.remove_object(BUCKET_NAME, object_name)
+                claimed = False
+                return jsonify({"error": "Imagen no válida o demasiado grande"}), 413
+
+        new_user = create_user(name, email, object_name)
+        claimed = False
+        if object_name:
+            schedule_thumbnail(object_name)
+    except psycopg2.IntegrityError:
+        return jsonify({"error": "El email ya está registrado"}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if claimed:
+            # No se ha creado el usuario: la subida vuelve a quedar pendiente
+            # para reintentar con el mismo token o para que la barra el sweep
+            expires_at = int(data["upload_token"].partition(".")[0])
+            track_pending_upload(object_name, expires_at)
 
-        # Eliminar usuario
-        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+    return jsonify(new_user), 201
 
-        # Invalidar caché
-        invalidate_users_cache()
 
-    except Exception as e:
-        print(f"Error: {e}")
+# Miniaturas perezosas ya encoladas (o fallidas): no se reintentan hasta
+# que caduca la entrada, así una imagen corrupta no se decodifica en bucle
+thumbnail_attempts = LRUCache(1024, THUMBNAIL_RETRY_AFTER)
+
+
+@app.route("/users/thumbnail/<path:object_name>")
+def user_thumbnail(object_name):
+    """
+    Generación perezosa de miniaturas: si la miniatura aún no existe (por
+    ejemplo, imágenes anteriores al pipeline) se encola en el pool de
+    miniaturas y, mientras tanto, se redirige a la imagen original. La
+    petición nunca decodifica la imagen: la memoria la acota THUMBNAIL_WORKERS.
+    """
+    if not OBJECT_NAME_RE.match(object_name):
+        return jsonify({"error": "Objeto no válido"}), 404
+    key = thumbnail_key(object_name)
+    try:
+        with timed("minio.stat"):
+            get_minio().stat_object(BUCKET_NAME, key)
+    except Exception:
+        if thumbnail_attempts.get(object_name) is None:
+            thumbnail_attempts.set(object_name, True)
+            schedule_thumbnail(object_name)
+        key = object_name
+    return redirect(f"http://{MINIO_PUBLIC_ENDPOINT}/{BUCKET_NAME}/{key}")
+
+
+@app.route("/users/delete/<int:user_id>")
+def delete_user(user_id):
+    try:
+        with get_db() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            with timed("db.query"):
+                cur.execute(
+                    "DELETE FROM users WHERE id = %s RETURNING id, image_url, created_at",
+                    (user_id,),
+                )
+                user = cur.fetchone()
+                conn.commit()
+            cur.close()
+
+        if user:
+            # Quitar al usuario de las páginas cacheadas que lo contenían
+            write_through_users_cache(deleted=user)
+
+            # Borrar imagen y miniatura; si falla, se reintenta más tarde
+            queue_object_deletions(
+                remove_objects(user_object_names([user["image_url"]]))
+            )
+
+        logger.info("Usuario borrado", extra={"user_id": user_id, "found": bool(user)})
+    except Exception:
+        logger.exception("Error borrando usuario", extra={"user_id": user_id})
 
     return redirect(url_for("users"))
 
 
+@app.route("/users/delete", methods=["POST"])
+def bulk_delete_users():
+    """
+    Borrado masivo. Cuerpo JSON con {"ids": [1, 2, ...]} o con el rango
+    {"id_min": 1, "id_max": 500}; como mucho BULK_DELETE_MAX usuarios.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    id_min, id_max = data.get("id_min"), data.get("id_max")
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids
+        ):
+            return jsonify({"error": "ids debe ser una lista de enteros"}), 400
+        if len(ids) > BULK_DELETE_MAX:
+            return jsonify({"error": f"Máximo {BULK_DELETE_MAX} ids"}), 400
+        kwargs = {"ids": ids}
+    elif isinstance(id_min, int) and isinstance(id_max, int) and id_min <= id_max:
+        if id_max - id_min + 1 > BULK_DELETE_MAX:
+            return jsonify({"error": f"Máximo {BULK_DELETE_MAX} ids"}), 400
+        kwargs = {"id_min": id_min, "id_max": id_max}
+    else:
+        return jsonify({"error": "Indica ids o id_min e id_max"}), 400
+
+    try:
+        result = delete_users(**kwargs)
+    except Exception as e:
+        logger.exception("Error en el borrado masivo")
+        return jsonify({"error": str(e)}), 500
+
+    logger.info("Borrado masivo", extra=result)
+    return jsonify(result), 200
+
+
+_request_threads = set()  # hilos que están atendiendo una petición
+_profile_lock = threading.Lock()  # un perfilado a la vez por proceso
+_cprofile_lock = threading.Lock()  # cProfile: una petición perfilada a la vez
+_request_profile = None
+# Clase de worker de gunicorn y número de hilos, fijados por
+# post_worker_init; sin gunicorn (python app.py, uvicorn) se asume que hay
+# varios hilos
+_worker_model = (None, None)
+
+
+def set_worker_model(worker_class, threads):
+    """Registra el modelo de concurrencia del worker (lo llama gunicorn.conf.py)"""
+    global _worker_model
+    _worker_model = (worker_class, threads)
+
+
+def profiler_unsupported():
+    """
+    Motivo por el que el perfilador no funciona con este modelo de workers,
+    o None. Ambos endpoints observan otros hilos del proceso: con workers
+    sync (o gthread con un hilo) la propia petición de perfilado ocupa el
+    único hilo, y con gevent las peticiones son greenlets que
+    sys._current_frames() no ve.
+    """
+    worker_class, threads = _worker_model
+    monkey = sys.modules.get("gevent.monkey")
+    if (monkey and monkey.is_module_patched("threading")) or (
+        worker_class and ("Gevent" in worker_class or "Eventlet" in worker_class)
+    ):
+        return "no disponible con workers gevent/eventlet"
+    if worker_class == "SyncWorker" or (
+        worker_class == "ThreadWorker" and threads is not None and threads < 2
+    ):
+        return "no disponible con workers de un solo hilo (sync)"
+    return None
+
+
+class RequestProfile:
+    """Acumula con cProfile las próximas `count` peticiones a una ruta"""
+
+    def __init__(self, route, count):
+        self.route = route
+        self.count = count
+        self.stats = None
+        self.done = threading.Event()
+        self._claimed = 0
+        self.profiled = 0
+        self._lock = threading.Lock()
+
+    def claim(self):
+        with self._lock:
+            if self._claimed >= self.count:
+                return False
+            self._claimed += 1
+            return True
+
+    def add(self, profiler):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.profiled += 1
+            if self.profiled >= self.count:
+                self.done.set()
+
+
+@app.before_request
+def start_request_profiling():
+    _request_threads.add(threading.get_ident())
+    profile = _request_profile
+    if profile is None or request.url_rule is None:
+        return
+    if request.url_rule.rule != profile.route:
+        return
+    # Si ya se está perfilando otra petición, esta se deja pasar sin perfilar
+    if not _cprofile_lock.acquire(blocking=False):
+        return
+    if not profile.claim():
+        _cprofile_lock.release()
+        return
+    g.profile = profile
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+@app.teardown_request
+def finish_request_profiling(exc):
+    _request_threads.discard(threading.get_ident())
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    profiler.disable()
+    _cprofile_lock.release()
+    g.pop("profile").add(profiler)
+
+
+def _frame_label(code):
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def sample_stacks(seconds, interval=PROFILER_INTERVAL, all_threads=False):
+    """
+    Muestrea cada `interval` segundos las pilas de los hilos del proceso
+    que están atendiendo peticiones (o de todos con all_threads) y devuelve
+    {pila colapsada: muestras}. Solo lee sys._current_frames(): los hilos
+    observados no se detienen ni se instrumentan.
+    """
+    own = threading.get_ident()
+    labels = {}  # code -> etiqueta, para no formatearla en cada muestra
+    stacks = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own or not (all_threads or ident in _request_threads):
+                continue
+            stack = []
+            while frame is not None:
+                label = labels.get(frame.f_code)
+                if label is None:
+                    label = labels[frame.f_code] = _frame_label(frame.f_code)
+                stack.append(label)
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            stacks[key] = stacks.get(key, 0) + 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed_stacks(stacks):
+    """Formato 'pila;colapsada muestras' de flamegraph.pl y speedscope"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def profiler_error():
+    """
+    Respuesta de error si la petición no puede usar el perfilador: 404 si
+    está desactivado (sin PROFILER_TOKEN), 401 si el token no coincide y
+    409 si el modelo de workers no lo permite (ver profiler_unsupported).
+    """
+    if not PROFILER_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), PROFILER_TOKEN.encode()
+    ):
+        return jsonify({"error": "No autorizado"}), 401
+    reason = profiler_unsupported()
+    if reason:
+        return jsonify({"error": f"Perfilador {reason}"}), 409
+    return None
+
+
+def _profile_param(name, default, cast, maximum):
+    try:
+        value = cast(request.args.get(name, default))
+    except ValueError:
+        raise ValueError(name)
+    if not 0 < value <= maximum:
+        raise ValueError(name)
+    return value
+
+
+@app.route("/debug/profile")
+def profile_process():
+    """
+    Muestrea las pilas de este proceso durante `seconds` segundos y las
+    devuelve colapsadas. Parámetros: seconds, interval y threads=all para
+    incluir también los hilos que no atienden peticiones.
+    """
+    error = profiler_error()
+    if error:
+        return error
+    try:
+        seconds = _profile_param("seconds", 10, float, PROFILER_MAX_SECONDS)
+        interval = _profile_param("interval", PROFILER_INTERVAL, float, 1)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro no válido: {e}"}), 400
+
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"error": "Ya hay un perfilado en curso"}), 409
+    try:
+        stacks = sample_stacks(
+            seconds, interval, all_threads=request.args.get("threads") == "all"
+        )
+    finally:
+        _profile_lock.release()
+
+    return Response(
+        collapsed_stacks(stacks),
+        mimetype="text/plain",
+        headers={"X-Instance-Id": INSTANCE_ID, "X-Process-Id": str(os.getpid())},
+    )
+
+
+@app.route("/debug/profile/requests")
+def profile_requests():
+    """
+    Perfila con cProfile las próximas `count` peticiones que este proceso
+    atienda en la ruta `route` (regla de Flask, p. ej. /users) y espera como
+    mucho `timeout` segundos. Devuelve un volcado pstats (format=pstats,
+    para pstats/snakeviz) o el resumen en texto (format=text).
+    """
+    global _request_profile
+    error = profiler_error()
+    if error:
+        return error
+    route = request.args.get("route", "")
+    fmt = request.args.get("format", "pstats")
+    try:
+        count = _profile_param("count", 10, int, PROFILER_MAX_REQUESTS)
+        timeout = _profile_param("timeout", 30, float, PROFILER_MAX_SECONDS)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro no válido: {e}"}), 400
+    if fmt not in ("pstats", "text"):
+        return jsonify({"error": "Formato no soportado (pstats o text)"}), 400
+    if route not in {rule.rule for rule in app.url_map.iter_rules()}:
+        return jsonify({"error": "Ruta desconocida"}), 400
+
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"error": "Ya hay un perfilado en curso"}), 409
+    try:
+        profile = RequestProfile(route, count)
+        _request_profile = profile
+        profile.done.wait(timeout)
+    finally:
+        _request_profile = None
+        _profile_lock.release()
+
+    if profile.stats is None:
+        return jsonify({"error": "Ninguna petición a la ruta a tiempo"}), 504
+    headers = {
+        "X-Instance-Id": INSTANCE_ID,
+        "X-Process-Id": str(os.getpid()),
+        "X-Profiled-Requests": str(profile.profiled),
+    }
+    if fmt == "text":
+        out = io.StringIO()
+        profile.stats.stream = out
+        profile.stats.sort_stats("cumulative").print_stats(50)
+        return Response(out.getvalue(), mimetype="text/plain", headers=headers)
+    headers["Content-Disposition"] = "attachment; filename=profile.pstats"
+    return Response(
+        marshal.dumps(profile.stats.stats),
+        mimetype="application/octet-stream",
+        headers=headers,
+    )
+
+
 if __name__ == "__main__":
+    setup_logging()
+    start_background_init()
+    start_cache_subscriber()
+    start_deletion_retrier()
     app.run(host="0.0.0.0", port=80)
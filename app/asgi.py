@@ -0,0 +1,551 @@
+"""
+Variante asíncrona (ASGI) de la aplicación.
+
+Las rutas de lectura (/, /health, /health/ready y GET /users) se sirven con
+E/S asíncrona: asyncpg para PostgreSQL, redis.asyncio para Redis y httpx para
+el balanceador, y las llamadas independientes se lanzan a la vez con
+asyncio.gather. El resto de rutas (altas, subidas, borrados, miniaturas y
+/metrics) se delegan en la aplicación Flask, que se ejecuta en un pool de
+hilos; las plantillas y las claves de caché son las mismas en ambos modos.
+
+Arranque: gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import asyncpg
+import httpx
+import redis.asyncio as aioredis
+from a2wsgi import WSGIMiddleware
+from flask import render_template
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from json_logging import request_id_var, setup_logging
+from app import (
+    CACHE_LOCK_TTL,
+    CACHE_LOCK_WAIT,
+    CACHE_SOFT_TTL,
+    CACHE_STALE,
+    CACHE_TTL,
+    DB_CONNECT_TIMEOUT,
+    DB_HOST,
+    DB_NAME,
+    DB_PASSWORD,
+    DB_POOL_MAX,
+    DB_POOL_MAX_IDLE,
+    DB_POOL_MIN,
+    DB_POOL_TIMEOUT,
+    DB_PORT,
+    DB_USER,
+    HEALTH_CACHE_TTL,
+    HEALTH_CHECK_DURATION,
+    HEALTH_CHECK_TIMEOUT,
+    INSTANCE_ID,
+    LB_HOST,
+    LB_PORT,
+    REDIS_CONNECT_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_HOST,
+    REDIS_POOL_MAX,
+    REDIS_POOL_TIMEOUT,
+    REDIS_PORT,
+    REDIS_SOCKET_TIMEOUT,
+    REQUEST_ID_RE,
+    USERS_CACHE_REQUESTS,
+    USERS_PAGE_SIZE,
+    USERS_PAGES_KEY,
+    USERS_VERSION_KEY,
+    _l1_active,
+    _page_score,
+    build_users_page,
+    check_minio,
+    decode_cache_value,
+    decode_cursor,
+    encode_cache_value,
+    get_users_fragment,
+    index_context,
+    is_not_modified,
+    mark_cache_result,
+    l1_cache,
+    parse_page_size,
+    readiness_response,
+    render_users_table,
+    users_http_headers,
+    timed,
+    users_page_key,
+    start_background_init,
+    start_cache_subscriber,
+    start_deletion_retrier,
+)
+
+# Hilos para las rutas que se delegan en Flask (WSGI)
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "10"))
+
+_db_pool = None
+_db_pool_lock = asyncio.Lock()
+_redis_clients = {}  # binary -> cliente
+_http_client = None
+_health_snapshot = None  # {"results": {...}, "checked_at": monotonic}
+_health_refresh = None  # tarea que está recalculando los checks
+
+
+async def get_async_db_pool():
+    """Pool asyncpg del proceso; se crea con la primera petición que lo usa"""
+    global _db_pool
+    if _db_pool is None:
+        async with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = await asyncpg.create_pool(
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    timeout=DB_CONNECT_TIMEOUT,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                )
+    return _db_pool
+
+
+def get_async_redis(binary=False):
+    """
+    Cliente redis.asyncio con el mismo dimensionado que el pool síncrono
+    (binary=True para los valores serializados de la caché)
+    """
+    if not REDIS_HOST or REDIS_PORT == 0:
+        return None
+    client = _redis_clients.get(binary)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            decode_responses=not binary,
+            max_connections=REDIS_POOL_MAX,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        _redis_clients[binary] = client
+    return client
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=HEALTH_CHECK_TIMEOUT)
+    return _http_client
+
+
+async def close_async_clients():
+    """Cierra los pools asíncronos (apagado del worker)"""
+    global _db_pool, _http_client
+    if _db_pool is not None:
+        await _db_pool.close()
+        _db_pool = None
+    for client in _redis_clients.values():
+        await client.close()
+        await client.connection_pool.disconnect()
+    _redis_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def check_postgres_async():
+    try:
+        pool = await get_async_db_pool()
+        async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            await conn.fetchval("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+async def check_redis_async():
+    try:
+        r = get_async_redis()
+        if not r:
+            return False
+        await r.ping()
+        return True
+    except Exception:
+        return False
+
+
+_minio_check = None  # check de MinIO en curso en el pool de hilos
+
+
+async def check_minio_async():
+    """
+    El SDK de MinIO solo es síncrono: se ejecuta en el pool de hilos. El
+    timeout de _timed_check no detiene el hilo, así que mientras un check
+    siga en curso se espera a ese mismo en lugar de lanzar otro.
+    """
+    global _minio_check
+    if (
+        _minio_check is None
+        or _minio_check.done()
+        or _minio_check.get_loop() is not asyncio.get_running_loop()
+    ):
+        _minio_check = asyncio.ensure_future(asyncio.to_thread(check_minio))
+    return await asyncio.shield(_minio_check)
+
+
+async def check_load_balancer_async():
+    try:
+        response = await get_http_client().get(f"http://{LB_HOST}:{LB_PORT}/health")
+        return response.status_code == 200
+    except Exception:
+        return False
+
+
+async def _timed_check(name, check):
+    start = time.monotonic()
+    try:
+        return bool(await asyncio.wait_for(check(), HEALTH_CHECK_TIMEOUT))
+    except Exception:
+        return False
+    finally:
+        HEALTH_CHECK_DURATION.labels(name).observe(time.monotonic() - start)
+
+
+async def run_health_checks_async():
+    """
+    Ejecuta los checks de dependencias a la vez. Un check que no termina
+    en HEALTH_CHECK_TIMEOUT segundos cuenta como fallido.
+    """
+    checks = {
+        "postgres": check_postgres_async,
+        "minio": check_minio_async,
+        "load_balancer": check_load_balancer_async,
+    }
+    if REDIS_HOST and REDIS_PORT:
+        checks["redis"] = check_redis_async
+
+    results = await asyncio.gather(
+        *(_timed_check(name, check) for name, check in checks.items())
+    )
+    return dict(zip(checks, results))
+
+
+async def _refresh_health():
+    global _health_snapshot, _health_refresh
+    try:
+        results = await run_health_checks_async()
+        _health_snapshot = {"results": results, "checked_at": time.monotonic()}
+        return results
+    finally:
+        _health_refresh = None
+
+
+async def get_health_snapshot_async():
+    """
+    Igual que get_health_snapshot(): el resultado se reutiliza durante
+    HEALTH_CACHE_TTL segundos y solo una tarea lo recalcula; mientras tanto
+    el resto usa la instantánea anterior (o espera a la primera).
+    """
+    global _health_refresh
+    snapshot = _health_snapshot
+    if snapshot and time.monotonic() - snapshot["checked_at"] < HEALTH_CACHE_TTL:
+        return snapshot["results"]
+    if _health_refresh is None:
+        _health_refresh = asyncio.ensure_future(_refresh_health())
+    elif snapshot is not None:
+        return snapshot["results"]
+    return await asyncio.shield(_health_refresh)
+
+
+def invalidate_health_cache_async():
+    """Descarta la instantánea de health checks"""
+    global _health_snapshot
+    _health_snapshot = None
+
+
+@timed("redis.version")
+async def get_users_version_async():
+    """Versión asíncrona de get_users_version()"""
+    try:
+        r = get_async_redis()
+        if not r:
+            return None
+        n, ts = await r.hmget(USERS_VERSION_KEY, "n", "ts")
+        if n is None or ts is None:
+            async with r.pipeline() as pipe:
+                pipe.hsetnx(USERS_VERSION_KEY, "n", 0)
+                pipe.hsetnx(USERS_VERSION_KEY, "ts", int(time.time() * 1000))
+                pipe.hmget(USERS_VERSION_KEY, "n", "ts")
+                n, ts = (await pipe.execute())[-1]
+        return int(n), int(ts)
+    except Exception:
+        return None
+
+
+@timed("redis.get_page")
+async def get_users_from_cache_async(cursor=None, limit=USERS_PAGE_SIZE, version=None):
+    """
+    Versión asíncrona de get_users_from_cache(), con la misma caché L1,
+    las mismas claves y la misma protección contra estampidas.
+    """
+    key = users_page_key(cursor, limit)
+    if _l1_active.is_set():
+        entry = l1_cache.get(key)
+        if entry is not None and version in (None, entry[0]):
+            USERS_CACHE_REQUESTS.labels("l1", "hit").inc()
+            return entry[1], True
+        USERS_CACHE_REQUESTS.labels("l1", "miss").inc()
+
+    try:
+        r = get_async_redis(binary=True)
+        if not r:
+            return None, False
+        cached_data, fresh = await r.mget(key, f"{key}:fresh")
+        if cached_data and fresh:
+            USERS_CACHE_REQUESTS.labels("redis", "hit").inc()
+            page = decode_cache_value(cached_data)
+            if _l1_active.is_set():
+                l1_cache.set(key, (version, page), _page_score(cursor))
+            return page, True
+
+        got_lock = await r.set(f"{key}:lock", INSTANCE_ID, ex=CACHE_LOCK_TTL, nx=True)
+        if got_lock:
+            USERS_CACHE_REQUESTS.labels("redis", "miss").inc()
+            return None, False
+        if cached_data:
+            USERS_CACHE_REQUESTS.labels("redis", "stale").inc()
+            return decode_cache_value(cached_data), CACHE_STALE
+
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            cached_data = await r.get(key)
+            if cached_data:
+                return decode_cache_value(cached_data), True
+    except Exception:
+        pass
+    return None, False
+
+
+@timed("redis.save_page")
+async def save_users_to_cache_async(
+    page, cursor=None, limit=USERS_PAGE_SIZE, version=None
+):
+    """Versión asíncrona de save_users_to_cache()"""
+    try:
+        r = get_async_redis(binary=True)
+        if r:
+            key = users_page_key(cursor, limit)
+            score = _page_score(cursor)
+            async with r.pipeline() as pipe:
+                for _ in range(3):
+                    try:
+                        fresh = True
+                        if version is not None:
+                            await pipe.watch(USERS_VERSION_KEY)
+                            current = await pipe.hmget(USERS_VERSION_KEY, "n", "ts")
+                            fresh = None not in current and (
+                                tuple(map(int, current)) == tuple(version)
+                            )
+                            pipe.multi()
+                        pipe.setex(key, CACHE_TTL, encode_cache_value(page))
+                        if fresh:
+                            pipe.setex(
+                                f"{key}:fresh", min(CACHE_SOFT_TTL, CACHE_TTL), 1
+                            )
+                        pipe.zadd(USERS_PAGES_KEY, {key: score})
+                        pipe.expire(USERS_PAGES_KEY, CACHE_TTL)
+                        pipe.delete(f"{key}:lock")
+                        await pipe.execute()
+                        break
+                    except aioredis.WatchError:
+                        continue
+                else:
+                    return
+            if fresh and _l1_active.is_set():
+                l1_cache.set(key, (version, page), score)
+    except Exception:
+        pass
+
+
+@timed("db.query")
+async def fetch_users_page_async(cursor=None, limit=USERS_PAGE_SIZE):
+    """Versión asíncrona de fetch_users_page() sobre el pool asyncpg"""
+    pool = await get_async_db_pool()
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            rows = await conn.fetch(
+                "SELECT * FROM users WHERE (created_at, id) < ($1, $2) "
+                "ORDER BY created_at DESC, id DESC LIMIT $3",
+                created_at,
+                last_id,
+                limit + 1,
+            )
+        else:
+            rows = await conn.fetch(
+                "SELECT * FROM users ORDER BY created_at DESC, id DESC LIMIT $1",
+                limit + 1,
+            )
+    return build_users_page(rows, limit)
+
+
+def flask_context(request):
+    """Contexto de petición de Flask para usar sus plantillas y url_for"""
+    return flask_app.test_request_context(
+        request.url.path, query_string=request.url.query
+    )
+
+
+async def health(request):
+    """Liveness: solo comprueba que el proceso responde"""
+    return JSONResponse(
+        {
+            "status": "healthy",
+            "instance_id": INSTANCE_ID,
+            "message": "Application is running",
+        }
+    )
+
+
+async def health_ready(request):
+    health_status, status_code = readiness_response(await get_health_snapshot_async())
+    return JSONResponse(health_status, status_code=status_code)
+
+
+async def index(request):
+    context = index_context(await get_health_snapshot_async())
+    with flask_context(request):
+        return HTMLResponse(render_template("index.html", **context))
+
+
+async def users(request):
+    from_cache = False
+    cursor = request.query_params.get("cursor") or None
+    limit = parse_page_size(request.query_params.get("limit"))
+
+    # Todo el manejador dentro del contexto de Flask: las etapas medidas con
+    # timed() se publican al salir con la ruta y el resultado de la caché
+    with flask_context(request):
+        version = await get_users_version_async()
+        headers = users_http_headers(version)
+        if is_not_modified(
+            headers,
+            request.headers.get("If-None-Match"),
+            request.headers.get("If-Modified-Since"),
+        ):
+            return Response(status_code=304, headers=headers)
+
+        try:
+            start_time = time.perf_counter()
+
+            table = get_users_fragment(version, cursor, limit)
+            from_cache = table is not None
+            if table is None:
+                page, from_cache = await get_users_from_cache_async(
+                    cursor, limit, version
+                )
+                page_version = version
+                if page is None:
+                    page = await fetch_users_page_async(cursor, limit)
+                    await save_users_to_cache_async(page, cursor, limit, version)
+                elif from_cache == CACHE_STALE:
+                    headers = users_http_headers(None)
+                    page_version = None
+                table = render_users_table(page, page_version, cursor, limit)
+
+            query_time = round((time.perf_counter() - start_time) * 1000, 2)
+            mark_cache_result(from_cache)
+
+            with timed("render.page"):
+                html = render_template(
+                    "users.html",
+                    users_table=table,
+                    instance_id=INSTANCE_ID,
+                    from_cache=from_cache,
+                    query_time=query_time,
+                )
+            return HTMLResponse(html, headers=headers)
+        except Exception as e:
+            return HTMLResponse(
+                render_template(
+                    "users.html",
+                    users=[],
+                    error=str(e),
+                    instance_id=INSTANCE_ID,
+                    from_cache=False,
+                    query_time=0,
+                )
+            )
+
+
+class RequestIdMiddleware:
+    """
+    Asigna (o respeta) el X-Request-ID de cada petición, lo deja en el
+    contextvar de los logs y lo devuelve. Se reescribe en las cabeceras de
+    entrada para que las rutas delegadas en Flask usen el mismo id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = [(k, v) for k, v in scope["headers"] if k != b"x-request-id"]
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        header = (b"x-request-id", request_id.encode())
+        scope = dict(scope, headers=[*headers, header])
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                response_headers = [
+                    (k, v)
+                    for k, v in message.get("headers", [])
+                    if k.lower() != b"x-request-id"
+                ]
+                message = dict(message, headers=[*response_headers, header])
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    start_background_init()
+    start_cache_subscriber()
+    start_deletion_retrier()
+    yield
+    await close_async_clients()
+
+
+application = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/health", health),
+        Route("/health/ready", health_ready),
+        Route("/users", users),
+        # Todo lo demás lo atiende la aplicación Flask
+        Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_WORKERS)),
+    ],
+    middleware=[Middleware(RequestIdMiddleware)],
+    lifespan=lifespan,
+)
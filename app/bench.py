@@ -0,0 +1,714 @@
+"""
+Benchmark de las rutas calientes de la app: lanza cada escenario con la
+concurrencia indicada, mide RPS y latencias (p50/p95/p99) y guarda el
+resultado en JSON para compararlo entre commits.
+
+Uso: python bench.py --fake [--latency-db 0.002 --latency-redis 0.0005 ...]
+     python bench.py --url http://localhost:5000 [--redis-url redis://localhost:6379]
+     python bench.py --fake --compare bench-results/anterior.json
+
+Con --fake la app se ejecuta en este proceso con PostgreSQL, Redis y MinIO
+simulados en memoria y una latencia fija por llamada; con --url se ataca
+un servidor real (stack local o port-forward a un pod). Los escenarios
+users_add y users_delete crean y borran usuarios con email bench-*.
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+BENCH_EMAIL_PREFIX = "bench-"
+CURSOR_RE = re.compile(r"[?&;]cursor=([A-Za-z0-9_-]+)")
+
+
+# --- Backends simulados -------------------------------------------------------
+
+
+class Slow:
+    """
+    Envuelve un cliente y añade `delay` segundos a cada llamada, como si
+    fuera un viaje de ida y vuelta por la red (un pipeline cuenta una vez).
+    """
+
+    def __init__(self, target, delay):
+        self._target = target
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or not self._delay:
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._delay)
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class FakeUsersDB:
+    """Tabla users en memoria con las consultas que hace la app"""
+
+    def __init__(self, users=0):
+        self.rows = {}  # id -> fila
+        self.keys = []  # (created_at, id) ordenadas, como idx_users_created_at_id
+        self.next_id = 1
+        self.lock = threading.Lock()
+        base = datetime(2025, 1, 1)
+        for i in range(users):
+            self.insert(
+                f"Usuario {i}",
+                f"seed-{i}@example.com",
+                None,
+                base + timedelta(seconds=i),
+            )
+
+    def insert(self, name, email, image_url, created_at=None):
+        with self.lock:
+            row = {
+                "id": self.next_id,
+                "name": name,
+                "email": email,
+                "image_url": image_url,
+                "created_at": created_at or datetime.now(),
+            }
+            self.next_id += 1
+            self.rows[row["id"]] = row
+            bisect.insort(self.keys, (row["created_at"], row["id"]))
+            return dict(row)
+
+    def delete(self, ids):
+        with self.lock:
+            deleted = [self.rows.pop(i) for i in ids if i in self.rows]
+            for row in deleted:
+                self.keys.remove((row["created_at"], row["id"]))
+            return deleted
+
+    def page(self, limit, before=None):
+        with self.lock:
+            end = (
+                len(self.keys)
+                if before is None
+                else bisect.bisect_left(self.keys, before)
+            )
+            keys = self.keys[max(0, end - limit) : end]
+            return [dict(self.rows[user_id]) for _, user_id in reversed(keys)]
+
+    def execute(self, query, params=()):
+        query = " ".join(query.split())
+        if query == "SELECT 1":
+            return [(1,)]
+        if query.startswith("SELECT * FROM users WHERE (created_at, id) <"):
+            created_at, last_id, limit = params
+            return self.page(limit, (created_at, last_id))
+        if query.startswith("SELECT * FROM users ORDER BY created_at DESC"):
+            return self.page(params[0])
+        if query.startswith("SELECT * FROM users") and query.endswith("ORDER BY id"):
+            since_id = params[0] if params else 0
+            with self.lock:
+                return [dict(r) for i, r in sorted(self.rows.items()) if i > since_id]
+        if query.startswith("INSERT INTO users (name, email, image_url)"):
+            return [self.insert(*params)]
+        if query.startswith("DELETE FROM users WHERE id = ANY"):
+            return self.delete(params[0])
+        if query.startswith("DELETE FROM users WHERE id BETWEEN"):
+            return self.delete(range(params[0], params[1] + 1))
+        if query.startswith("DELETE FROM users WHERE id ="):
+            return self.delete([params[0]])
+        raise NotImplementedError(f"Consulta no simulada: {query}")
+
+
+class FakeCursor:
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+        self.rows = []
+        self.itersize = 2000
+
+    def execute(self, query, params=()):
+        time.sleep(self.delay)
+        self.rows = self.db.execute(query, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self.db, self.delay)
+
+    def commit(self):
+        time.sleep(self.delay)
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """Sustituye a ConnectionPool: presta conexiones a la tabla en memoria"""
+
+    def __init__(self, db, delay):
+        self.db = db
+        self.delay = delay
+
+    def getconn(self):
+        return FakeConnection(self.db, self.delay)
+
+    def putconn(self, conn, discard=False):
+        pass
+
+    def closeall(self):
+        pass
+
+
+class FakeObject(BytesIO):
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """Bucket en memoria con las operaciones de MinIO que usa la app"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def list_buckets(self):
+        return []
+
+    def bucket_exists(self, bucket):
+        return True
+
+    def put_object(self, bucket, name, data, length=-1, content_type=None, **kwargs):
+        self.objects[name] = data.read(length) if length >= 0 else data.read()
+
+    def get_object(self, bucket, name):
+        return FakeObject(self.objects[name])
+
+    def stat_object(self, bucket, name):
+        if name not in self.objects:
+            raise KeyError(name)
+
+    def remove_object(self, bucket, name):
+        self.objects.pop(name, None)
+
+    def remove_objects(self, bucket, delete_objects):
+        for obj in delete_objects:
+            self.objects.pop(obj._name, None)
+        return iter(())
+
+
+# --- Destinos ---------------------------------------------------------------
+
+
+class HttpTarget:
+    """Servidor real; con redis_url se puede vaciar la caché (escenario cold)"""
+
+    def __init__(self, base_url, redis_url=None, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.redis = None
+        if redis_url:
+            import redis
+
+            self.redis = redis.Redis.from_url(redis_url)
+        self._local = threading.local()
+
+    def describe(self):
+        return self.base_url
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method, path, form=None, files=None, json=None):
+        response = self._session().request(
+            method,
+            self.base_url + path,
+            data=form,
+            files=files,
+            json=json,
+            allow_redirects=False,
+            timeout=self.timeout,
+        )
+        return response.status_code, response.text
+
+    def flush_cache(self):
+        if self.redis is None:
+            return False
+        keys = list(self.redis.scan_iter("users_list*"))
+        if keys:
+            self.redis.delete(*keys)
+        return True
+
+    def bench_user_ids(self):
+        status, text = self.request("GET", "/api/users?format=ndjson")
+        if status != 200:
+            return []
+        users = (json.loads(line) for line in text.splitlines() if line)
+        return [u["id"] for u in users if u["email"].startswith(BENCH_EMAIL_PREFIX)]
+
+    def settle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeTarget:
+    """La app Flask en este proceso con backends simulados y latencia fija"""
+
+    def __init__(
+        self, users=1000, latency_db=0.002, latency_redis=0.0005, latency_minio=0.005
+    ):
+        for name, value in (
+            ("DB_HOST", "bench"),
+            ("DB_PORT", "5432"),
+            ("REDIS_HOST", "bench"),
+            ("REDIS_PORT", "6379"),
+        ):
+            os.environ.setdefault(name, value)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from unittest.mock import patch
+
+        import app as app_module
+        from fakes import FakeRedis
+
+        self.app_module = app_module
+        self.latency = {
+            "db": latency_db,
+            "redis": latency_redis,
+            "minio": latency_minio,
+        }
+        self.db = FakeUsersDB(users)
+        self.redis = FakeRedis()
+        self.minio = FakeMinio()
+        redis_client = Slow(self.redis, latency_redis)
+        minio_client = Slow(self.minio, latency_minio)
+        self._patches = [
+            patch("app.get_db_pool", return_value=FakePool(self.db, latency_db)),
+            patch("app.get_redis", lambda binary=False: redis_client),
+            patch("app.get_minio", return_value=minio_client),
+            patch("app.get_minio_health", return_value=minio_client),
+            patch("app.check_load_balancer", return_value=True),
+            patch("app.REDIS_HOST", "bench"),
+            patch("app.REDIS_PORT", 6379),
+        ]
+        for p in self._patches:
+            p.start()
+        self._local = threading.local()
+
+    def describe(self):
+        return "fake " + json.dumps(self.latency)
+
+    def request(self, method, path, form=None, files=None, json=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app_module.app.test_client()
+        data = dict(form or {})
+        for field, (filename, content, content_type) in (files or {}).items():
+            data[field] = (BytesIO(content), filename, content_type)
+        response = client.open(path, method=method, data=data or None, json=json)
+        return response.status_code, response.get_data(as_text=True)
+
+    def flush_cache(self):
+        self.redis.__init__()
+        self.app_module.l1_cache.clear()
+        self.app_module.fragment_cache.clear()
+        return True
+
+    def bench_user_ids(self):
+        return [
+            row["id"]
+            for row in list(self.db.rows.values())
+            if row["email"].startswith(BENCH_EMAIL_PREFIX)
+        ]
+
+    def settle(self):
+        """
+        Espera a que terminen las subidas y miniaturas en segundo plano, para
+        que no compitan por la CPU con el siguiente escenario ni lleguen al
+        MinIO real tras quitar los parches.
+        """
+        # Primero las subidas: al terminar encolan su miniatura
+        for name in ("_upload_executor", "_thumbnail_executor"):
+            executor = getattr(self.app_module, name)
+            if executor is not None:
+                executor.shutdown(wait=True)
+                setattr(self.app_module, name, None)
+                setattr(self.app_module, f"{name}_pid", None)
+
+    def close(self):
+        self.settle()
+        for p in reversed(self._patches):
+            p.stop()
+
+
+# --- Escenarios ---------------------------------------------------------------
+
+
+class Workload:
+    """
+    Petición i-ésima de un escenario (`send`, devuelve el código HTTP) y
+    preparación previa sin cronometrar (`before`). `size` limita el número
+    de peticiones cuando el escenario no da para más (p. ej. borrados).
+    """
+
+    def __init__(self, send, before=None, size=None):
+        self.send = send
+        self.before = before
+        self.size = size
+
+
+def random_png(size):
+    """PNG de ruido (no se comprime), parecido en tamaño a una foto"""
+    image = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    output = BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+def _get(target, path):
+    return target.request("GET", path)[0]
+
+
+def prepare_index(target, args):
+    return Workload(lambda i: _get(target, "/"))
+
+
+def prepare_health_ready(target, args):
+    return Workload(lambda i: _get(target, "/health/ready"))
+
+
+def prepare_users_warm(target, args):
+    path = f"/users?limit={args.page_size}"
+    _get(target, path)  # cebar la caché
+    return Workload(lambda i: _get(target, path))
+
+
+def prepare_users_cold(target, args):
+    if not target.flush_cache():
+        return None
+    path = f"/users?limit={args.page_size}"
+    return Workload(lambda i: _get(target, path), before=lambda i: target.flush_cache())
+
+
+def prepare_users_paginated(target, args):
+    """Recorre una vez las primeras páginas y después las pide en bucle"""
+    paths = [f"/users?limit={args.page_size}"]
+    while len(paths) < args.pages:
+        status, html = target.request("GET", paths[-1])
+        match = CURSOR_RE.search(html) if status == 200 else None
+        if not match:
+            break
+        paths.append(f"/users?limit={args.page_size}&cursor={match.group(1)}")
+    return Workload(lambda i: _get(target, paths[i % len(paths)]))
+
+
+def prepare_users_add(target, args):
+    image = random_png(args.image_size)
+    run_id = uuid.uuid4().hex[:8]
+
+    def send(i):
+        return target.request(
+            "POST",
+            "/users/add",
+            form={
+                "name": f"Bench {i}",
+                "email": f"{BENCH_EMAIL_PREFIX}{run_id}-{i}@example.com",
+            },
+            files={"image": ("bench.png", image, "image/png")},
+        )[0]
+
+    return Workload(send)
+
+
+def prepare_users_delete(target, args):
+    """Borra de uno en uno los usuarios bench-* (los crea users_add)"""
+    ids = target.bench_user_ids()
+    if not ids:
+        return None
+
+    def send(i):
+        return target.request("POST", "/users/delete", json={"ids": [ids[i]]})[0]
+
+    return Workload(send, size=len(ids))
+
+
+SCENARIOS = {
+    "index": prepare_index,
+    "health_ready": prepare_health_ready,
+    "users_warm": prepare_users_warm,
+    "users_cold": prepare_users_cold,
+    "users_paginated": prepare_users_paginated,
+    "users_add": prepare_users_add,
+    "users_delete": prepare_users_delete,
+}
+
+
+# --- Ejecución y resultados ------------------------------------------------------
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))  # ceil sin float
+    return sorted_values[min(len(sorted_values), int(rank)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """RPS y latencias en ms de una ejecución"""
+    values = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(values) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": ms(sum(values) / len(values)) if values else None,
+            "p50": ms(percentile(values, 50)),
+            "p95": ms(percentile(values, 95)),
+            "p99": ms(percentile(values, 99)),
+            "max": ms(values[-1]) if values else None,
+        },
+    }
+
+
+def run_workload(workload, total, concurrency):
+    """
+    Lanza `total` peticiones con `concurrency` hilos. Cuenta como error
+    cualquier excepción o código >= 400. El tiempo de `before` no entra en
+    la latencia pero sí en la duración total (y por tanto en el RPS).
+    """
+    if workload.size is not None:
+        total = min(total, workload.size)
+    counter = itertools.count()  # next() es atómico con el GIL
+
+    def worker():
+        latencies, errors = [], 0
+        for i in iter(lambda: next(counter), None):
+            if i >= total:
+                break
+            if workload.before:
+                workload.before(i)
+            start = time.perf_counter()
+            try:
+                ok = workload.send(i) < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = [
+            f.result() for f in [executor.submit(worker) for _ in range(concurrency)]
+        ]
+    elapsed = time.perf_counter() - start
+    return summarize(
+        [v for latencies, _ in results for v in latencies],
+        sum(errors for _, errors in results),
+        elapsed,
+    )
+
+
+def run_benchmark(target, args):
+    """Prepara y ejecuta los escenarios pedidos, en orden"""
+    results = {}
+    for name in args.scenarios:
+        workload = SCENARIOS[name](target, args)
+        if workload is None:
+            print(
+                f"[BENCH] {name}: omitido (sin datos o sin acceso a Redis)",
+                file=sys.stderr,
+            )
+            continue
+        if args.warmup:
+            run_workload(workload, min(args.warmup, workload.size or args.warmup), 1)
+            target.settle()
+            if name == "users_delete":  # los borrados del calentamiento ya no existen
+                workload = SCENARIOS[name](target, args)
+                if workload is None:
+                    continue
+        results[name] = run_workload(workload, args.requests, args.concurrency)
+        target.settle()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(old, new, max_regression):
+    """
+    Compara dos resultados y devuelve los escenarios que empeoran más de
+    `max_regression` (fracción) en p95 o en RPS.
+    """
+    regressions = []
+    for name, current in new["results"].items():
+        previous = old["results"].get(name)
+        if not previous:
+            continue
+        old_p95, new_p95 = previous["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        old_rps, new_rps = previous["rps"], current["rps"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{name}: p95 {old_p95} ms -> {new_p95} ms")
+        if old_rps and new_rps and new_rps < old_rps * (1 - max_regression):
+            regressions.append(f"{name}: RPS {old_rps} -> {new_rps}")
+    return regressions
+
+
+def format_table(results):
+    lines = [
+        f"{'escenario':<16}{'peticiones':>11}{'errores':>9}{'RPS':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    ]
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        lines.append(
+            f"{name:<16}{r['requests']:>11}{r['errors']:>9}{r['rps']!s:>10}"
+            f"{lat['p50']!s:>10}{lat['p95']!s:>10}{lat['p99']!s:>10}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de las rutas calientes")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--url", help="URL base de un servidor real")
+    mode.add_argument(
+        "--fake", action="store_true", help="App en proceso con backends simulados"
+    )
+    parser.add_argument("--redis-url", help="Redis del servidor real (para users_cold)")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        type=lambda value: value.split(","),
+        help="Lista separada por comas (por defecto, todos en este orden)",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Peticiones por escenario"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="Peticiones previas sin medir"
+    )
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument(
+        "--pages", type=int, default=10, help="Páginas de users_paginated"
+    )
+    parser.add_argument(
+        "--image-size", type=int, default=256, help="Lado en px de la imagen"
+    )
+    parser.add_argument(
+        "--seed-users", type=int, default=1000, help="Usuarios iniciales (--fake)"
+    )
+    parser.add_argument("--latency-db", type=float, default=0.002)
+    parser.add_argument("--latency-redis", type=float, default=0.0005)
+    parser.add_argument("--latency-minio", type=float, default=0.005)
+    parser.add_argument(
+        "--output", help="Fichero JSON (por defecto bench-results/<commit>.json)"
+    )
+    parser.add_argument("--compare", help="Resultado anterior con el que comparar")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Empeoramiento tolerado en p95/RPS antes de fallar (0.2 = 20%%)",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    if args.fake:
+        target = FakeTarget(
+            args.seed_users, args.latency_db, args.latency_redis, args.latency_minio
+        )
+    else:
+        target = HttpTarget(args.url, args.redis_url)
+    try:
+        results = run_benchmark(target, args)
+    finally:
+        target.close()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "target": target.describe(),
+        "python": sys.version.split()[0],
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "page_size": args.page_size,
+            "image_size": args.image_size,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        "bench-results", f"{commit or datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(format_table(results))
+    print(f"\nResultados en {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        for line in regressions:
+            print(f"[REGRESIÓN] {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
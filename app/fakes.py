@@ -0,0 +1,187 @@
+"""
+Dobles en memoria de los servicios externos, para los tests y para los
+backends simulados de bench.py --fake.
+"""
+
+
+class FakePipeline:
+    """Pipeline que acumula comandos y los ejecuta contra FakeRedis"""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+        self._immediate = False  # Tras WATCH los comandos se ejecutan al momento
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+        if self._immediate:
+            return method
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def watch(self, *keys):
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def reset(self):
+        self._immediate = False
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def execute(self):
+        results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+class FakeRedis:
+    """Subconjunto de la API de redis-py suficiente para la caché de la app"""
+
+    def __init__(self):
+        self.data = {}
+        self.zsets = {}
+        self.ttls = {}
+        self.published = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def ping(self):
+        return True
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 1
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        if ex:
+            self.ttls[key] = ex
+        return True
+
+    def setex(self, key, ttl, value):
+        return self.set(key, value, ex=ttl)
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += int(self.data.pop(key, None) is not None)
+            removed += int(self.zsets.pop(key, None) is not None)
+            self.ttls.pop(key, None)
+        return removed
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start : None if end == -1 else end + 1]
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.lrange(key, start, end)
+        return True
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = str(value)
+        return 1
+
+    def hsetnx(self, key, field, value):
+        if field in self.data.get(key, {}):
+            return 0
+        return self.hset(key, field, value)
+
+    def hincrby(self, key, field, amount=1):
+        value = int(self.data.get(key, {}).get(field, 0)) + amount
+        self.hset(key, field, value)
+        return value
+
+    def hmget(self, key, *fields):
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+        return True
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    def zrem(self, key, *members):
+        zset = self.zsets.get(key, {})
+        return sum(int(zset.pop(m, None) is not None) for m in members)
+
+    def zrangebyscore(self, key, min_score, max_score, start=None, num=None):
+        low, high = float(min_score), float(max_score)
+        zset = self.zsets.get(key, {})
+        members = [
+            m
+            for m, score in sorted(zset.items(), key=lambda i: i[1])
+            if low <= score <= high
+        ]
+        if start is not None:
+            members = members[start : start + num]
+        return members
+
+
+class AsyncFakePipeline(FakePipeline):
+    """Pipeline de redis.asyncio: los comandos se encolan y execute se espera"""
+
+    def __getattr__(self, name):
+        method = FakePipeline.__getattr__(self, name)
+        if not self._immediate:
+            return method
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+    async def watch(self, *keys):
+        FakePipeline.watch(self, *keys)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.reset()
+
+    async def execute(self):
+        return FakePipeline.execute(self)
+
+
+class AsyncFakeRedis:
+    """Interfaz de redis.asyncio sobre un FakeRedis (accesible en `sync`)"""
+
+    def __init__(self):
+        self.sync = FakeRedis()
+
+    def pipeline(self, transaction=True):
+        return AsyncFakePipeline(self.sync)
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
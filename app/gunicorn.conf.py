@@ -0,0 +1,103 @@
+"""
+Configuración de gunicorn para el modo de producción.
+Todos los valores se pueden ajustar con variables de entorno.
+"""
+
+import math
+import os
+import shutil
+
+# Métricas multiproceso: cada worker escribe sus métricas en este directorio y
+# /metrics las agrega. Debe definirse antes de que los workers importen la app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def cpu_limit():
+    """
+    CPUs disponibles para el contenedor: primero el límite que inyecta el
+    Deployment (Downward API), luego el de cgroup y por último os.cpu_count().
+    """
+    millicores = os.getenv("CPU_LIMIT_MILLICORES")
+    if millicores:
+        return max(1, math.ceil(int(millicores) / 1000))
+
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+
+    return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '80')}"
+
+# sync, gthread o gevent (gevent requiere instalar el paquete gevent); con
+# APP_SERVER=asgi el Dockerfile usa uvicorn.workers.UvicornWorker
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", str(cpu_limit() + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+
+# La app se importa dentro de cada worker, de modo que los pools de
+# PostgreSQL, Redis y MinIO se crean después del fork
+preload_app = False
+
+# Reciclado gradual de workers: acota fugas de memoria sin cortar peticiones
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Heartbeat de los workers en memoria en lugar de en disco
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def on_starting(server):
+    """Vacía el directorio de métricas multiproceso en cada arranque"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """
+    Arranca en cada worker la inicialización en segundo plano, el hilo de
+    invalidación de la caché L1 y el de reintento de borrados en MinIO
+    """
+    from app import (
+        set_worker_model,
+        start_background_init,
+        start_cache_subscriber,
+        start_deletion_retrier,
+    )
+    from json_logging import setup_logging
+
+    setup_logging()
+    # /debug/profile solo funciona con varios hilos por worker (gthread)
+    set_worker_model(type(worker).__name__, worker.cfg.threads)
+    start_background_init()
+    start_cache_subscriber()
+    start_deletion_retrier()
+
+
+def child_exit(server, worker):
+    """Descarta las métricas de tipo gauge del worker que termina"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,47 @@
+"""
+Importación masiva de usuarios desde CSV (con cabecera name,email,image_url)
+o NDJSON (un objeto JSON por línea).
+
+Uso: python import_users.py FICHERO [--format csv|ndjson] [--on-conflict skip|update]
+     Con FICHERO = - se lee de la entrada estándar.
+"""
+
+import argparse
+import json
+import sys
+
+from app import (
+    IMPORT_BATCH_SIZE,
+    IMPORT_CONFLICT_POLICIES,
+    IMPORT_FORMATS,
+    import_format,
+    import_users,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importación masiva de usuarios")
+    parser.add_argument("file", help="Fichero CSV o NDJSON ('-' para stdin)")
+    parser.add_argument("--format", choices=sorted(IMPORT_FORMATS))
+    parser.add_argument(
+        "--on-conflict", choices=sorted(IMPORT_CONFLICT_POLICIES), default="skip"
+    )
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or import_format(args.file)
+    if fmt is None:
+        parser.error("No se puede deducir el formato: usa --format")
+
+    if args.file == "-":
+        stats = import_users(sys.stdin.buffer, fmt, args.on_conflict, args.batch_size)
+    else:
+        with open(args.file, "rb") as f:
+            stats = import_users(f, fmt, args.on_conflict, args.batch_size)
+
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,14 @@
 import psycopg2
 import os
 import time
+import random
+import json
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
 import logging
+from migrate import migrate
+from json_logging import setup_logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DB_HOST = os.getenv("DB_HOST")
@@ -17,103 +21,120 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
 MINIO_USER = os.getenv("MINIO_USER")
 MINIO_PASSWORD = os.getenv("MINIO_PASSWORD")
 
+# Reintentos con backoff exponencial y jitter (0 = reintentar indefinidamente)
+INIT_MAX_RETRIES = int(os.getenv("INIT_MAX_RETRIES", "30"))
+INIT_BASE_DELAY = float(os.getenv("INIT_BASE_DELAY", "0.5"))
+INIT_MAX_DELAY = float(os.getenv("INIT_MAX_DELAY", "10"))
 
-def init_database():
-    max_retries = 30
-    retry_count = 0
 
-    while retry_count < max_retries:
-        try:
-            logger.info(f"Intentando conectar a PostgreSQL en {DB_HOST}:{DB_PORT}...")
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-            )
-
-            cur = conn.cursor()
+class InitError(Exception):
+    pass
 
-            with open("init.sql", "r") as f:
-                sql = f.read()
-                cur.execute(sql)
 
-            conn.commit()
-            cur.close()
-            conn.close()
+def backoff_delay(attempt, base=None, cap=None):
+    """Espera antes del reintento `attempt` (1, 2, ...): full jitter"""
+    base = INIT_BASE_DELAY if base is None else base
+    cap = INIT_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
 
-            logger.info("Base de datos inicializada correctamente")
-            return
-
-        except Exception as e:
-            retry_count += 1
-            logger.error(
-                f"Error al conectar (intento {retry_count}/{max_retries}): {e}"
-            )
-            time.sleep(2)
 
-    logger.error("No se pudo conectar a la base de datos")
-    exit(1)
-
-
-def init_minio():
-    max_retries = 30
-    retry_count = 0
-
-    while retry_count < max_retries:
+def with_retries(name, func, max_retries=None):
+    """Ejecuta `func` hasta que no lance excepción o se agoten los intentos"""
+    max_retries = INIT_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            logger.info(f"Intentando conectar a MinIO en {MINIO_ENDPOINT}...")
-            client = Minio(
-                MINIO_ENDPOINT,
-                access_key=MINIO_USER,
-                secret_key=MINIO_PASSWORD,
-                secure=False,
-            )
-
-            bucket_name = "user-images"
-            if not client.bucket_exists(bucket_name):
-                client.make_bucket(bucket_name)
-                logger.info(f"Bucket '{bucket_name}' creado")
-
-                # Hacer el bucket público para lectura
-                policy = {
-                    "Version": "2012-10-17",
-                    "Statement": [
-                        {
-                            "Effect": "Allow",
-                            "Principal": {"AWS": "*"},
-                            "Action": ["s3:GetObject"],
-                            "Resource": [f"arn:aws:s3:::{bucket_name}/*"],
-                        }
-                    ],
-                }
-                import json
-
-                client.set_bucket_policy(bucket_name, json.dumps(policy))
-                logger.info(f"Bucket '{bucket_name}' configurado como público")
-            else:
-                logger.info(f"Bucket '{bucket_name}' ya existe")
-
-            return
-
+            return func()
         except Exception as e:
-            retry_count += 1
-            logger.error(
-                f"Error al conectar a MinIO (intento {retry_count}/{max_retries}): {e}"
-            )
-            time.sleep(2)
-
-    logger.error("No se pudo conectar a MinIO")
-    exit(1)
+            total = max_retries or "∞"
+            logger.error(f"Error en {name} (intento {attempt}/{total}): {e}")
+            if max_retries and attempt >= max_retries:
+                raise InitError(f"No se pudo inicializar {name}") from e
+            time.sleep(backoff_delay(attempt))
+
+
+def init_database_once():
+    logger.info(f"Intentando conectar a PostgreSQL en {DB_HOST}:{DB_PORT}...")
+    conn = psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        connect_timeout=5,
+    )
+    try:
+        # Si otro pod está migrando lanza MigrationInProgress y se reintenta
+        if migrate(conn):
+            logger.info("Base de datos inicializada correctamente")
+        else:
+            logger.info("Esquema al día")
+    finally:
+        conn.close()
+
+
+def init_minio_once():
+    logger.info(f"Intentando conectar a MinIO en {MINIO_ENDPOINT}...")
+    client = Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_USER,
+        secret_key=MINIO_PASSWORD,
+        secure=False,
+    )
+
+    bucket_name = "user-images"
+    if not client.bucket_exists(bucket_name):
+        client.make_bucket(bucket_name)
+        logger.info(f"Bucket '{bucket_name}' creado")
+
+        # Hacer el bucket público para lectura
+        policy = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Principal": {"AWS": "*"},
+                    "Action": ["s3:GetObject"],
+                    "Resource": [f"arn:aws:s3:::{bucket_name}/*"],
+                }
+            ],
+        }
+        client.set_bucket_policy(bucket_name, json.dumps(policy))
+        logger.info(f"Bucket '{bucket_name}' configurado como público")
+    else:
+        logger.info(f"Bucket '{bucket_name}' ya existe")
+
+
+def init_database(max_retries=None):
+    with_retries("PostgreSQL", init_database_once, max_retries)
+
+
+def init_minio(max_retries=None):
+    with_retries("MinIO", init_minio_once, max_retries)
+
+
+def run_init(max_retries=None):
+    """
+    Inicializa PostgreSQL y MinIO en paralelo. Lanza InitError si alguna
+    de las dos no termina dentro de sus reintentos.
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="init") as executor:
+        futures = [
+            executor.submit(init_database, max_retries),
+            executor.submit(init_minio, max_retries),
+        ]
+        for future in futures:
+            future.result()
+    logger.info("Inicialización completada")
 
 
 if __name__ == "__main__":
-    logger.info("=" * 50)
+    setup_logging()
     logger.info("Inicializando aplicación...")
-    logger.info("=" * 50)
 
-    init_database()
-    init_minio()
-
-    logger.info("Inicialización completada")
+    try:
+        run_init()
+    except InitError as e:
+        logger.error(str(e))
+        exit(1)
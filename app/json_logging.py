@@ -0,0 +1,204 @@
+"""
+Logging estructurado (una línea JSON por evento) y asíncrono.
+
+Los hilos de las peticiones solo filtran por nivel/muestreo y encolan el
+registro en una cola acotada; un hilo QueueListener lo serializa y lo
+escribe en stdout (y en LOG_DIR si está configurado). Si la cola está
+llena el registro se descarta en lugar de bloquear la petición.
+
+Cada registro lleva el request_id de la petición en curso (contextvar, vale
+para hilos y asyncio) y los campos pasados con `extra=`.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fracción de registros que se conservan por nivel, p. ej. "DEBUG=0.01,INFO=0.5";
+# WARNING y superiores no se muestrean salvo que se indique
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# Directorio para ficheros de log (uno por proceso, con rotación); vacío = solo stdout
+LOG_DIR = os.getenv("LOG_DIR", "")
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+INSTANCE_ID = socket.gethostname()
+
+# Id de correlación de la petición en curso ("-" fuera de una petición)
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+# Atributos propios de LogRecord: el resto son campos de `extra=`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def parse_sample_rates(value):
+    """'DEBUG=0.01,INFO=0.5' -> {10: 0.01, 20: 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        level, _, rate = item.partition("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Conserva solo una fracción aleatoria de los registros de cada nivel"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    """Añade al registro el request_id del contexto que lo emite"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra=` al final"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "instance": INSTANCE_ID,
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que nunca bloquea: con la cola llena descarta el registro
+    y lo cuenta; el siguiente registro encolado lleva `dropped_logs`. En el
+    hilo que emite solo se interpola el mensaje: el JSON se genera en el
+    hilo del listener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        dropped = self.dropped
+        if dropped:
+            record.dropped_logs = dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped -= dropped
+        except queue.Full:
+            self.dropped += 1
+
+
+def _remove_stale_logs(directory):
+    """Borra los ficheros de procesos que ya no existen (workers reciclados)"""
+    for name in os.listdir(directory):
+        pid = name.split(".")[0].rpartition("-")[2]
+        if not name.startswith("app-") or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        except OSError:
+            pass
+
+
+_listener = None
+_listener_pid = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None):
+    """
+    Configura (una vez por proceso) el logger raíz con la cola y el
+    listener. Tras un fork el hijo crea su propio listener.
+    """
+    global _listener, _listener_pid
+    with _setup_lock:
+        if _listener_pid == os.getpid():
+            return
+        formatter = JsonFormatter()
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if LOG_DIR:
+            try:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                _remove_stale_logs(LOG_DIR)
+                handlers.append(
+                    logging.handlers.RotatingFileHandler(
+                        os.path.join(LOG_DIR, f"app-{os.getpid()}.log"),
+                        maxBytes=LOG_FILE_MAX_BYTES,
+                        backupCount=1,
+                    )
+                )
+            except OSError:
+                pass
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+        queue_handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(
+            queue_handler.queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+        _listener_pid = os.getpid()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Vacía la cola y detiene el listener (se llama al salir)"""
+    global _listener, _listener_pid
+    with _setup_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        _listener = None
+        _listener_pid = None
@@ -0,0 +1,224 @@
+"""
+Migraciones versionadas del esquema de PostgreSQL.
+
+Cada fichero migrations/NNNN_descripcion.sql es una migración con versión
+NNNN. Las aplicadas se registran en la tabla schema_migrations y solo un
+pod migra a la vez (advisory lock); el resto comprueba con una única
+consulta que no queda nada pendiente.
+
+Las migraciones se ejecutan en una transacción, salvo las que empiezan por
+la línea `-- migrate:no-transaction`, necesaria para CREATE INDEX
+CONCURRENTLY y similares. Esas deben contener una sola sentencia idempotente
+(IF NOT EXISTS), porque si el proceso muere antes de registrarla se repite.
+
+Un CREATE INDEX CONCURRENTLY que falla deja el índice creado pero INVALID,
+y en el reintento IF NOT EXISTS no haría nada. Por eso, antes de esas
+migraciones se borra el índice si existe y no es válido, y después se
+comprueba que es válido antes de registrar la versión. Esas construcciones
+no usan MIGRATION_LOCK_TIMEOUT: esperan a que terminen las transacciones en
+curso sin bloquear a nadie.
+
+Uso: python migrate.py [status]
+"""
+
+import os
+import re
+import logging
+
+import psycopg2
+from psycopg2 import errors
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+# Clave del advisory lock (arbitraria, compartida por todos los pods)
+MIGRATION_LOCK_ID = 7248061
+# Una migración que no consigue sus locks en este tiempo falla y se reintenta,
+# en lugar de dejar en cola detrás de ella todas las consultas a la tabla
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+CONCURRENT_INDEX_RE = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+"
+    r"(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class MigrationInProgress(Exception):
+    """Otro proceso tiene el lock de migraciones"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def __repr__(self):
+        return f"Migration({self.version}, {self.name!r})"
+
+    @property
+    def sql(self):
+        with open(self.path, "r") as f:
+            return f.read()
+
+    @property
+    def transactional(self):
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    @property
+    def concurrent_index(self):
+        """Nombre del índice que crea con CREATE INDEX CONCURRENTLY, si lo hay"""
+        match = CONCURRENT_INDEX_RE.search(self.sql)
+        return match.group(1) if match else None
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Migraciones disponibles, ordenadas por versión"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append(
+                Migration(
+                    int(match.group(1)),
+                    match.group(2),
+                    os.path.join(directory, filename),
+                )
+            )
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Hay migraciones con la misma versión")
+    return migrations
+
+
+def current_version(conn):
+    """Última versión aplicada (0 si no hay ninguna o no existe la tabla)"""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cur.fetchone()[0]
+    except errors.UndefinedTable:
+        return 0
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def _applied_versions(cur):
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _index_valid(cur, name):
+    """True/False según pg_index.indisvalid, o None si el índice no existe"""
+    cur.execute(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _apply(conn, migration):
+    logger.info(f"Aplicando migración {migration.version} ({migration.name})...")
+    conn.autocommit = not migration.transactional
+    index = None if migration.transactional else migration.concurrent_index
+    cur = conn.cursor()
+    try:
+        if index:
+            cur.execute("SET lock_timeout = 0")
+            if _index_valid(cur, index) is False:
+                logger.warning(f"Borrando el índice no válido {index}")
+                # El nombre solo puede contener \w (CONCURRENT_INDEX_RE)
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+        cur.execute(migration.sql)
+        if index and not _index_valid(cur, index):
+            raise RuntimeError(f"El índice {index} no se ha creado correctamente")
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration.version, migration.name),
+        )
+        if migration.transactional:
+            conn.commit()
+    except Exception:
+        if migration.transactional:
+            conn.rollback()
+        raise
+    finally:
+        if index:
+            cur.execute("SET lock_timeout = %s", (MIGRATION_LOCK_TIMEOUT,))
+        cur.close()
+        conn.autocommit = False
+
+
+def migrate(conn, migrations=None):
+    """
+    Aplica las migraciones pendientes y devuelve las versiones aplicadas.
+    Lanza MigrationInProgress si otro proceso está migrando.
+    """
+    migrations = load_migrations() if migrations is None else migrations
+    latest = migrations[-1].version if migrations else 0
+
+    # Camino rápido: una sola consulta cuando el esquema está al día
+    if current_version(conn) >= latest:
+        return []
+
+    # Lock de sesión (no de transacción): se mantiene entre migraciones con
+    # y sin transacción
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    if not cur.fetchone()[0]:
+        cur.close()
+        conn.autocommit = False
+        raise MigrationInProgress("Otro pod está aplicando las migraciones")
+
+    applied = []
+    try:
+        cur.execute("SET lock_timeout = %s", (MIGRATION_LOCK_TIMEOUT,))
+        done = _applied_versions(cur)
+        conn.autocommit = False
+        for migration in migrations:
+            if migration.version not in done:
+                _apply(conn, migration)
+                applied.append(migration.version)
+    finally:
+        conn.autocommit = True
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        cur.close()
+        conn.autocommit = False
+
+    if applied:
+        logger.info(f"Migraciones aplicadas: {applied}")
+    return applied
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    connection = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT")),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+    try:
+        if sys.argv[1:] == ["status"]:
+            version = current_version(connection)
+            for m in load_migrations():
+                state = "aplicada" if m.version <= version else "pendiente"
+                print(f"{m.version:04d} {m.name}: {state}")
+        else:
+            migrate(connection)
+    finally:
+        connection.close()
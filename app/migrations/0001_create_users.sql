@@ -5,4 +5,3 @@ CREATE TABLE IF NOT EXISTS users (
     image_url VARCHAR(500),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
-
@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Paginación keyset del listado de usuarios (ORDER BY created_at DESC, id DESC).
+-- CONCURRENTLY no bloquea las lecturas ni las escrituras mientras se construye.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_at_id ON users (created_at DESC, id DESC);
@@ -0,0 +1,3 @@
+-- Trigramas para la búsqueda de usuarios por subcadena/prefijo (LIKE '%...%').
+-- pg_trgm es una extensión "trusted" (PostgreSQL 13+): basta con ser dueño de la BD.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -0,0 +1,3 @@
+-- migrate:no-transaction
+-- Búsqueda sin distinguir mayúsculas: lower(name) LIKE '%texto%' usa este índice.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_name_trgm ON users USING gin (lower(name) gin_trgm_ops);
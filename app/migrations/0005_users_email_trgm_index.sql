@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Igual que idx_users_name_trgm para el email; las dos condiciones del OR se
+-- resuelven con un BitmapOr de ambos índices.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_email_trgm ON users USING gin (lower(email) gin_trgm_ops);
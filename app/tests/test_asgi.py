@@ -0,0 +1,302 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import sys
+import os
+import time
+import threading
+
+# Añadir el directorio padre al path para importar app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from starlette.testclient import TestClient
+
+from asgi import (
+    application,
+    run_health_checks_async,
+    get_health_snapshot_async,
+    invalidate_health_cache_async,
+    fetch_users_page_async,
+    get_async_db_pool,
+    save_users_to_cache_async,
+    check_minio_async,
+    _timed_check,
+)
+from app import users_page_key, encode_cursor, fragment_cache, USERS_VERSION_KEY
+from fakes import AsyncFakeRedis
+
+
+class FakeConnection:
+    def __init__(self, rows=()):
+        self.fetch = AsyncMock(return_value=list(rows))
+        self.fetchval = AsyncMock(return_value=1)
+
+
+class FakePool:
+    """Pool asyncpg mínimo: acquire() como context manager asíncrono"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        yield self.conn
+
+
+def make_row(user_id, created_at=datetime(2025, 1, 1, 12, 0)):
+    return {
+        "id": user_id,
+        "name": f"User {user_id}",
+        "email": f"user{user_id}@example.com",
+        "image_url": None,
+        "created_at": created_at,
+    }
+
+
+@pytest.fixture
+def client():
+    """Cliente de pruebas de la aplicación ASGI"""
+    invalidate_health_cache_async()
+    fragment_cache.clear()
+    yield TestClient(application)
+    invalidate_health_cache_async()
+    fragment_cache.clear()
+
+
+def all_checks(**results):
+    """Parchea los checks asíncronos con resultados fijos (True por defecto)"""
+    names = ["postgres", "redis", "minio", "load_balancer"]
+    return [
+        patch(
+            f"asgi.check_{name}_async", AsyncMock(return_value=results.get(name, True))
+        )
+        for name in names
+    ]
+
+
+class TestAsyncHealth:
+    """Test: Health checks de la variante ASGI"""
+
+    def test_liveness(self, client):
+        """Test: /health responde sin comprobar dependencias"""
+        response = client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["status"] == "healthy"
+
+    def test_ready_when_dependencies_ok(self, client):
+        """Test: /health/ready devuelve 200 si PostgreSQL y MinIO responden"""
+        patches = all_checks()
+        for p in patches:
+            p.start()
+        try:
+            response = client.get("/health/ready")
+        finally:
+            for p in patches:
+                p.stop()
+        assert response.status_code == 200
+        assert response.json()["checks"]["postgres"] == "ok"
+
+    def test_not_ready_when_postgres_down(self, client):
+        """Test: /health/ready devuelve 503 si PostgreSQL falla"""
+        patches = all_checks(postgres=False)
+        for p in patches:
+            p.start()
+        try:
+            response = client.get("/health/ready")
+        finally:
+            for p in patches:
+                p.stop()
+        assert response.status_code == 503
+        assert response.json()["status"] == "not_ready"
+
+    def test_checks_run_concurrently(self):
+        """Test: Los checks se esperan a la vez, no uno detrás de otro"""
+
+        async def slow_check():
+            await asyncio.sleep(0.2)
+            return True
+
+        with patch("asgi.check_postgres_async", slow_check), patch(
+            "asgi.check_minio_async", slow_check
+        ), patch("asgi.check_load_balancer_async", slow_check), patch(
+            "asgi.check_redis_async", slow_check
+        ):
+            start = time.monotonic()
+            results = asyncio.run(run_health_checks_async())
+            elapsed = time.monotonic() - start
+
+        assert all(results.values())
+        assert elapsed < 0.5
+
+    def test_slow_check_counts_as_failed(self):
+        """Test: Un check que supera HEALTH_CHECK_TIMEOUT cuenta como fallido"""
+
+        async def hanging_check():
+            await asyncio.sleep(5)
+            return True
+
+        with patch("asgi.HEALTH_CHECK_TIMEOUT", 0.05), patch(
+            "asgi.check_postgres_async", hanging_check
+        ), patch("asgi.check_minio_async", AsyncMock(return_value=True)), patch(
+            "asgi.check_load_balancer_async", AsyncMock(return_value=True)
+        ), patch(
+            "asgi.check_redis_async", AsyncMock(return_value=True)
+        ):
+            results = asyncio.run(run_health_checks_async())
+
+        assert results["postgres"] is False
+        assert results["minio"] is True
+
+    def test_hung_minio_check_not_resubmitted(self):
+        """Test: Mientras el hilo del check de MinIO siga colgado no se lanza otro"""
+        release = threading.Event()
+        calls = []
+
+        def hung_check():
+            calls.append(1)
+            return release.wait(5)
+
+        async def two_rounds():
+            first = await _timed_check("minio", check_minio_async)
+            second = await _timed_check("minio", check_minio_async)
+            release.set()
+            return first, second, await check_minio_async()
+
+        with patch("asgi.HEALTH_CHECK_TIMEOUT", 0.05), patch(
+            "asgi.check_minio", hung_check
+        ):
+            results = asyncio.run(two_rounds())
+
+        assert results == (False, False, True)
+        assert len(calls) == 1
+
+    def test_snapshot_is_reused(self, client):
+        """Test: Los checks no se repiten dentro de HEALTH_CACHE_TTL"""
+        with patch(
+            "asgi.run_health_checks_async",
+            AsyncMock(
+                return_value={"postgres": True, "minio": True, "load_balancer": True}
+            ),
+        ) as mock_run:
+            asyncio.run(get_health_snapshot_async())
+            asyncio.run(get_health_snapshot_async())
+        assert mock_run.await_count == 1
+
+    def test_index_renders_statuses(self, client):
+        """Test: La página principal muestra el estado de los servicios"""
+        patches = all_checks(minio=False)
+        for p in patches:
+            p.start()
+        try:
+            response = client.get("/")
+        finally:
+            for p in patches:
+                p.stop()
+        assert response.status_code == 200
+        assert "No disponible" in response.text
+
+
+class TestAsyncUsers:
+    """Test: Listado de usuarios con asyncpg y redis.asyncio"""
+
+    def test_users_from_database_then_cache(self, client):
+        """Test: Un fallo de caché consulta la BD y la siguiente petición usa Redis"""
+        conn = FakeConnection([make_row(2), make_row(1)])
+        fake_redis = AsyncFakeRedis()
+        with patch(
+            "asgi.get_async_db_pool", AsyncMock(return_value=FakePool(conn))
+        ), patch("asgi.get_async_redis", return_value=fake_redis):
+            first = client.get("/users")
+            second = client.get("/users")
+
+        assert first.status_code == 200
+        assert "user2@example.com" in first.text
+        assert conn.fetch.await_count == 1
+        assert users_page_key(None, 50) in fake_redis.sync.data
+        assert "user1@example.com" in second.text
+
+    def test_request_id_shared_with_flask(self, client):
+        """Test: Las rutas delegadas en Flask usan el X-Request-ID del middleware"""
+        response = client.get("/api/users?format=xml", headers={"X-Request-ID": "r-1"})
+        generated = client.get("/health")
+
+        assert response.status_code == 400
+        assert response.headers.get_list("X-Request-ID") == ["r-1"]
+        assert len(generated.headers["X-Request-ID"]) == 32
+
+    def test_page_from_older_version_saved_stale(self):
+        """Test: La página consultada antes de una escritura no queda fresca"""
+        fake_redis = AsyncFakeRedis()
+        fake_redis.sync.hset(USERS_VERSION_KEY, "n", 2)
+        fake_redis.sync.hset(USERS_VERSION_KEY, "ts", 2000)
+        page = {"users": [], "next_cursor": None}
+        cursor = encode_cursor(datetime(2025, 6, 1), 20)
+        with patch("asgi.get_async_redis", return_value=fake_redis):
+            asyncio.run(save_users_to_cache_async(page, version=(1, 1000)))
+            asyncio.run(save_users_to_cache_async(page, cursor, version=(2, 2000)))
+
+        key = users_page_key(None, 50)
+        assert key in fake_redis.sync.data
+        assert f"{key}:fresh" not in fake_redis.sync.data
+        assert f"{users_page_key(cursor, 50)}:fresh" in fake_redis.sync.data
+
+    def test_users_not_modified(self, client):
+        """Test: Con el ETag vigente se devuelve 304 sin consultar la BD"""
+        conn = FakeConnection([make_row(1)])
+        fake_redis = AsyncFakeRedis()
+        with patch(
+            "asgi.get_async_db_pool", AsyncMock(return_value=FakePool(conn))
+        ), patch("asgi.get_async_redis", return_value=fake_redis):
+            etag = client.get("/users").headers["ETag"]
+            response = client.get("/users", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert conn.fetch.await_count == 1
+
+    def test_users_error_is_rendered(self, client):
+        """Test: Un error de BD se muestra en la página"""
+        with patch(
+            "asgi.get_async_db_pool", AsyncMock(side_effect=Exception("DB Error"))
+        ), patch("asgi.get_async_redis", return_value=None):
+            response = client.get("/users")
+        assert response.status_code == 200
+        assert "DB Error" in response.text
+
+    def test_pool_idle_timeout(self):
+        """Test: asyncpg cierra por inactividad (DB_POOL_MAX_IDLE), no por edad"""
+        with patch("asgi._db_pool", None), patch("asgi.DB_POOL_MAX_IDLE", 60), patch(
+            "asgi.asyncpg.create_pool", AsyncMock()
+        ) as mock_create:
+            asyncio.run(get_async_db_pool())
+
+        assert mock_create.await_args.kwargs["max_inactive_connection_lifetime"] == 60
+
+    def test_keyset_query_uses_cursor(self):
+        """Test: El cursor se traduce en parámetros posicionales de asyncpg"""
+        conn = FakeConnection([make_row(i) for i in range(3, 0, -1)])
+        cursor = encode_cursor(datetime(2025, 6, 1), 20)
+        with patch("asgi.get_async_db_pool", AsyncMock(return_value=FakePool(conn))):
+            page = asyncio.run(fetch_users_page_async(cursor, 2))
+
+        sql, created_at, last_id, limit = conn.fetch.await_args.args
+        assert "(created_at, id) < ($1, $2)" in sql
+        assert (created_at, last_id, limit) == (datetime(2025, 6, 1), 20, 3)
+        assert len(page["users"]) == 2
+        assert page["next_cursor"] is not None
+
+
+class TestFlaskFallback:
+    """Test: Las rutas no portadas se delegan en la aplicación Flask"""
+
+    def test_metrics_served_by_flask(self, client):
+        """Test: /metrics lo atiende Flask a través del adaptador WSGI"""
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert "users_cache_requests_total" in response.text
+
+    def test_flask_route_not_found(self, client):
+        """Test: Las rutas desconocidas devuelven el 404 de Flask"""
+        response = client.get("/no-existe")
+        assert response.status_code == 404
@@ -0,0 +1,202 @@
+import pytest
+import sys
+import os
+import json
+import time
+from argparse import Namespace
+from datetime import datetime
+
+# Añadir el directorio padre al path para importar app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench import (
+    FakeTarget,
+    FakeUsersDB,
+    Workload,
+    compare,
+    main,
+    percentile,
+    prepare_users_paginated,
+    run_workload,
+    summarize,
+)
+
+
+@pytest.fixture
+def fake_target():
+    """App en proceso con backends simulados sin latencia"""
+    target = FakeTarget(users=120, latency_db=0, latency_redis=0, latency_minio=0)
+    target.flush_cache()
+    yield target
+    target.flush_cache()
+    target.close()
+
+
+def report(p95, rps):
+    return {"results": {"users_warm": {"rps": rps, "latency_ms": {"p95": p95}}}}
+
+
+class TestBenchStats:
+    """Tests para el cálculo de percentiles y la comparación de resultados"""
+
+    def test_percentile_nearest_rank(self):
+        """Test: Percentiles por rango más cercano"""
+        values = list(range(1, 101))
+
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 99) == 99
+        assert percentile([7], 99) == 7
+        assert percentile([], 50) is None
+
+    def test_summarize(self):
+        """Test: RPS y latencias en milisegundos"""
+        result = summarize([0.001, 0.002, 0.003, 0.004], errors=1, elapsed=2)
+
+        assert result["requests"] == 4
+        assert result["errors"] == 1
+        assert result["rps"] == 2.0
+        assert result["latency_ms"]["p50"] == 2.0
+        assert result["latency_ms"]["max"] == 4.0
+
+    def test_run_workload_counts_errors(self):
+        """Test: Los códigos >= 400 y las excepciones cuentan como error"""
+
+        def send(i):
+            if i == 3:
+                raise RuntimeError("caído")
+            return 500 if i % 2 else 200
+
+        result = run_workload(Workload(send, size=6), total=10, concurrency=3)
+
+        assert result["requests"] == 6
+        assert result["errors"] == 3
+
+    def test_compare_detects_regressions(self):
+        """Test: Se detectan empeoramientos de p95 o de RPS"""
+        assert compare(report(10, 100), report(11, 95), 0.2) == []
+        assert len(compare(report(10, 100), report(13, 100), 0.2)) == 1
+        assert len(compare(report(10, 100), report(10, 70), 0.2)) == 1
+
+
+class TestFakeBackends:
+    """Tests para los backends simulados del benchmark"""
+
+    def test_keyset_pages(self):
+        """Test: Las páginas simuladas siguen el orden (created_at, id) descendente"""
+        db = FakeUsersDB(users=5)
+
+        first = db.page(2)
+        second = db.page(2, (first[-1]["created_at"], first[-1]["id"]))
+
+        assert [u["id"] for u in first] == [5, 4]
+        assert [u["id"] for u in second] == [3, 2]
+
+    def test_insert_and_delete(self):
+        """Test: Altas y bajas mantienen el índice ordenado"""
+        db = FakeUsersDB(users=2)
+        db.insert("Ana", "bench-ana@example.com", None, datetime(2030, 1, 1))
+
+        db.execute("DELETE FROM users WHERE id = ANY(%s) RETURNING id", ([1],))
+
+        assert [u["id"] for u in db.page(10)] == [3, 2]
+
+    def test_paginated_walks_pages(self, fake_target):
+        """Test: users_paginated recorre páginas distintas con el cursor"""
+        workload = prepare_users_paginated(
+            fake_target, Namespace(page_size=50, pages=5)
+        )
+
+        statuses = [workload.send(i) for i in range(3)]
+
+        assert statuses == [200, 200, 200]
+
+
+class TestBenchRun:
+    """Tests de una ejecución completa contra los backends simulados"""
+
+    def test_close_drains_background_jobs(self, fake_target):
+        """Test: Al cerrar se esperan las miniaturas pendientes con el MinIO simulado"""
+        app_module = fake_target.app_module
+        done = []
+        app_module._get_thumbnail_executor().submit(
+            lambda: time.sleep(0.05) or done.append(True)
+        )
+
+        fake_target.close()
+
+        assert done == [True]
+        assert app_module._thumbnail_executor is None
+
+    def test_fake_run_writes_json(self, tmp_path, capsys):
+        """Test: Todos los escenarios se ejecutan sin errores y se guarda el JSON"""
+        output = tmp_path / "result.json"
+
+        code = main(
+            [
+                "--fake",
+                "--requests",
+                "6",
+                "--concurrency",
+                "2",
+                "--warmup",
+                "2",
+                "--seed-users",
+                "60",
+                "--latency-db",
+                "0",
+                "--latency-redis",
+                "0",
+                "--latency-minio",
+                "0",
+                "--image-size",
+                "16",
+                "--output",
+                str(output),
+            ]
+        )
+
+        result = json.loads(output.read_text())
+        assert code == 0
+        assert set(result["results"]) == {
+            "index",
+            "health_ready",
+            "users_warm",
+            "users_cold",
+            "users_paginated",
+            "users_add",
+            "users_delete",
+        }
+        for name, stats in result["results"].items():
+            assert stats["errors"] == 0, name
+            assert stats["requests"] == 6, name
+        assert "users_warm" in capsys.readouterr().out
+
+    def test_compare_fails_on_regression(self, tmp_path):
+        """Test: Con --compare el proceso falla si hay regresión"""
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(report(0.000001, 10**9)))
+
+        code = main(
+            [
+                "--fake",
+                "--scenarios",
+                "users_warm",
+                "--requests",
+                "5",
+                "--warmup",
+                "0",
+                "--latency-db",
+                "0",
+                "--latency-redis",
+                "0",
+                "--latency-minio",
+                "0",
+                "--output",
+                str(tmp_path / "new.json"),
+                "--compare",
+                str(baseline),
+            ]
+        )
+
+        assert code == 1
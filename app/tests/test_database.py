@@ -2,43 +2,173 @@ import pytest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import time
+import json
+import psycopg2
+from datetime import datetime
 from io import BytesIO
+from collections import deque
 
 # Añadir el directorio padre al path para importar app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from app import app, get_db
+from app import app, get_db, close_db_pool, ConnectionPool, PoolTimeout
+from app import encode_cursor, decode_cursor, get_minio, stream_size
+from app import generate_thumbnail, thumbnail_key, thumbnail_attempts, THUMBNAIL_SIZE
+from app import import_users, parse_import_rows, import_format
+from app import delete_users, remove_objects, retry_object_deletions, DELETE_RETRY_KEY
+from app import queue_object_deletions
+from app import upload_token, sweep_pending_uploads, PENDING_UPLOADS_KEY
+from app import invalidate_users_cache, static_fingerprint, fragment_cache
+from app import save_users_to_cache, users_page_key, USERS_PAGE_SIZE
+from app import get_users_fragment, get_users_version, CACHE_STALE
+from app import write_through_users_cache, users_http_headers
+from app import timed, metrics_registry
+from fakes import FakeRedis
+from PIL import Image
 
 
 @pytest.fixture
 def client():
     """Fixture para el cliente de pruebas de Flask"""
     app.config["TESTING"] = True
+    fragment_cache.clear()
+    thumbnail_attempts.clear()
     with app.test_client() as client:
         yield client
+    fragment_cache.clear()
+    thumbnail_attempts.clear()
+
+
+@pytest.fixture(autouse=True)
+def mock_schedule_thumbnail():
+    """Fixture que evita generar miniaturas en hilos de fondo durante los tests"""
+    with patch("app.schedule_thumbnail") as mock_schedule:
+        yield mock_schedule
+
+
+@pytest.fixture
+def fresh_pool():
+    """Fixture que garantiza un pool de conexiones nuevo en cada test"""
+    close_db_pool()
+    yield
+    close_db_pool()
+
+
+def make_conn():
+    """Crea una conexión simulada abierta"""
+    conn = MagicMock()
+    conn.closed = 0
+    return conn
 
 
 class TestDatabaseConnection:
     """Tests para la conexión a la base de datos"""
 
     @patch("app.psycopg2.connect")
-    def test_get_db_success(self, mock_connect):
+    def test_get_db_success(self, mock_connect, fresh_pool):
         """Test: Conexión exitosa a la base de datos"""
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
+        mock_connect.side_effect = lambda **kwargs: make_conn()
 
-        conn = get_db()
+        with get_db() as conn:
+            assert conn is not None
 
-        assert conn is not None
         mock_connect.assert_called_once()
 
     @patch("app.psycopg2.connect")
-    def test_get_db_failure(self, mock_connect):
+    def test_get_db_failure(self, mock_connect, fresh_pool):
         """Test: Fallo en la conexión a la base de datos"""
         mock_connect.side_effect = Exception("Database connection error")
 
         with pytest.raises(Exception):
-            get_db()
+            with get_db():
+                pass
+
+    @patch("app.psycopg2.connect")
+    def test_get_db_reuses_connection(self, mock_connect, fresh_pool):
+        """Test: Las conexiones se reutilizan entre peticiones"""
+        mock_connect.side_effect = lambda **kwargs: make_conn()
+
+        with get_db() as first:
+            pass
+        with get_db() as second:
+            pass
+
+        assert first is second
+        mock_connect.assert_called_once()
+        first.rollback.assert_called()
+
+
+class TestConnectionPool:
+    """Tests para el pool de conexiones PostgreSQL"""
+
+    @patch("app.psycopg2.connect")
+    def test_pool_timeout_when_exhausted(self, mock_connect):
+        """Test: Se lanza PoolTimeout si no quedan conexiones libres"""
+        mock_connect.side_effect = lambda **kwargs: make_conn()
+        pool = ConnectionPool(0, 1, 0.05, 0, 30)
+
+        conn = pool.getconn()
+        with pytest.raises(PoolTimeout):
+            pool.getconn()
+
+        pool.putconn(conn)
+        assert pool.getconn() is conn
+
+    @patch("app.psycopg2.connect")
+    def test_pool_discards_expired_connection(self, mock_connect):
+        """Test: Las conexiones que superan su vida máxima se reemplazan"""
+        mock_connect.side_effect = lambda **kwargs: make_conn()
+        pool = ConnectionPool(0, 2, 1, 0.01, 30)
+
+        conn = pool.getconn()
+        pool.putconn(conn)
+        time.sleep(0.02)
+        new_conn = pool.getconn()
+
+        assert new_conn is not conn
+        conn.close.assert_called_once()
+
+    @patch("app.psycopg2.connect")
+    def test_pool_health_check_on_borrow(self, mock_connect):
+        """Test: Una conexión que no responde al prestarla se descarta"""
+        mock_connect.side_effect = lambda **kwargs: make_conn()
+        pool = ConnectionPool(1, 2, 1, 0, 0)
+
+        broken = pool._idle[0][0]
+        broken.cursor.return_value.execute.side_effect = Exception("server closed")
+        conn = pool.getconn()
+
+        assert conn is not broken
+        assert mock_connect.call_count == 2
+
+    @patch("app.psycopg2.connect")
+    def test_pool_discards_closed_connection_on_return(self, mock_connect):
+        """Test: Una conexión cerrada no vuelve al pool"""
+        mock_connect.side_effect = lambda **kwargs: make_conn()
+        pool = ConnectionPool(0, 1, 1, 0, 30)
+
+        conn = pool.getconn()
+        conn.closed = 1
+        pool.putconn(conn)
+
+        assert pool._idle == []
+
+    @patch("app.get_db_pool")
+    def test_query_timeout_keeps_connection(self, mock_get_pool):
+        """Test: Un statement_timeout no descarta la conexión; un corte sí"""
+        pool = mock_get_pool.return_value
+
+        with pytest.raises(psycopg2.errors.QueryCanceled):
+            with get_db():
+                raise psycopg2.errors.QueryCanceled()
+        pool.putconn.assert_called_once_with(pool.getconn.return_value)
+
+        pool.reset_mock()
+        with pytest.raises(psycopg2.OperationalError):
+            with get_db():
+                raise psycopg2.OperationalError("server closed the connection")
+        pool.putconn.assert_called_once_with(pool.getconn.return_value, discard=True)
 
 
 class TestUsersEndpoint:
@@ -71,7 +201,7 @@ class TestUsersEndpoint:
             },
         ]
         mock_conn.cursor.return_value = mock_cursor
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         response = client.get("/users")
 
@@ -82,20 +212,57 @@ class TestUsersEndpoint:
     def test_users_list_from_cache(self, mock_cache, client):
         """Test: Listar usuarios desde caché"""
         # Mock caché con datos
-        cached_users = [
+        cached_page = {
+            "users": [
+                {
+                    "id": 1,
+                    "name": "Juan",
+                    "email": "juan@example.com",
+                    "image_url": None,
+                    "created_at": "2025-01-01T10:00:00",
+                },
+            ],
+            "next_cursor": None,
+        }
+        mock_cache.return_value = (cached_page, True)
+
+        response = client.get("/users")
+
+        assert response.status_code == 200
+        assert b"juan@example.com" in response.data
+
+    @patch("app.save_users_to_cache")
+    @patch("app.get_users_from_cache")
+    @patch("app.get_db")
+    def test_users_keyset_pagination(self, mock_get_db, mock_cache, mock_save, client):
+        """Test: La consulta usa el cursor y pide una fila extra"""
+        mock_cache.return_value = (None, False)
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
             {
-                "id": 1,
-                "name": "Juan",
-                "email": "juan@example.com",
+                "id": i,
+                "name": f"U{i}",
+                "email": f"u{i}@example.com",
                 "image_url": None,
-                "created_at": "2025-01-01T10:00:00",
-            },
+                "created_at": datetime(2025, 1, i),
+            }
+            for i in (3, 2, 1)
         ]
-        mock_cache.return_value = (cached_users, True)
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_db.return_value.__enter__.return_value = mock_conn
+        cursor = encode_cursor(datetime(2025, 1, 4), 4)
 
-        response = client.get("/users")
+        response = client.get(f"/users?cursor={cursor}&limit=2")
 
         assert response.status_code == 200
+        sql, params = mock_cursor.execute.call_args[0]
+        assert "(created_at, id) < (%s, %s)" in sql
+        assert params == (datetime(2025, 1, 4), 4, 3)
+        page = mock_save.call_args[0][0]
+        assert [u["id"] for u in page["users"]] == [3, 2]
+        assert decode_cursor(page["next_cursor"]) == (datetime(2025, 1, 2), 2)
+        assert page["next_cursor"].encode() in response.data
 
     @patch("app.get_users_from_cache")
     @patch("app.get_db")
@@ -113,7 +280,7 @@ class TestUsersEndpoint:
 class TestAddUser:
     """Tests para agregar usuarios"""
 
-    @patch("app.invalidate_users_cache")
+    @patch("app.write_through_users_cache")
     @patch("app.get_db")
     def test_add_user_without_image(self, mock_get_db, mock_invalidate, client):
         """Test: Agregar usuario sin imagen"""
@@ -121,7 +288,7 @@ class TestAddUser:
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_conn.cursor.return_value = mock_cursor
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         response = client.post(
             "/users/add",
@@ -131,10 +298,11 @@ class TestAddUser:
 
         assert response.status_code == 302  # Redirect
         mock_cursor.execute.assert_called_once()
+        assert "RETURNING" in mock_cursor.execute.call_args[0][0]
         mock_conn.commit.assert_called_once()
         mock_invalidate.assert_called_once()
 
-    @patch("app.invalidate_users_cache")
+    @patch("app.write_through_users_cache")
     @patch("app.get_minio")
     @patch("app.get_db")
     def test_add_user_with_image(
@@ -145,7 +313,7 @@ class TestAddUser:
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_conn.cursor.return_value = mock_cursor
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         # Mock MinIO
         mock_minio = MagicMock()
@@ -183,26 +351,399 @@ class TestAddUser:
         assert response.status_code == 302
 
 
+class TestMinioUploads:
+    """Tests para la subida de imágenes a MinIO"""
+
+    def test_stream_size_keeps_position(self):
+        """Test: Se obtiene el tamaño sin consumir el stream"""
+        stream = BytesIO(b"0123456789")
+        stream.read(2)
+
+        assert stream_size(stream) == 8
+        assert stream.tell() == 2
+
+    @patch("app.Minio")
+    def test_get_minio_is_shared(self, mock_minio):
+        """Test: El cliente MinIO (y su pool HTTP) se reutiliza"""
+        with patch("app._minio_pid", None), patch("app._minio_client", None):
+            first = get_minio()
+            second = get_minio()
+
+        assert first is second
+        mock_minio.assert_called_once()
+        assert mock_minio.call_args.kwargs["http_client"] is not None
+
+    @patch("app.write_through_users_cache")
+    @patch("app.get_minio")
+    @patch("app.get_db")
+    def test_upload_uses_known_length(
+        self, mock_get_db, mock_get_minio, mock_write_through, client
+    ):
+        """Test: La subida indica la longitud en lugar de length=-1"""
+        mock_minio = MagicMock()
+        mock_get_minio.return_value = mock_minio
+
+        client.post(
+            "/users/add",
+            data={
+                "name": "Test User",
+                "email": "test@example.com",
+                "image": (BytesIO(b"fake image data"), "test.jpg"),
+            },
+            content_type="multipart/form-data",
+        )
+
+        assert mock_minio.put_object.call_args.kwargs["length"] == len(
+            b"fake image data"
+        )
+
+    @patch("app.UPLOAD_ASYNC_THRESHOLD", 4)
+    @patch("app._get_upload_executor")
+    @patch("app.write_through_users_cache")
+    @patch("app.get_minio")
+    @patch("app.get_db")
+    def test_large_upload_runs_in_background(
+        self, mock_get_db, mock_get_minio, mock_write_through, mock_executor, client
+    ):
+        """Test: Las imágenes grandes se suben después de guardar el usuario"""
+        mock_minio = MagicMock()
+        mock_get_minio.return_value = mock_minio
+        mock_executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+        uploaded = []
+        mock_minio.put_object.side_effect = lambda bucket, name, stream, **kw: (
+            uploaded.append(stream.read())
+        )
+
+        response = client.post(
+            "/users/add",
+            data={
+                "name": "Test User",
+                "email": "test@example.com",
+                "image": (BytesIO(b"fake image data"), "test.jpg"),
+            },
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 302
+        mock_get_db.return_value.__enter__.return_value.commit.assert_called_once()
+        mock_executor.return_value.submit.assert_called_once()
+        assert uploaded == [b"fake image data"]
+
+
+class TestPresignedUploads:
+    """Tests para la subida directa a MinIO con URL prefirmada"""
+
+    OBJECT_NAME = "123e4567-e89b-12d3-a456-426614174000_foto.jpg"
+
+    def confirm(self, client, **extra):
+        """Confirma la subida de OBJECT_NAME con un token válido"""
+        data = {
+            "name": "U",
+            "email": "u@example.com",
+            "object_name": self.OBJECT_NAME,
+            "upload_token": upload_token(self.OBJECT_NAME, int(time.time()) + 60),
+        }
+        data.update(extra)
+        return client.post("/users/confirm", json=data)
+
+    @patch("app.get_redis")
+    @patch("app.get_minio_signer")
+    def test_upload_url_issued(self, mock_signer, mock_get_redis, client):
+        """Test: Se devuelve una URL prefirmada para el bucket"""
+        fake_redis = FakeRedis()
+        mock_get_redis.return_value = fake_redis
+        mock_signer.return_value.presigned_put_object.return_value = "http://signed"
+
+        response = client.post("/users/upload-url", json={"filename": "foto.jpg"})
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body["upload_url"] == "http://signed"
+        assert body["object_name"].endswith("_foto.jpg")
+        assert body["upload_token"]
+        bucket, object_name = mock_signer.return_value.presigned_put_object.call_args[0]
+        assert bucket == "user-images"
+        assert object_name == body["object_name"]
+        assert object_name in fake_redis.zsets[PENDING_UPLOADS_KEY]
+
+    def test_upload_url_rejects_extension(self, client):
+        """Test: No se firman URLs para archivos que no son imágenes"""
+        response = client.post("/users/upload-url", json={"filename": "script.sh"})
+
+        assert response.status_code == 400
+
+    @patch("app.image_in_use", return_value=False)
+    @patch("app.create_user")
+    @patch("app.get_minio")
+    def test_confirm_creates_user(self, mock_get_minio, mock_create, _, client):
+        """Test: Al confirmar se comprueba el objeto y se crea el usuario"""
+        mock_get_minio.return_value.stat_object.return_value = MagicMock(
+            size=1024, content_type="image/jpeg"
+        )
+        mock_create.return_value = {"id": 1, "name": "Test User"}
+
+        response = self.confirm(client, name="Test User", email="test@example.com")
+
+        assert response.status_code == 201
+        mock_create.assert_called_once_with(
+            "Test User", "test@example.com", self.OBJECT_NAME
+        )
+
+    @patch("app.image_in_use", return_value=False)
+    @patch("app.create_user")
+    @patch("app.get_minio")
+    def test_confirm_missing_object(self, mock_get_minio, mock_create, _, client):
+        """Test: No se crea el usuario si la imagen no llegó a subirse"""
+        mock_get_minio.return_value.stat_object.side_effect = Exception("NoSuchKey")
+
+        response = self.confirm(client)
+
+        assert response.status_code == 400
+        mock_create.assert_not_called()
+
+    @patch("app.image_in_use", return_value=False)
+    @patch("app.create_user")
+    @patch("app.get_minio")
+    def test_confirm_rejects_oversized_object(
+        self, mock_get_minio, mock_create, _, client
+    ):
+        """Test: Un objeto demasiado grande se borra y se rechaza"""
+        mock_minio = mock_get_minio.return_value
+        mock_minio.stat_object.return_value = MagicMock(
+            size=100 * 1024 * 1024, content_type="image/jpeg"
+        )
+
+        response = self.confirm(client)
+
+        assert response.status_code == 413
+        mock_minio.remove_object.assert_called_once_with(
+            "user-images", self.OBJECT_NAME
+        )
+        mock_create.assert_not_called()
+
+    def test_confirm_rejects_arbitrary_object(self, client):
+        """Test: Solo se aceptan nombres de objeto generados por la app"""
+        response = self.confirm(client, object_name="../otro.jpg")
+
+        assert response.status_code == 400
+
+    @patch("app.create_user")
+    def test_confirm_requires_token(self, mock_create, client):
+        """Test: Sin el token de /users/upload-url (o con uno ajeno) se rechaza"""
+        other = upload_token("00000000-0000-0000-0000-000000000000_x.jpg", 2**40)
+        expired = upload_token(self.OBJECT_NAME, int(time.time()) - 1)
+
+        assert self.confirm(client, upload_token=None).status_code == 403
+        assert self.confirm(client, upload_token=other).status_code == 403
+        assert self.confirm(client, upload_token=expired).status_code == 403
+        mock_create.assert_not_called()
+
+    @patch("app.create_user")
+    @patch("app.get_db")
+    def test_confirm_rejects_assigned_object(self, mock_get_db, mock_create, client):
+        """Test: No se puede confirmar un objeto que ya tiene otro usuario"""
+        mock_cursor = mock_get_db.return_value.__enter__.return_value.cursor()
+        mock_cursor.fetchone.return_value = (1,)
+
+        response = self.confirm(client)
+
+        assert response.status_code == 409
+        mock_create.assert_not_called()
+
+    @patch("app.create_user")
+    @patch("app.get_minio")
+    @patch("app.get_redis")
+    def test_confirm_token_single_use(
+        self, mock_get_redis, mock_get_minio, mock_create, client
+    ):
+        """Test: El token solo confirma una vez: la segunda petición recibe 409"""
+        fake_redis = FakeRedis()
+        fake_redis.zadd(PENDING_UPLOADS_KEY, {self.OBJECT_NAME: time.time() + 60})
+        mock_get_redis.return_value = fake_redis
+        mock_get_minio.return_value.stat_object.return_value = MagicMock(
+            size=1024, content_type="image/jpeg"
+        )
+        mock_create.return_value = {"id": 1}
+
+        assert self.confirm(client).status_code == 201
+        assert self.confirm(client, email="otro@example.com").status_code == 409
+        mock_create.assert_called_once()
+
+    @patch("app.create_user")
+    @patch("app.get_minio")
+    @patch("app.get_redis")
+    def test_confirm_failure_releases_claim(
+        self, mock_get_redis, mock_get_minio, mock_create, client
+    ):
+        """Test: Si no se crea el usuario la subida vuelve a quedar pendiente"""
+        fake_redis = FakeRedis()
+        fake_redis.zadd(PENDING_UPLOADS_KEY, {self.OBJECT_NAME: time.time() + 60})
+        mock_get_redis.return_value = fake_redis
+        mock_get_minio.return_value.stat_object.return_value = MagicMock(
+            size=1024, content_type="image/jpeg"
+        )
+        mock_create.side_effect = psycopg2.IntegrityError()
+
+        response = self.confirm(client)
+
+        assert response.status_code == 409
+        assert self.OBJECT_NAME in fake_redis.zsets[PENDING_UPLOADS_KEY]
+
+    @patch("app.remove_objects")
+    @patch("app.get_db")
+    @patch("app.get_redis")
+    def test_sweep_unconfirmed_uploads(
+        self, mock_get_redis, mock_get_db, mock_remove, client
+    ):
+        """Test: Las subidas caducadas sin usuario se borran; las confirmadas no"""
+        fake_redis = FakeRedis()
+        mock_get_redis.return_value = fake_redis
+        now = int(time.time())
+        fake_redis.zadd(
+            PENDING_UPLOADS_KEY, {"huerfano.jpg": now - 120, "usado.jpg": now - 120}
+        )
+        fake_redis.zadd(PENDING_UPLOADS_KEY, {"pendiente.jpg": now + 300})
+        mock_cursor = mock_get_db.return_value.__enter__.return_value.cursor()
+        mock_cursor.fetchall.return_value = [("usado.jpg",)]
+        mock_remove.return_value = []
+
+        assert sweep_pending_uploads() == 2
+
+        mock_remove.assert_called_once_with(
+            ["huerfano.jpg", thumbnail_key("huerfano.jpg")]
+        )
+        assert list(fake_redis.zsets[PENDING_UPLOADS_KEY]) == ["pendiente.jpg"]
+
+
+class TestThumbnails:
+    """Tests para el pipeline de miniaturas"""
+
+    OBJECT_NAME = "123e4567-e89b-12d3-a456-426614174000_foto.png"
+
+    @patch("app.get_minio")
+    def test_generate_thumbnail(self, mock_get_minio):
+        """Test: Se genera un JPEG reducido bajo la clave derivada"""
+        original = BytesIO()
+        Image.new("RGBA", (800, 400), (255, 0, 0, 255)).save(original, "PNG")
+        mock_minio = mock_get_minio.return_value
+        mock_minio.get_object.return_value.read.return_value = original.getvalue()
+        stored = {}
+        mock_minio.put_object.side_effect = lambda bucket, key, data, **kw: (
+            stored.update(key=key, data=data.read(), **kw)
+        )
+
+        key = generate_thumbnail(self.OBJECT_NAME)
+
+        assert (
+            key
+            == f"thumbnails/{THUMBNAIL_SIZE}/123e4567-e89b-12d3-a456-426614174000_foto.jpg"
+        )
+        assert stored["key"] == key
+        assert stored["content_type"] == "image/jpeg"
+        assert stored["length"] == len(stored["data"])
+        with Image.open(BytesIO(stored["data"])) as thumbnail:
+            assert thumbnail.format == "JPEG"
+            assert thumbnail.size == (THUMBNAIL_SIZE, THUMBNAIL_SIZE // 2)
+
+    @patch("app.THUMBNAIL_MAX_PIXELS", 10000)
+    @patch("app.get_minio")
+    def test_thumbnail_rejects_huge_images(self, mock_get_minio):
+        """Test: Una imagen con demasiados píxeles se rechaza sin decodificarla"""
+        original = BytesIO()
+        Image.new("P", (200, 200)).save(original, "PNG")
+        mock_minio = mock_get_minio.return_value
+        mock_minio.get_object.return_value.read.return_value = original.getvalue()
+
+        with patch("app.ImageOps.exif_transpose") as mock_transpose:
+            with pytest.raises(ValueError):
+                generate_thumbnail(self.OBJECT_NAME)
+
+        mock_transpose.assert_not_called()
+        mock_minio.put_object.assert_not_called()
+
+    @patch("app.write_through_users_cache")
+    @patch("app.get_minio")
+    @patch("app.get_db")
+    def test_add_user_schedules_thumbnail(
+        self,
+        mock_get_db,
+        mock_get_minio,
+        mock_write_through,
+        mock_schedule_thumbnail,
+        client,
+    ):
+        """Test: Al añadir un usuario con imagen se encola su miniatura"""
+        client.post(
+            "/users/add",
+            data={
+                "name": "Test User",
+                "email": "test@example.com",
+                "image": (BytesIO(b"fake image data"), "test.jpg"),
+            },
+            content_type="multipart/form-data",
+        )
+
+        mock_schedule_thumbnail.assert_called_once()
+        assert mock_schedule_thumbnail.call_args[0][0].endswith("_test.jpg")
+
+    @patch("app.generate_thumbnail")
+    @patch("app.get_minio")
+    def test_lazy_thumbnail_existing(self, mock_get_minio, mock_generate, client):
+        """Test: Si la miniatura existe se redirige sin regenerarla"""
+        response = client.get(f"/users/thumbnail/{self.OBJECT_NAME}")
+
+        assert response.status_code == 302
+        assert response.location.endswith(thumbnail_key(self.OBJECT_NAME))
+        mock_generate.assert_not_called()
+
+    @patch("app.schedule_thumbnail")
+    @patch("app.generate_thumbnail")
+    @patch("app.get_minio")
+    def test_lazy_thumbnail_missing(
+        self, mock_get_minio, mock_generate, mock_schedule, client
+    ):
+        """Test: Si la miniatura no existe se encola y se sirve la original"""
+        mock_get_minio.return_value.stat_object.side_effect = Exception("NoSuchKey")
+
+        response = client.get(f"/users/thumbnail/{self.OBJECT_NAME}")
+
+        assert response.status_code == 302
+        assert response.location.endswith(f"/user-images/{self.OBJECT_NAME}")
+        mock_schedule.assert_called_once_with(self.OBJECT_NAME)
+        mock_generate.assert_not_called()
+
+    @patch("app.schedule_thumbnail")
+    @patch("app.get_minio")
+    def test_lazy_thumbnail_not_retried(self, mock_get_minio, mock_schedule, client):
+        """Test: Una miniatura encolada o fallida no se reintenta en cada petición"""
+        mock_get_minio.return_value.stat_object.side_effect = Exception("NoSuchKey")
+
+        for _ in range(3):
+            client.get(f"/users/thumbnail/{self.OBJECT_NAME}")
+
+        mock_schedule.assert_called_once_with(self.OBJECT_NAME)
+
+
 class TestDeleteUser:
     """Tests para eliminar usuarios"""
 
-    @patch("app.invalidate_users_cache")
+    @patch("app.write_through_users_cache")
     @patch("app.get_db")
     def test_delete_user_without_image(self, mock_get_db, mock_invalidate, client):
         """Test: Eliminar usuario sin imagen"""
         # Mock base de datos
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_cursor.fetchone.return_value = {"image_url": None}
+        mock_cursor.fetchone.return_value = {"id": 1, "image_url": None}
         mock_conn.cursor.return_value = mock_cursor
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         response = client.get("/users/delete/1", follow_redirects=False)
 
         assert response.status_code == 302
         mock_invalidate.assert_called_once()
 
-    @patch("app.invalidate_users_cache")
+    @patch("app.write_through_users_cache")
     @patch("app.get_minio")
     @patch("app.get_db")
     def test_delete_user_with_image(
@@ -212,18 +753,22 @@ class TestDeleteUser:
         # Mock base de datos
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_cursor.fetchone.return_value = {"image_url": "test_image.jpg"}
+        mock_cursor.fetchone.return_value = {"id": 1, "image_url": "test_image.jpg"}
         mock_conn.cursor.return_value = mock_cursor
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         # Mock MinIO
         mock_minio = MagicMock()
+        mock_minio.remove_objects.return_value = iter([])
         mock_get_minio.return_value = mock_minio
 
         response = client.get("/users/delete/1", follow_redirects=False)
 
         assert response.status_code == 302
-        mock_minio.remove_object.assert_called_once()
+        assert "RETURNING" in mock_cursor.execute.call_args[0][0]
+        bucket, objects = mock_minio.remove_objects.call_args[0]
+        removed = [obj._name for obj in objects]
+        assert removed == ["test_image.jpg", thumbnail_key("test_image.jpg")]
         mock_invalidate.assert_called_once()
 
     @patch("app.get_db")
@@ -234,3 +779,711 @@ class TestDeleteUser:
         response = client.get("/users/delete/1", follow_redirects=False)
 
         assert response.status_code == 302
+
+
+IMPORT_OBJECT = "123e4567-e89b-12d3-a456-426614174000_abc.jpg"
+CSV_USERS = (
+    "name,email,image_url\n"
+    "Ana,ana@example.com,\n"
+    f"Luis,luis@example.com,{IMPORT_OBJECT}\n"
+    ",sin-nombre@example.com,\n"
+    "Eva,eva@example.com,\n"
+)
+
+
+class TestBulkImport:
+    """Tests para la importación masiva de usuarios"""
+
+    def test_parse_csv(self):
+        """Test: Las filas CSV se validan y normalizan"""
+        rows = list(parse_import_rows(CSV_USERS.splitlines(keepends=True), "csv"))
+
+        assert rows == [
+            ("Ana", "ana@example.com", None),
+            ("Luis", "luis@example.com", IMPORT_OBJECT),
+            None,
+            ("Eva", "eva@example.com", None),
+        ]
+
+    def test_parse_ndjson(self):
+        """Test: Las líneas NDJSON mal formadas cuentan como inválidas"""
+        lines = [
+            '{"name": "Ana", "email": "ana@example.com"}\n',
+            "\n",
+            "{roto\n",
+            "[1]\n",
+        ]
+
+        rows = list(parse_import_rows(lines, "ndjson"))
+
+        assert rows == [("Ana", "ana@example.com", None), None, None]
+
+    def test_parse_rejects_foreign_values(self):
+        """Test: Rutas de objeto arbitrarias o valores que no son texto son inválidos"""
+        lines = [
+            '{"name": "Ana", "email": "ana@example.com", "image_url": "../x.png"}\n',
+            '{"name": 123, "email": "num@example.com"}\n',
+            '{"name": "Eva", "email": ["eva@example.com"]}\n',
+            '{"name": "Luis", "email": "luis@example.com", "image_url": 7}\n',
+        ]
+
+        assert list(parse_import_rows(lines, "ndjson")) == [None] * 4
+
+    @patch("app.invalidate_users_cache")
+    @patch("app._import_batch")
+    def test_import_counts_non_string_as_invalid(self, mock_batch, _):
+        """Test: Un valor no textual no aborta la importación"""
+        mock_batch.return_value = [(True, None)]
+        data = b'{"name": 123, "email": "a@example.com"}\n' + (
+            b'{"name": "Ana", "email": "ana@example.com"}\n'
+        )
+
+        stats = import_users(BytesIO(data), "ndjson")
+
+        assert (stats["invalid"], stats["inserted"]) == (1, 1)
+
+    def test_import_format(self):
+        """Test: El formato se deduce de la extensión o del Content-Type"""
+        assert import_format("users.csv") == "csv"
+        assert import_format("users.jsonl") == "ndjson"
+        assert import_format(content_type="application/x-ndjson") == "ndjson"
+        assert import_format("users.txt") is None
+
+    @patch("app.invalidate_users_cache")
+    @patch("app._import_batch")
+    def test_import_in_batches(self, mock_batch, mock_invalidate):
+        """Test: Se importa por lotes y la caché se invalida una vez por lote"""
+        created = datetime(2025, 1, 1)
+        # Primer lote: un email ya existente; segundo lote: todo nuevo
+        mock_batch.side_effect = [[(True, created)], [(True, created)]]
+
+        stats = import_users(BytesIO(CSV_USERS.encode()), "csv", batch_size=2)
+
+        assert mock_batch.call_count == 2
+        assert mock_invalidate.call_count == 2
+        mock_invalidate.assert_called_with(created)
+        assert stats["received"] == 4
+        assert stats["invalid"] == 1
+        assert stats["inserted"] == 2
+        assert stats["skipped"] == 1
+        assert "rows_per_sec" in stats
+
+    @patch("app.invalidate_users_cache")
+    @patch("app.get_db")
+    def test_batch_uses_copy_and_upsert(self, mock_get_db, mock_invalidate):
+        """Test: El lote se carga con COPY en staging y se vuelca con ON CONFLICT"""
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            (True, datetime(2025, 1, 1)),
+            (False, None),
+        ]
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_db.return_value.__enter__.return_value = mock_conn
+
+        stats = import_users(BytesIO(CSV_USERS.encode()), "csv", on_conflict="update")
+
+        copy_sql, buffer = mock_cursor.copy_expert.call_args[0]
+        assert copy_sql.startswith("COPY users_import")
+        assert f"luis@example.com,{IMPORT_OBJECT}" in buffer.getvalue()
+        insert_sql = mock_cursor.execute.call_args_list[-1][0][0]
+        assert "ON CONFLICT (email) DO UPDATE" in insert_sql
+        assert "u.image_url = i.image_url AND u.email <> i.email" in insert_sql
+        mock_conn.commit.assert_called_once()
+        # Una fila actualizada sin created_at obliga a invalidar todo
+        mock_invalidate.assert_called_once_with(None)
+        assert (stats["inserted"], stats["updated"], stats["skipped"]) == (1, 1, 1)
+
+    @patch("app.import_users")
+    def test_import_endpoint_with_file(self, mock_import, client):
+        """Test: El endpoint acepta un fichero y devuelve el resumen"""
+        mock_import.return_value = {"received": 3, "inserted": 3}
+
+        response = client.post(
+            "/users/import?on_conflict=update",
+            data={"file": (BytesIO(CSV_USERS.encode()), "users.csv")},
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 200
+        assert response.get_json()["inserted"] == 3
+        assert mock_import.call_args[0][1:] == ("csv", "update")
+
+    @patch("app.import_users")
+    def test_import_endpoint_raw_ndjson(self, mock_import, client):
+        """Test: El cuerpo NDJSON se procesa según su Content-Type"""
+        mock_import.return_value = {"received": 1}
+
+        response = client.post(
+            "/users/import",
+            data=b'{"name": "Ana", "email": "ana@example.com"}\n',
+            content_type="application/x-ndjson",
+        )
+
+        assert response.status_code == 200
+        assert mock_import.call_args[0][1] == "ndjson"
+
+    def test_import_endpoint_rejects_unknown_format(self, client):
+        """Test: Un formato desconocido devuelve 400"""
+        response = client.post("/users/import", data=b"x", content_type="text/plain")
+
+        assert response.status_code == 400
+
+
+class TestBulkDelete:
+    """Tests para el borrado masivo de usuarios"""
+
+    def deleted_rows(self, mock_get_db, rows):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = rows
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_db.return_value.__enter__.return_value = mock_conn
+        return mock_conn, mock_cursor
+
+    @patch("app.get_redis", return_value=None)
+    @patch("app.invalidate_users_cache")
+    @patch("app.get_minio")
+    @patch("app.get_db")
+    def test_delete_in_one_statement(
+        self, mock_get_db, mock_get_minio, mock_invalidate, mock_redis
+    ):
+        """Test: Un solo DELETE, una invalidación y un DeleteObjects"""
+        rows = [
+            {"id": 1, "image_url": "a.jpg", "created_at": datetime(2025, 3, 1)},
+            {"id": 2, "image_url": None, "created_at": datetime(2025, 1, 1)},
+        ]
+        mock_conn, mock_cursor = self.deleted_rows(mock_get_db, rows)
+        mock_get_minio.return_value.remove_objects.return_value = iter([])
+
+        result = delete_users(ids=[1, 2, 3])
+
+        mock_cursor.execute.assert_called_once()
+        sql, params = mock_cursor.execute.call_args[0]
+        assert "id = ANY(%s)" in sql and "RETURNING" in sql
+        assert params == ([1, 2, 3],)
+        mock_invalidate.assert_called_once_with(datetime(2025, 1, 1))
+        mock_get_minio.return_value.remove_objects.assert_called_once()
+        assert result == {"deleted": 2, "objects_removed": 2, "objects_queued": 0}
+
+    @patch("app.get_minio")
+    def test_remove_objects_in_batches(self, mock_get_minio):
+        """Test: Los objetos se borran en lotes de 1000"""
+        mock_get_minio.return_value.remove_objects.side_effect = (
+            lambda bucket, objs: iter([])
+        )
+
+        failed = remove_objects([f"obj-{i}" for i in range(2500)])
+
+        sizes = [
+            len(c.args[1])
+            for c in mock_get_minio.return_value.remove_objects.call_args_list
+        ]
+        assert sizes == [1000, 1000, 500]
+        assert failed == []
+
+    @patch("app.invalidate_users_cache")
+    @patch("app.get_redis")
+    @patch("app.get_minio")
+    @patch("app.get_db")
+    def test_failed_objects_are_queued(
+        self, mock_get_db, mock_get_minio, mock_get_redis, mock_invalidate
+    ):
+        """Test: Los objetos que no se pueden borrar se encolan en Redis"""
+        fake_redis = FakeRedis()
+        mock_get_redis.return_value = fake_redis
+        self.deleted_rows(
+            mock_get_db, [{"id": 1, "image_url": "a.jpg", "created_at": None}]
+        )
+        error = MagicMock()
+        error.name = "a.jpg"
+        mock_get_minio.return_value.remove_objects.return_value = iter([error])
+
+        result = delete_users(id_min=1, id_max=10)
+
+        mock_invalidate.assert_called_once_with(None)
+        assert result["objects_queued"] == 1
+        assert fake_redis.data[DELETE_RETRY_KEY] == ["a.jpg"]
+
+        # El reintento los vuelve a borrar y vacía la cola
+        mock_get_minio.return_value.remove_objects.return_value = iter([])
+        assert retry_object_deletions() == 1
+        assert fake_redis.data[DELETE_RETRY_KEY] == []
+
+    @patch("app.get_redis", return_value=None)
+    @patch("app.get_minio")
+    def test_minio_unavailable_queues_locally(self, mock_get_minio, mock_redis):
+        """Test: Sin Redis ni MinIO los borrados quedan en la cola del proceso"""
+        mock_get_minio.return_value.remove_objects.side_effect = Exception(
+            "MinIO caído"
+        )
+
+        with patch("app._local_delete_queue", deque()) as queue:
+            queue_object_deletions(remove_objects(["x.jpg"]))
+            assert list(queue) == ["x.jpg"]
+
+            # Un reintento fallido los deja en la cola
+            assert retry_object_deletions() == 0
+            assert list(queue) == ["x.jpg"]
+
+    @patch("app.delete_users")
+    def test_bulk_delete_endpoint(self, mock_delete, client):
+        """Test: El endpoint acepta una lista de ids"""
+        mock_delete.return_value = {
+            "deleted": 2,
+            "objects_removed": 0,
+            "objects_queued": 0,
+        }
+
+        response = client.post("/users/delete", json={"ids": [1, 2]})
+
+        assert response.status_code == 200
+        assert response.get_json()["deleted"] == 2
+        mock_delete.assert_called_once_with(ids=[1, 2])
+
+    def test_bulk_delete_endpoint_validation(self, client):
+        """Test: Peticiones sin ids válidos devuelven 400"""
+        assert client.post("/users/delete", json={"ids": ["1"]}).status_code == 400
+        assert (
+            client.post("/users/delete", json={"id_min": 5, "id_max": 1}).status_code
+            == 400
+        )
+        assert client.post("/users/delete", json={}).status_code == 400
+        too_many = {"id_min": 1, "id_max": 10**9}
+        assert client.post("/users/delete", json=too_many).status_code == 400
+
+
+def export_rows(*ids):
+    return [
+        {
+            "id": i,
+            "name": f"User {i}",
+            "email": f"u{i}@example.com",
+            "created_at": datetime(2025, 1, i),
+        }
+        for i in ids
+    ]
+
+
+class TestUsersApi:
+    """Tests para la exportación de usuarios en streaming"""
+
+    def mock_export(self, mock_get_db, blocks):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchmany.side_effect = blocks + [[]]
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_db.return_value.__enter__.return_value = mock_conn
+        return mock_conn, mock_cursor
+
+    @patch("app.get_db")
+    def test_ndjson_stream(self, mock_get_db, client):
+        """Test: NDJSON con una línea por usuario leída con cursor de servidor"""
+        mock_conn, mock_cursor = self.mock_export(
+            mock_get_db, [export_rows(1, 2), export_rows(3)]
+        )
+
+        response = client.get("/api/users?format=ndjson")
+
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [1, 2, 3]
+        assert json.loads(lines[0])["created_at"] == "2025-01-01T00:00:00"
+        assert mock_conn.cursor.call_args.kwargs["name"] == "users_export"
+        assert mock_cursor.fetchmany.call_count == 3
+
+    @patch("app.get_db")
+    def test_json_array_stream(self, mock_get_db, client):
+        """Test: El array JSON se emite por bloques y es válido"""
+        self.mock_export(mock_get_db, [export_rows(1, 2), export_rows(3)])
+
+        response = client.get("/api/users", headers={"Accept": "application/json"})
+
+        assert response.mimetype == "application/json"
+        assert [u["id"] for u in json.loads(response.get_data(as_text=True))] == [
+            1,
+            2,
+            3,
+        ]
+
+    @patch("app.get_db")
+    def test_empty_table(self, mock_get_db, client):
+        """Test: Sin usuarios se devuelve un array vacío"""
+        self.mock_export(mock_get_db, [])
+
+        response = client.get("/api/users?format=json")
+
+        assert json.loads(response.get_data(as_text=True)) == []
+
+    @patch("app.get_db")
+    def test_since_id(self, mock_get_db, client):
+        """Test: since_id filtra por id para sincronizaciones incrementales"""
+        mock_conn, mock_cursor = self.mock_export(mock_get_db, [export_rows(3)])
+
+        response = client.get("/api/users?format=ndjson&since_id=2")
+
+        assert response.status_code == 200
+        sql, params = mock_cursor.execute.call_args[0]
+        assert "id > %s" in sql
+        assert params == (2,)
+
+    @patch("app.get_db")
+    def test_database_error(self, mock_get_db, client):
+        """Test: Un error de BD antes de empezar devuelve 503"""
+        mock_get_db.side_effect = Exception("Database error")
+
+        response = client.get("/api/users")
+
+        assert response.status_code == 503
+
+    def test_invalid_params(self, client):
+        """Test: Parámetros no válidos devuelven 400"""
+        assert client.get("/api/users?format=xml").status_code == 400
+        assert client.get("/api/users?since_id=abc").status_code == 400
+
+
+class TestHttpCaching:
+    """Tests para ETag, Last-Modified y ficheros estáticos con huella"""
+
+    PAGE = {"users": [], "next_cursor": None}
+
+    @patch("app.get_redis")
+    def test_stale_page_without_validators(self, mock_get_redis, client):
+        """Test: La copia obsoleta se sirve sin ETag ni Last-Modified"""
+        fake_redis = FakeRedis()
+        mock_get_redis.return_value = fake_redis
+        save_users_to_cache(self.PAGE)
+        invalidate_users_cache()
+        # Otro worker tiene el lock y está recalculando la página
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        fake_redis.set(f"{key}:lock", "otro-pod")
+
+        response = client.get("/users")
+
+        assert response.status_code == 200
+        assert "ETag" not in response.headers
+        assert "Last-Modified" not in response.headers
+
+    @patch("app.fetch_users_page")
+    @patch("app.get_redis")
+    def test_page_read_before_write_not_fresh(self, mock_get_redis, mock_fetch, client):
+        """Test: Una página consultada antes de una escritura no se guarda fresca"""
+        fake_redis = FakeRedis()
+        mock_get_redis.return_value = fake_redis
+        added = {"id": 9, "name": "N", "created_at": "2025-06-01T00:00:00"}
+
+        def fetch_then_write(cursor, limit):
+            # La escritura llega mientras se consulta: no hay página que parchear
+            if mock_fetch.call_count == 1:
+                write_through_users_cache(added=added)
+            return self.PAGE
+
+        mock_fetch.side_effect = fetch_then_write
+
+        client.get("/users")
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        assert key in fake_redis.data
+        assert f"{key}:fresh" not in fake_redis.data
+
+        # La siguiente petición no la toma por la versión actual: la recalcula
+        response = client.get("/users")
+        assert mock_fetch.call_count == 2
+        assert f"{key}:fresh" in fake_redis.data
+        assert (
+            response.headers["ETag"] == users_http_headers(get_users_version())["ETag"]
+        )
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_etag_and_304(self, mock_get_redis, mock_cache, client):
+        """Test: Con el ETag vigente se devuelve 304 sin consultar la caché"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, True)
+
+        first = client.get("/users")
+        etag = first.headers["ETag"]
+        second = client.get("/users", headers={"If-None-Match": etag})
+
+        assert first.status_code == 200
+        assert etag.startswith('W/"')
+        assert "Last-Modified" in first.headers
+        assert "no-cache" in first.headers["Cache-Control"]
+        assert second.status_code == 304
+        assert second.headers["ETag"] == etag
+        mock_cache.assert_called_once()
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_write_changes_etag(self, mock_get_redis, mock_cache, client):
+        """Test: Tras una escritura el ETag anterior deja de valer"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, True)
+
+        etag = client.get("/users").headers["ETag"]
+        invalidate_users_cache()
+        response = client.get("/users", headers={"If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_if_modified_since(self, mock_get_redis, mock_cache, client):
+        """Test: If-Modified-Since igual a Last-Modified devuelve 304"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, True)
+
+        last_modified = client.get("/users").headers["Last-Modified"]
+        response = client.get("/users", headers={"If-Modified-Since": last_modified})
+
+        assert response.status_code == 304
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis", return_value=None)
+    def test_no_etag_without_redis(self, mock_get_redis, mock_cache, client):
+        """Test: Sin Redis no hay versión de datos ni ETag"""
+        mock_cache.return_value = (self.PAGE, False)
+
+        response = client.get("/users", headers={"If-None-Match": "*"})
+
+        assert response.status_code == 200
+        assert "ETag" not in response.headers
+
+    def test_static_fingerprint(self, client):
+        """Test: Los estáticos con huella se cachean un año"""
+        fingerprint = static_fingerprint("style.css")
+        with app.test_request_context():
+            from flask import url_for
+
+            assert url_for("static", filename="style.css").endswith(f"?v={fingerprint}")
+
+        fresh = client.get(f"/static/style.css?v={fingerprint}")
+        stale = client.get("/static/style.css?v=antigua")
+
+        assert "immutable" in fresh.headers["Cache-Control"]
+        assert "immutable" not in stale.headers.get("Cache-Control", "")
+
+
+class TestFragmentCache:
+    """Tests para la caché de la tabla de usuarios ya renderizada"""
+
+    PAGE = {
+        "users": [{"id": 7, "name": "Ana", "email": "ana@example.com"}],
+        "next_cursor": None,
+    }
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_hit_skips_cache_and_render(self, mock_get_redis, mock_cache, client):
+        """Test: Con la tabla cacheada no se consulta la caché de datos"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, False)
+
+        first = client.get("/users")
+        with patch("app.render_users_table") as mock_render:
+            second = client.get("/users")
+
+        assert b"ana@example.com" in first.data
+        assert b"ana@example.com" in second.data
+        assert b"Desde cach" in second.data
+        mock_cache.assert_called_once()
+        mock_render.assert_not_called()
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_write_renders_again(self, mock_get_redis, mock_cache, client):
+        """Test: Una escritura cambia la versión y la tabla se vuelve a renderizar"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, True)
+
+        client.get("/users")
+        invalidate_users_cache()
+        mock_cache.return_value = ({"users": [], "next_cursor": None}, False)
+        response = client.get("/users")
+
+        assert b"ana@example.com" not in response.data
+        assert mock_cache.call_count == 2
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_stale_page_not_cached(self, mock_get_redis, mock_cache, client):
+        """Test: La copia obsoleta no se guarda como tabla de la versión actual"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = (self.PAGE, CACHE_STALE)
+
+        client.get("/users")
+
+        assert get_users_fragment(get_users_version(), None, USERS_PAGE_SIZE) is None
+        assert len(fragment_cache) == 0
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis", return_value=None)
+    def test_not_cached_without_version(self, mock_get_redis, mock_cache, client):
+        """Test: Sin Redis no se cachean fragmentos"""
+        mock_cache.return_value = (self.PAGE, False)
+
+        client.get("/users")
+        client.get("/users")
+
+        assert mock_cache.call_count == 2
+        assert len(fragment_cache) == 0
+
+
+def stage_count(route, stage, cache):
+    value = metrics_registry.get_sample_value(
+        "request_stage_duration_seconds_count",
+        {"route": route, "stage": stage, "cache": cache},
+    )
+    return value or 0
+
+
+class TestStageMetrics:
+    """Tests para la latencia por etapa de las peticiones"""
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_users_stages_by_route_and_cache(self, mock_get_redis, mock_cache, client):
+        """Test: Las etapas de /users se etiquetan con la ruta y el fallo de caché"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = ({"users": [], "next_cursor": None}, False)
+        before = {
+            stage: stage_count("/users", stage, "miss")
+            for stage in ("redis.version", "render.table", "render.page")
+        }
+
+        client.get("/users")
+
+        for stage, count in before.items():
+            assert stage_count("/users", stage, "miss") == count + 1
+
+    @patch("app.get_users_from_cache")
+    @patch("app.get_redis")
+    def test_fragment_hit_is_labelled(self, mock_get_redis, mock_cache, client):
+        """Test: Un acierto de caché se anota como hit y no renderiza la tabla"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cache.return_value = ({"users": [], "next_cursor": None}, False)
+        client.get("/users")
+        tables = stage_count("/users", "render.table", "hit")
+        pages = stage_count("/users", "render.page", "hit")
+
+        client.get("/users")
+
+        assert stage_count("/users", "render.table", "hit") == tables
+        assert stage_count("/users", "render.page", "hit") == pages + 1
+
+    def test_outside_request(self):
+        """Test: Fuera de una petición la etapa se publica sin ruta"""
+        before = stage_count("-", "test.stage", "none")
+
+        @timed("test.stage")
+        def work():
+            return 42
+
+        assert work() == 42
+        assert stage_count("-", "test.stage", "none") == before + 1
+
+    def test_coroutine(self):
+        """Test: El decorador también mide corrutinas"""
+        import asyncio
+
+        @timed("test.async")
+        async def work():
+            return 7
+
+        before = stage_count("-", "test.async", "none")
+        assert asyncio.run(work()) == 7
+        assert stage_count("-", "test.async", "none") == before + 1
+
+
+class TestUsersSearch:
+    """Tests para la búsqueda de usuarios por nombre o email"""
+
+    ROWS = [
+        {
+            "id": 2,
+            "name": "Ana",
+            "email": "ana@example.com",
+            "image_url": None,
+            "created_at": datetime(2025, 1, 2),
+        },
+        {
+            "id": 1,
+            "name": "Mariana",
+            "email": "mariana@example.com",
+            "image_url": None,
+            "created_at": datetime(2025, 1, 1),
+        },
+    ]
+
+    def mock_db(self, mock_get_db):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = self.ROWS
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_db.return_value.__enter__.return_value = mock_conn
+        return mock_cursor
+
+    @patch("app.get_redis")
+    @patch("app.get_db")
+    def test_search_contains(self, mock_get_db, mock_get_redis, client):
+        """Test: La búsqueda usa lower(...) LIKE con el patrón '%q%'"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cursor = self.mock_db(mock_get_db)
+
+        response = client.get("/api/users/search?q=ANA")
+
+        data = response.get_json()
+        assert response.status_code == 200
+        assert [u["id"] for u in data["users"]] == [2, 1]
+        assert data["from_cache"] is False
+        sql, params = mock_cursor.execute.call_args[0]
+        assert "lower(name) LIKE" in sql and "lower(email) LIKE" in sql
+        assert params[:2] == ("%ana%", "%ana%")
+
+    @patch("app.get_redis")
+    @patch("app.get_db")
+    def test_search_prefix_escapes_wildcards(self, mock_get_db, mock_get_redis, client):
+        """Test: match=prefix ancla al inicio y escapa % y _"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_cursor = self.mock_db(mock_get_db)
+
+        client.get("/api/users/search?q=a%25_b&match=prefix")
+
+        params = mock_cursor.execute.call_args[0][1]
+        assert params[0] == "a\\%\\_b%"
+
+    def test_invalid_params(self, client):
+        """Test: Búsquedas demasiado cortas o modos desconocidos dan 400"""
+        assert client.get("/api/users/search?q=an").status_code == 400
+        assert client.get("/api/users/search?q=ana&match=regex").status_code == 400
+        assert client.get("/api/users/search?q=ana&cursor=xx").status_code == 400
+
+    @patch("app.get_redis")
+    @patch("app.get_db")
+    def test_cached_until_write(self, mock_get_db, mock_get_redis, client):
+        """Test: Se sirve de Redis hasta que una escritura cambia la versión"""
+        mock_get_redis.return_value = FakeRedis()
+        self.mock_db(mock_get_db)
+
+        first = client.get("/api/users/search?q=ana").get_json()
+        second = client.get("/api/users/search?q=ana").get_json()
+        invalidate_users_cache()
+        third = client.get("/api/users/search?q=ana").get_json()
+
+        assert first["from_cache"] is False
+        assert second["from_cache"] is True
+        assert second["users"] == first["users"]
+        assert third["from_cache"] is False
+        assert mock_get_db.call_count == 2
+
+    @patch("app.get_redis")
+    @patch("app.get_db")
+    def test_database_error(self, mock_get_db, mock_get_redis, client):
+        """Test: Un error de la base de datos devuelve 503"""
+        mock_get_redis.return_value = FakeRedis()
+        mock_get_db.side_effect = Exception("statement timeout")
+
+        response = client.get("/api/users/search?q=ana")
+
+        assert response.status_code == 503
@@ -0,0 +1,50 @@
+import importlib.util
+import os
+from unittest.mock import mock_open, patch
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_conf():
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # El módulo define PROMETHEUS_MULTIPROC_DIR; no debe filtrarse a otros tests
+    with patch.dict(os.environ):
+        spec.loader.exec_module(module)
+    return module
+
+
+class TestGunicornConfig:
+    """Test: Configuración de gunicorn"""
+
+    def test_cpu_limit_from_downward_api(self):
+        """Test: Los millicores del Deployment se redondean hacia arriba"""
+        conf = load_conf()
+        with patch.dict(os.environ, {"CPU_LIMIT_MILLICORES": "200"}):
+            assert conf.cpu_limit() == 1
+        with patch.dict(os.environ, {"CPU_LIMIT_MILLICORES": "1500"}):
+            assert conf.cpu_limit() == 2
+
+    def test_cpu_limit_from_cgroup_v2(self):
+        """Test: Sin variable de entorno se usa la cuota de cgroup"""
+        conf = load_conf()
+        with patch.dict(os.environ, {}, clear=True), patch(
+            "builtins.open", mock_open(read_data="300000 100000\n")
+        ):
+            assert conf.cpu_limit() == 3
+
+    def test_cpu_limit_falls_back_to_cpu_count(self):
+        """Test: Sin límites conocidos se usa os.cpu_count()"""
+        conf = load_conf()
+        with patch.dict(os.environ, {}, clear=True), patch(
+            "builtins.open", side_effect=OSError
+        ), patch("os.cpu_count", return_value=8):
+            assert conf.cpu_limit() == 8
+
+    def test_workers_follow_cpu_limit(self):
+        """Test: Por defecto se arranca un worker más que CPUs disponibles"""
+        with patch.dict(os.environ, {"CPU_LIMIT_MILLICORES": "2000"}):
+            conf = load_conf()
+        assert conf.workers == 3
+        assert conf.worker_class == "gthread"
+        assert conf.preload_app is False
@@ -2,19 +2,26 @@ import pytest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import time
+import threading
 
 # Añadir el directorio padre al path para importar app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import app as app_module
 from app import app, check_postgres, check_redis, check_minio, check_load_balancer
+from app import run_health_checks, get_health_snapshot, invalidate_health_cache
+from app import get_minio_health, HEALTH_CHECK_TIMEOUT
 
 
 @pytest.fixture
 def client():
     """Fixture para el cliente de pruebas de Flask"""
     app.config["TESTING"] = True
+    invalidate_health_cache()
     with app.test_client() as client:
         yield client
+    invalidate_health_cache()
 
 
 class TestHealthChecks:
@@ -24,12 +31,12 @@ class TestHealthChecks:
     def test_check_postgres_success(self, mock_get_db):
         """Test: PostgreSQL está disponible"""
         mock_conn = MagicMock()
-        mock_get_db.return_value = mock_conn
+        mock_get_db.return_value.__enter__.return_value = mock_conn
 
         result = check_postgres()
 
         assert result is True
-        mock_conn.close.assert_called_once()
+        mock_conn.cursor.return_value.execute.assert_called_once_with("SELECT 1")
 
     @patch("app.get_db")
     def test_check_postgres_failure(self, mock_get_db):
@@ -63,7 +70,7 @@ class TestHealthChecks:
 
         assert result is False
 
-    @patch("app.get_minio")
+    @patch("app.get_minio_health")
     def test_check_minio_success(self, mock_get_minio):
         """Test: MinIO está disponible"""
         mock_client = MagicMock()
@@ -75,7 +82,7 @@ class TestHealthChecks:
         assert result is True
         mock_client.list_buckets.assert_called_once()
 
-    @patch("app.get_minio")
+    @patch("app.get_minio_health")
     def test_check_minio_failure(self, mock_get_minio):
         """Test: MinIO no está disponible"""
         mock_client = MagicMock()
@@ -161,3 +168,128 @@ class TestHealthEndpoint:
         response = client.get("/")
 
         assert response.status_code == 200
+
+
+class TestConcurrentHealthChecks:
+    """Tests para la ejecución concurrente y cacheada de los health checks"""
+
+    def setup_method(self):
+        invalidate_health_cache()
+        app_module._health_futures.clear()
+
+    def teardown_method(self):
+        invalidate_health_cache()
+        app_module._health_futures.clear()
+
+    @patch("app.check_load_balancer")
+    @patch("app.check_minio")
+    @patch("app.check_redis")
+    @patch("app.check_postgres")
+    def test_checks_run_concurrently(self, mock_pg, mock_redis, mock_minio, mock_lb):
+        """Test: Los checks lentos se ejecutan en paralelo"""
+        for mock_check in (mock_pg, mock_redis, mock_minio, mock_lb):
+            mock_check.side_effect = lambda: time.sleep(0.2) or True
+
+        start = time.monotonic()
+        results = run_health_checks()
+
+        assert time.monotonic() - start < 0.6
+        assert all(results.values())
+
+    @patch("app.HEALTH_CHECK_TIMEOUT", 0.1)
+    @patch("app.check_load_balancer", return_value=True)
+    @patch("app.check_minio", return_value=True)
+    @patch("app.check_redis", return_value=True)
+    @patch("app.check_postgres")
+    def test_slow_check_fails_at_deadline(self, mock_pg, *mocks):
+        """Test: Un check que supera su plazo cuenta como fallido"""
+        mock_pg.side_effect = lambda: time.sleep(0.5) or True
+
+        results = run_health_checks()
+
+        assert results["postgres"] is False
+        assert results["minio"] is True
+
+    @patch("app.HEALTH_CHECK_TIMEOUT", 0.05)
+    @patch("app.check_load_balancer", return_value=True)
+    @patch("app.check_redis", return_value=True)
+    @patch("app.check_postgres", return_value=True)
+    @patch("app.check_minio")
+    def test_hung_check_not_resubmitted(self, mock_minio, *mocks):
+        """Test: Un check colgado no se relanza: no agota los hilos del pool"""
+        release = threading.Event()
+        mock_minio.side_effect = lambda: release.wait(5)
+        try:
+            first = run_health_checks()
+            second = run_health_checks()
+        finally:
+            release.set()
+
+        assert first["minio"] is False and second["minio"] is False
+        assert second["postgres"] is True
+        assert mock_minio.call_count == 1
+
+    @patch("app.MINIO_ENDPOINT", "minio:9000")
+    def test_minio_health_client_fails_fast(self):
+        """Test: El cliente del check no reintenta y usa HEALTH_CHECK_TIMEOUT"""
+        pool = get_minio_health()._http
+
+        assert pool.connection_pool_kw["retries"].total is False
+        assert pool.connection_pool_kw["timeout"].read_timeout == HEALTH_CHECK_TIMEOUT
+
+    @patch("app.run_health_checks")
+    def test_snapshot_is_cached(self, mock_run):
+        """Test: Peticiones seguidas reutilizan la misma instantánea"""
+        mock_run.return_value = {"postgres": True, "minio": True}
+
+        get_health_snapshot()
+        get_health_snapshot()
+
+        mock_run.assert_called_once()
+
+    @patch("app.run_health_checks")
+    def test_health_ready_not_ready(self, mock_run, client):
+        """Test: /health/ready devuelve 503 si falla una dependencia crítica"""
+        mock_run.return_value = {
+            "postgres": False,
+            "minio": True,
+            "redis": True,
+            "load_balancer": True,
+        }
+
+        response = client.get("/health/ready")
+
+        assert response.status_code == 503
+        assert response.get_json()["checks"]["postgres"] == "error"
+
+    @patch("app._init_state", "running")
+    @patch("app.run_health_checks")
+    def test_health_ready_while_initializing(self, mock_run, client):
+        """Test: /health/ready devuelve 503 mientras la inicialización no termina"""
+        mock_run.return_value = {
+            "postgres": True,
+            "minio": True,
+            "redis": True,
+            "load_balancer": True,
+        }
+
+        response = client.get("/health/ready")
+
+        assert response.status_code == 503
+        assert response.get_json()["checks"]["init"] == "pending"
+
+    @patch("app._init_state", "done")
+    @patch("app.run_health_checks")
+    def test_health_ready_after_init(self, mock_run, client):
+        """Test: /health/ready devuelve 200 cuando la inicialización ha terminado"""
+        mock_run.return_value = {
+            "postgres": True,
+            "minio": True,
+            "redis": True,
+            "load_balancer": True,
+        }
+
+        response = client.get("/health/ready")
+
+        assert response.status_code == 200
+        assert response.get_json()["checks"]["init"] == "ok"
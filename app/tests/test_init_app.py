@@ -0,0 +1,101 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import time
+
+# Añadir el directorio padre al path para importar init_app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from init_app import (
+    InitError,
+    backoff_delay,
+    with_retries,
+    init_database,
+    init_database_once,
+    run_init,
+)
+from migrate import MigrationInProgress
+
+
+class TestBackoff:
+    """Test: Reintentos con backoff exponencial y jitter"""
+
+    def test_backoff_is_capped_and_jittered(self):
+        """Test: La espera crece exponencialmente, con tope y aleatoria"""
+        with patch("init_app.random.uniform", side_effect=lambda a, b: b):
+            assert backoff_delay(1, base=0.5, cap=10) == 0.5
+            assert backoff_delay(3, base=0.5, cap=10) == 2
+            assert backoff_delay(10, base=0.5, cap=10) == 10
+        with patch("init_app.random.uniform", side_effect=lambda a, b: a):
+            assert backoff_delay(3, base=0.5, cap=10) == 0
+
+    @patch("init_app.time.sleep")
+    def test_retries_until_success(self, mock_sleep):
+        """Test: Se reintenta hasta que la función no falla"""
+        func = MagicMock(side_effect=[Exception("down"), Exception("down"), "ok"])
+
+        assert with_retries("test", func, max_retries=5) == "ok"
+        assert func.call_count == 3
+        assert mock_sleep.call_count == 2
+
+    @patch("init_app.time.sleep")
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        """Test: Se lanza InitError al agotar los intentos"""
+        func = MagicMock(side_effect=Exception("down"))
+
+        with pytest.raises(InitError):
+            with_retries("test", func, max_retries=3)
+        assert func.call_count == 3
+
+
+class TestInitDatabase:
+    """Test: Inicialización del esquema"""
+
+    @patch("init_app.migrate")
+    @patch("init_app.psycopg2.connect")
+    def test_runs_migrations(self, mock_connect, mock_migrate):
+        """Test: Se aplican las migraciones y se cierra la conexión"""
+        mock_migrate.return_value = [1, 2]
+
+        init_database_once()
+
+        mock_migrate.assert_called_once_with(mock_connect.return_value)
+        mock_connect.return_value.close.assert_called_once()
+
+    @patch("init_app.time.sleep")
+    @patch("init_app.migrate")
+    @patch("init_app.psycopg2.connect")
+    def test_retries_while_other_pod_migrates(
+        self, mock_connect, mock_migrate, mock_sleep
+    ):
+        """Test: Si otro pod tiene el lock se reintenta con backoff"""
+        mock_migrate.side_effect = [MigrationInProgress(), []]
+
+        init_database(max_retries=3)
+
+        assert mock_migrate.call_count == 2
+        mock_sleep.assert_called_once()
+
+
+class TestRunInit:
+    """Test: Inicialización en paralelo"""
+
+    def test_database_and_minio_run_concurrently(self):
+        """Test: PostgreSQL y MinIO se inicializan a la vez"""
+        with patch(
+            "init_app.init_database_once", side_effect=lambda: time.sleep(0.2)
+        ), patch("init_app.init_minio_once", side_effect=lambda: time.sleep(0.2)):
+            start = time.monotonic()
+            run_init(max_retries=1)
+            elapsed = time.monotonic() - start
+
+        assert elapsed < 0.35
+
+    def test_failure_is_raised(self):
+        """Test: Un fallo definitivo se propaga como InitError"""
+        with patch("init_app.init_database_once"), patch(
+            "init_app.init_minio_once", side_effect=Exception("down")
+        ):
+            with pytest.raises(InitError):
+                run_init(max_retries=1)
@@ -0,0 +1,149 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+import json
+import queue
+import logging
+
+# Añadir el directorio padre al path para importar app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import app
+from json_logging import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    RequestIdFilter,
+    SamplingFilter,
+    parse_sample_rates,
+    request_id_var,
+    setup_logging,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def client():
+    """Fixture para el cliente de pruebas de Flask"""
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def app_records():
+    """Registros del logger "app" tal y como llegarían a la cola"""
+    log_queue = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    logger = logging.getLogger("app")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield log_queue
+    logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def make_record(level=logging.INFO, msg="hola %s", args=("mundo",), **extra):
+    record = logging.LogRecord("app", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestJsonLogging:
+    """Tests para el formato JSON, el muestreo y la cola no bloqueante"""
+
+    def test_json_line_with_extra_fields(self):
+        """Test: Cada registro es una línea JSON con los campos de extra="""
+        line = JsonFormatter().format(make_record(user_id=7, request_id="abc"))
+
+        entry = json.loads(line)
+        assert entry["msg"] == "hola mundo"
+        assert entry["level"] == "INFO"
+        assert entry["user_id"] == 7
+        assert entry["request_id"] == "abc"
+
+    def test_queue_full_drops_without_blocking(self):
+        """Test: Con la cola llena se descarta y se avisa en el siguiente registro"""
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        handler.handle(make_record())
+        handler.handle(make_record())
+        handler.handle(make_record())
+
+        handler.queue.get_nowait()
+        handler.handle(make_record())
+
+        assert handler.queue.get_nowait().dropped_logs == 2
+
+    def test_prepare_interpolates_in_caller(self):
+        """Test: El mensaje se interpola antes de encolar (args mutables)"""
+        handler = NonBlockingQueueHandler(queue.Queue())
+        args = ["antes"]
+        handler.handle(make_record(args=(args,)))
+        args[0] = "después"
+
+        record = handler.queue.get_nowait()
+        assert record.getMessage() == "hola ['antes']"
+
+    def test_sampling_by_level(self):
+        """Test: El muestreo solo afecta a los niveles configurados"""
+        rates = parse_sample_rates("DEBUG=0, INFO=1")
+        sampling = SamplingFilter(rates)
+
+        assert rates == {logging.DEBUG: 0.0, logging.INFO: 1.0}
+        assert not sampling.filter(make_record(level=logging.DEBUG))
+        assert sampling.filter(make_record(level=logging.INFO))
+        assert sampling.filter(make_record(level=logging.ERROR))
+
+    def test_setup_writes_json_file(self, tmp_path, restore_root_logger):
+        """Test: El listener escribe las líneas JSON en el fichero del proceso"""
+        with patch("json_logging.LOG_DIR", str(tmp_path)):
+            setup_logging()
+            token = request_id_var.set("req-1")
+            logging.getLogger("app").info("evento", extra={"user_id": 3})
+            request_id_var.reset(token)
+            stop_logging()
+
+        entry = json.loads((tmp_path / f"app-{os.getpid()}.log").read_text())
+        assert entry["msg"] == "evento"
+        assert entry["request_id"] == "req-1"
+        assert entry["user_id"] == 3
+
+
+class TestRequestId:
+    """Tests para el id de correlación de las peticiones"""
+
+    @patch("app.delete_users")
+    def test_request_id_propagated(self, mock_delete, client, app_records):
+        """Test: El X-Request-ID de entrada se devuelve y llega a los logs"""
+        mock_delete.return_value = {"deleted": 1}
+
+        response = client.post(
+            "/users/delete", json={"ids": [1]}, headers={"X-Request-ID": "trace-42"}
+        )
+
+        assert response.headers["X-Request-ID"] == "trace-42"
+        record = app_records.get_nowait()
+        assert record.request_id == "trace-42"
+        assert record.deleted == 1
+        assert request_id_var.get() == "-"
+
+    def test_request_id_generated(self, client):
+        """Test: Sin cabecera (o con una no válida) se genera un id nuevo"""
+        first = client.get("/health").headers["X-Request-ID"]
+        second = client.get("/health", headers={"X-Request-ID": "a b"}).headers[
+            "X-Request-ID"
+        ]
+
+        assert len(first) == 32
+        assert second != "a b" and second != first
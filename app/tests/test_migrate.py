@@ -0,0 +1,183 @@
+import pytest
+import sys
+import os
+
+# Añadir el directorio padre al path para importar migrate
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from psycopg2 import errors
+
+from migrate import (
+    MigrationInProgress,
+    MIGRATION_LOCK_ID,
+    MIGRATION_LOCK_TIMEOUT,
+    load_migrations,
+    current_version,
+    migrate,
+)
+
+
+class RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params, self.conn.autocommit))
+        if "FROM schema_migrations" in sql and "MAX" in sql and self.conn.missing_table:
+            raise errors.UndefinedTable()
+
+    def fetchone(self):
+        return self.conn.results.pop(0)
+
+    def fetchall(self):
+        return [(v,) for v in self.conn.applied]
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    """Conexión psycopg2 falsa que registra cada sentencia y su modo"""
+
+    def __init__(self, results=(), applied=(), missing_table=False):
+        self.results = list(results)
+        self.applied = list(applied)
+        self.missing_table = missing_table
+        self.autocommit = False
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def statements(self):
+        return [sql for sql, _, _ in self.executed]
+
+
+@pytest.fixture
+def migrations(tmp_path):
+    (tmp_path / "0001_create.sql").write_text("CREATE TABLE t (id INT);")
+    (tmp_path / "0002_index.sql").write_text(
+        "-- migrate:no-transaction\nCREATE INDEX CONCURRENTLY IF NOT EXISTS i ON t (id);"
+    )
+    (tmp_path / "README.md").write_text("no es una migración")
+    return load_migrations(str(tmp_path))
+
+
+class TestLoadMigrations:
+    """Test: Descubrimiento de migraciones"""
+
+    def test_sorted_by_version(self, migrations):
+        """Test: Se ordenan por versión e ignoran otros ficheros"""
+        assert [(m.version, m.name) for m in migrations] == [
+            (1, "create"),
+            (2, "index"),
+        ]
+
+    def test_no_transaction_marker(self, migrations):
+        """Test: La marca no-transaction desactiva la transacción"""
+        assert migrations[0].transactional is True
+        assert migrations[1].transactional is False
+
+    def test_repo_migrations(self):
+        """Test: Las migraciones del repositorio se cargan sin versiones repetidas"""
+        versions = [m.version for m in load_migrations()]
+        assert versions == sorted(set(versions))
+        assert versions[0] == 1
+
+    def test_repo_concurrent_indexes(self):
+        """Test: Los índices CONCURRENTLY del repositorio van fuera de transacción"""
+        indexes = {}
+        for migration in load_migrations():
+            if migration.concurrent_index:
+                assert migration.transactional is False, migration.version
+                indexes[migration.version] = migration.concurrent_index
+        assert indexes[2] == "idx_users_created_at_id"
+
+
+class TestMigrate:
+    """Test: Aplicación de migraciones"""
+
+    def test_current_version_without_table(self):
+        """Test: Sin tabla de control la versión es 0"""
+        conn = RecordingConnection(missing_table=True)
+        assert current_version(conn) == 0
+
+    def test_fast_path_when_up_to_date(self, migrations):
+        """Test: Con el esquema al día solo se hace una consulta"""
+        conn = RecordingConnection(results=[(2,)])
+
+        assert migrate(conn, migrations) == []
+        assert len(conn.executed) == 1
+        assert not any("advisory" in sql for sql in conn.statements())
+
+    def test_other_pod_holds_lock(self, migrations):
+        """Test: Si otro pod tiene el lock se lanza MigrationInProgress"""
+        conn = RecordingConnection(results=[(0,), (False,)])
+
+        with pytest.raises(MigrationInProgress):
+            migrate(conn, migrations)
+        assert not any("CREATE TABLE t" in sql for sql in conn.statements())
+
+    def test_applies_pending_migrations(self, migrations):
+        """Test: Solo se aplican las pendientes y el lock se libera"""
+        conn = RecordingConnection(results=[(1,), (True,), None, (True,)], applied=[1])
+
+        assert migrate(conn, migrations) == [2]
+
+        statements = conn.statements()
+        assert not any("CREATE TABLE t" in sql for sql in statements)
+        assert statements[-1] == "SELECT pg_advisory_unlock(%s)"
+        assert conn.executed[-1][1] == (MIGRATION_LOCK_ID,)
+
+    def test_transaction_modes(self, migrations):
+        """Test: Cada migración se ejecuta en su modo y se registra"""
+        conn = RecordingConnection(results=[(0,), (True,), None, (True,)])
+
+        assert migrate(conn, migrations) == [1, 2]
+
+        modes = {sql: autocommit for sql, _, autocommit in conn.executed}
+        assert modes["CREATE TABLE t (id INT);"] is False
+        assert modes[migrations[1].sql] is True
+        inserts = [
+            p
+            for sql, p, _ in conn.executed
+            if sql.startswith("INSERT INTO schema_migrations")
+        ]
+        assert inserts == [(1, "create"), (2, "index")]
+        assert conn.commits == 1
+        assert conn.autocommit is False
+
+    def test_invalid_index_is_rebuilt(self, migrations):
+        """Test: Un índice INVALID de un intento anterior se borra y se recrea"""
+        conn = RecordingConnection(
+            results=[(1,), (True,), (False,), (True,)], applied=[1]
+        )
+
+        assert migrate(conn, migrations) == [2]
+
+        statements = conn.statements()
+        drop = statements.index("DROP INDEX CONCURRENTLY IF EXISTS i")
+        assert statements.index("SET lock_timeout = 0") < drop
+        assert drop < statements.index(migrations[1].sql)
+
+    def test_failed_index_not_recorded(self, migrations):
+        """Test: Si el índice queda INVALID la migración no se registra"""
+        conn = RecordingConnection(results=[(1,), (True,), None, (False,)], applied=[1])
+
+        with pytest.raises(RuntimeError):
+            migrate(conn, migrations)
+
+        statements = conn.statements()
+        assert not any(sql.startswith("INSERT INTO") for sql in statements)
+        assert conn.executed[-2][:2] == (
+            "SET lock_timeout = %s",
+            (MIGRATION_LOCK_TIMEOUT,),
+        )
+        assert statements[-1] == "SELECT pg_advisory_unlock(%s)"
@@ -0,0 +1,199 @@
+import pytest
+from unittest.mock import patch
+import sys
+import os
+import time
+import marshal
+import threading
+
+# Añadir el directorio padre al path para importar app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app as app_module
+from app import app, sample_stacks, collapsed_stacks
+
+TOKEN = "secreto"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def client():
+    """Fixture para el cliente de pruebas de Flask"""
+    app.config["TESTING"] = True
+    with patch("app.PROFILER_TOKEN", TOKEN):
+        with app.test_client() as client:
+            yield client
+
+
+def busy_marker(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+@pytest.fixture
+def busy_request_thread():
+    """Hilo ocupado que figura como si atendiera una petición"""
+    stop = threading.Event()
+    started = threading.Event()
+
+    def run():
+        app_module._request_threads.add(threading.get_ident())
+        started.set()
+        try:
+            busy_marker(stop)
+        finally:
+            app_module._request_threads.discard(threading.get_ident())
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+class TestProfilerAccess:
+    """Tests para la activación y autenticación del perfilador"""
+
+    def test_disabled_without_token(self):
+        """Test: Sin PROFILER_TOKEN el endpoint no existe"""
+        with app.test_client() as client:
+            response = client.get("/debug/profile", headers=AUTH)
+
+        assert response.status_code == 404
+
+    def test_wrong_token(self, client):
+        """Test: Un token incorrecto devuelve 401"""
+        response = client.get(
+            "/debug/profile", headers={"Authorization": "Bearer otro"}
+        )
+
+        assert response.status_code == 401
+
+    def test_invalid_params(self, client):
+        """Test: Duraciones fuera de rango o rutas desconocidas dan 400"""
+        assert client.get("/debug/profile?seconds=0", headers=AUTH).status_code == 400
+        assert client.get("/debug/profile?seconds=x", headers=AUTH).status_code == 400
+        response = client.get("/debug/profile/requests?route=/nada", headers=AUTH)
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "worker_model",
+        [("SyncWorker", 1), ("ThreadWorker", 1), ("GeventWorker", 1000)],
+    )
+    def test_unsupported_worker_model(self, client, worker_model):
+        """Test: Con workers sync o gevent se responde 409 sin esperar"""
+        with patch("app._worker_model", worker_model):
+            for path in ("/debug/profile", "/debug/profile/requests?route=/health"):
+                response = client.get(path, headers=AUTH)
+
+                assert response.status_code == 409
+                assert "no disponible" in response.get_json()["error"]
+
+    def test_supported_worker_model(self):
+        """Test: Con gthread de varios hilos (o sin gunicorn) se puede perfilar"""
+        with patch("app._worker_model", ("ThreadWorker", 4)):
+            assert app_module.profiler_unsupported() is None
+        assert app_module.profiler_unsupported() is None
+
+    def test_one_profile_at_a_time(self, client):
+        """Test: Mientras hay un perfilado en curso se responde 409"""
+        with app_module._profile_lock:
+            response = client.get("/debug/profile?seconds=0.1", headers=AUTH)
+
+        assert response.status_code == 409
+
+
+class TestStackSampling:
+    """Tests para el muestreo de pilas"""
+
+    def test_samples_request_threads(self, busy_request_thread):
+        """Test: Se muestrean las pilas de los hilos que atienden peticiones"""
+        stacks = sample_stacks(0.1, 0.005)
+
+        assert any("busy_marker" in stack for stack in stacks)
+        assert all(";" in stack for stack in stacks)
+
+    def test_ignores_idle_threads(self):
+        """Test: Por defecto no se muestrean los hilos sin petición"""
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_marker, args=(stop,))
+        thread.start()
+        try:
+            default = sample_stacks(0.05, 0.005)
+            everything = sample_stacks(0.05, 0.005, all_threads=True)
+        finally:
+            stop.set()
+            thread.join()
+
+        assert not any("busy_marker" in stack for stack in default)
+        assert any("busy_marker" in stack for stack in everything)
+
+    def test_collapsed_format(self):
+        """Test: Una línea 'pila muestras' por pila"""
+        text = collapsed_stacks({"a;b": 3, "a;c": 1})
+
+        assert text == "a;b 3\na;c 1\n"
+
+    def test_endpoint_returns_collapsed(self, client, busy_request_thread):
+        """Test: El endpoint devuelve las pilas colapsadas en texto"""
+        response = client.get("/debug/profile?seconds=0.1&interval=0.005", headers=AUTH)
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        line = next(
+            line for line in response.text.splitlines() if "busy_marker" in line
+        )
+        assert int(line.rsplit(" ", 1)[1]) > 0
+
+
+class TestRequestProfiling:
+    """Tests para el perfilado de las próximas peticiones a una ruta"""
+
+    def profile_in_background(self, query):
+        result = {}
+
+        def run():
+            with app.test_client() as client:
+                result["response"] = client.get(
+                    f"/debug/profile/requests?{query}", headers=AUTH
+                )
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        deadline = time.monotonic() + 2
+        while app_module._request_profile is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return thread, result
+
+    def test_profiles_next_requests(self, client):
+        """Test: Se perfilan las siguientes peticiones a la ruta y se devuelve pstats"""
+        thread, result = self.profile_in_background("route=/health&count=2&timeout=5")
+        client.get("/health")
+        client.get("/health")
+        thread.join()
+
+        response = result["response"]
+        assert response.status_code == 200
+        assert response.headers["X-Profiled-Requests"] == "2"
+        stats = marshal.loads(response.data)
+        assert any(func[2] == "health" for func in stats)
+
+    def test_text_format(self, client):
+        """Test: format=text devuelve el resumen de pstats"""
+        thread, result = self.profile_in_background(
+            "route=/health&count=1&timeout=5&format=text"
+        )
+        client.get("/health")
+        thread.join()
+
+        assert b"function calls" in result["response"].data
+
+    def test_timeout_without_requests(self, client):
+        """Test: Si no llega ninguna petición a tiempo se responde 504"""
+        response = client.get(
+            "/debug/profile/requests?route=/health&count=1&timeout=0.05", headers=AUTH
+        )
+
+        assert response.status_code == 504
+        assert app_module._request_profile is None
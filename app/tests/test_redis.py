@@ -2,23 +2,57 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import json
+import time
+import pytest
+from datetime import datetime
 
 # Añadir el directorio padre al path para importar app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from app import (
     get_redis,
+    close_redis_pool,
+    InstrumentedRedisPool,
+    REDIS_POOL_EVENTS,
     get_users_from_cache,
     save_users_to_cache,
     invalidate_users_cache,
-    USERS_CACHE_KEY,
+    users_page_key,
+    encode_cursor,
+    decode_cursor,
+    parse_page_size,
+    USERS_PAGES_KEY,
+    CACHE_INVALIDATION_CHANNEL,
+    LRUCache,
+    l1_cache,
+    apply_cache_invalidation,
+    patch_users_page,
+    write_through_users_cache,
+    USERS_PAGE_SIZE,
+    USERS_PAGE_SIZE_MAX,
     CACHE_TTL,
+    CACHE_STALE,
+    CACHE_CODECS,
+    USERS_VERSION_KEY,
+    encode_cache_value,
+    decode_cache_value,
+    build_users_page,
 )
+from fakes import FakeRedis
+
+CURSOR_NEW = encode_cursor(datetime(2025, 6, 1), 20)
+CURSOR_OLD = encode_cursor(datetime(2025, 1, 1), 10)
 
 
 class TestRedisConnection:
     """Tests para la conexión a Redis"""
 
+    def setup_method(self):
+        close_redis_pool()
+
+    def teardown_method(self):
+        close_redis_pool()
+
     @patch("app.redis.Redis")
     def test_get_redis_success(self, mock_redis):
         """Test: Conexión exitosa a Redis"""
@@ -30,6 +64,46 @@ class TestRedisConnection:
         assert client is not None
         mock_redis.assert_called_once()
 
+    @patch("app.redis.Redis")
+    def test_get_redis_shared_client(self, mock_redis):
+        """Test: Todas las llamadas comparten el mismo cliente y pool"""
+        client_a = get_redis()
+        client_b = get_redis()
+
+        assert client_a is client_b
+        mock_redis.assert_called_once()
+        pool = mock_redis.call_args.kwargs["connection_pool"]
+        assert isinstance(pool, InstrumentedRedisPool)
+        assert pool.connection_kwargs["socket_keepalive"] is True
+
+
+class TestRedisPoolMetrics:
+    """Tests para las métricas del pool Redis"""
+
+    def _pool(self):
+        connection = MagicMock()
+        connection.can_read.return_value = False
+        connection.pid = os.getpid()
+        return InstrumentedRedisPool(
+            connection_class=MagicMock(return_value=connection), max_connections=2
+        )
+
+    def _count(self, event):
+        return REDIS_POOL_EVENTS.labels(event)._value.get()
+
+    def test_pool_counts_miss_then_hit(self):
+        """Test: La primera conexión es un miss y la reutilización un hit"""
+        pool = self._pool()
+        misses, hits = self._count("miss"), self._count("hit")
+
+        conn = pool.get_connection("GET")
+        pool.release(conn)
+        again = pool.get_connection("GET")
+
+        assert again is conn
+        assert self._count("miss") == misses + 1
+        assert self._count("hit") == hits + 1
+
 
 class TestCacheOperations:
     """Tests para operaciones de caché"""
@@ -39,38 +113,45 @@ class TestCacheOperations:
         """Test: Obtener usuarios desde caché (cache hit)"""
         # Mock Redis con datos en caché
         mock_redis = MagicMock()
-        users_data = [
-            {"id": 1, "name": "Juan", "email": "juan@example.com"},
-            {"id": 2, "name": "María", "email": "maria@example.com"},
-        ]
-        mock_redis.get.return_value = json.dumps(users_data)
+        page = {
+            "users": [
+                {"id": 1, "name": "Juan", "email": "juan@example.com"},
+                {"id": 2, "name": "María", "email": "maria@example.com"},
+            ],
+            "next_cursor": None,
+        }
+        mock_redis.mget.return_value = [json.dumps(page), "1"]
         mock_get_redis.return_value = mock_redis
 
         result, from_cache = get_users_from_cache()
 
-        assert result == users_data
+        assert result == page
         assert from_cache is True
-        mock_redis.get.assert_called_once_with(USERS_CACHE_KEY)
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        mock_redis.mget.assert_called_once_with(key, f"{key}:fresh")
+        mock_redis.set.assert_not_called()
 
     @patch("app.get_redis")
     def test_get_users_from_cache_miss(self, mock_get_redis):
         """Test: Caché vacío (cache miss)"""
         # Mock Redis sin datos
         mock_redis = MagicMock()
-        mock_redis.get.return_value = None
+        mock_redis.mget.return_value = [None, None]
+        mock_redis.set.return_value = True  # Este worker obtiene el lock
         mock_get_redis.return_value = mock_redis
 
         result, from_cache = get_users_from_cache()
 
         assert result is None
         assert from_cache is False
+        assert mock_redis.set.call_args.kwargs["nx"] is True
 
     @patch("app.get_redis")
     def test_get_users_from_cache_error(self, mock_get_redis):
         """Test: Error al obtener desde caché"""
         # Mock Redis con error
         mock_redis = MagicMock()
-        mock_redis.get.side_effect = Exception("Redis error")
+        mock_redis.mget.side_effect = Exception("Redis error")
         mock_get_redis.return_value = mock_redis
 
         result, from_cache = get_users_from_cache()
@@ -81,48 +162,50 @@ class TestCacheOperations:
     @patch("app.get_redis")
     def test_save_users_to_cache_success(self, mock_get_redis):
         """Test: Guardar usuarios en caché exitosamente"""
-        # Mock Redis
-        mock_redis = MagicMock()
-        mock_get_redis.return_value = mock_redis
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
 
-        users_data = [{"id": 1, "name": "Juan", "email": "juan@example.com"}]
+        page = {"users": [{"id": 1, "name": "Juan"}], "next_cursor": None}
 
-        save_users_to_cache(users_data)
+        save_users_to_cache(page)
 
-        mock_redis.setex.assert_called_once_with(
-            USERS_CACHE_KEY, CACHE_TTL, json.dumps(users_data)
-        )
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        assert decode_cache_value(fake.data[key]) == page
+        assert fake.zsets[USERS_PAGES_KEY] == {key: float("inf")}
 
     @patch("app.get_redis")
     def test_save_users_to_cache_error(self, mock_get_redis):
         """Test: Error al guardar en caché (no debe lanzar excepción)"""
         # Mock Redis con error
         mock_redis = MagicMock()
-        mock_redis.setex.side_effect = Exception("Redis error")
+        mock_redis.pipeline.return_value.execute.side_effect = Exception("Redis error")
         mock_get_redis.return_value = mock_redis
 
-        users_data = [{"id": 1, "name": "Juan"}]
+        page = {"users": [{"id": 1, "name": "Juan"}], "next_cursor": None}
 
         # No debe lanzar excepción
-        save_users_to_cache(users_data)
+        save_users_to_cache(page)
 
     @patch("app.get_redis")
     def test_invalidate_users_cache_success(self, mock_get_redis):
         """Test: Invalidar caché exitosamente"""
-        # Mock Redis
-        mock_redis = MagicMock()
-        mock_get_redis.return_value = mock_redis
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        save_users_to_cache({"users": [], "next_cursor": None})
+        save_users_to_cache({"users": [], "next_cursor": None}, CURSOR_OLD)
 
         invalidate_users_cache()
 
-        mock_redis.delete.assert_called_once_with(USERS_CACHE_KEY)
+        # El contenido se conserva, pero ninguna página queda fresca
+        assert not [key for key in fake.data if key.endswith(":fresh")]
+        assert users_page_key(None, USERS_PAGE_SIZE) in fake.data
 
     @patch("app.get_redis")
     def test_invalidate_users_cache_error(self, mock_get_redis):
         """Test: Error al invalidar caché (no debe lanzar excepción)"""
         # Mock Redis con error
         mock_redis = MagicMock()
-        mock_redis.delete.side_effect = Exception("Redis error")
+        mock_redis.zrangebyscore.side_effect = Exception("Redis error")
         mock_get_redis.return_value = mock_redis
 
         # No debe lanzar excepción
@@ -135,57 +218,374 @@ class TestCacheIntegration:
     @patch("app.get_redis")
     def test_cache_workflow(self, mock_get_redis):
         """Test: Flujo completo - guardar, obtener e invalidar"""
-        # Mock Redis
-        mock_redis = MagicMock()
-        users_data = [{"id": 1, "name": "Test User", "email": "test@example.com"}]
-
-        # Simular comportamiento de Redis
-        cache_storage = {}
-
-        def mock_setex(key, ttl, value):
-            cache_storage[key] = value
-
-        def mock_get(key):
-            return cache_storage.get(key)
-
-        def mock_delete(key):
-            if key in cache_storage:
-                del cache_storage[key]
-
-        mock_redis.setex.side_effect = mock_setex
-        mock_redis.get.side_effect = mock_get
-        mock_redis.delete.side_effect = mock_delete
-        mock_get_redis.return_value = mock_redis
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        page = {"users": [{"id": 1, "name": "Test User"}], "next_cursor": None}
 
         # 1. Guardar en caché
-        save_users_to_cache(users_data)
-        assert USERS_CACHE_KEY in cache_storage
+        save_users_to_cache(page)
+        assert users_page_key(None, USERS_PAGE_SIZE) in fake.data
 
         # 2. Obtener desde caché
         result, from_cache = get_users_from_cache()
-        assert result == users_data
+        assert result == page
         assert from_cache is True
 
         # 3. Invalidar caché
         invalidate_users_cache()
-        assert USERS_CACHE_KEY not in cache_storage
 
-        # 4. Verificar que caché está vacío
+        # 4. El primer lector recalcula; el resto recibe la copia obsoleta
         result, from_cache = get_users_from_cache()
         assert result is None
         assert from_cache is False
+        result, from_cache = get_users_from_cache()
+        assert result == page
+        assert from_cache == CACHE_STALE
+
+        # 5. Al guardar la nueva página se libera el lock
+        save_users_to_cache(page)
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        assert f"{key}:lock" not in fake.data
+        assert get_users_from_cache() == (page, True)
 
     @patch("app.get_redis")
     def test_cache_ttl_is_set(self, mock_get_redis):
         """Test: Verificar que se establece el TTL correcto"""
-        mock_redis = MagicMock()
-        mock_get_redis.return_value = mock_redis
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+
+        save_users_to_cache({"users": [{"id": 1, "name": "Test"}], "next_cursor": None})
+
+        assert fake.ttls[users_page_key(None, USERS_PAGE_SIZE)] == CACHE_TTL
+        assert fake.ttls[USERS_PAGES_KEY] == CACHE_TTL
+
+    @patch("app.get_redis")
+    def test_invalidation_only_affects_newer_pages(self, mock_get_redis):
+        """Test: Un cambio solo invalida las páginas en las que puede aparecer"""
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        empty = {"users": [], "next_cursor": None}
+        save_users_to_cache(empty)
+        save_users_to_cache(empty, CURSOR_NEW)
+        save_users_to_cache(empty, CURSOR_OLD)
+
+        # Usuario creado entre ambos cursores
+        invalidate_users_cache(datetime(2025, 3, 1))
+
+        fresh = {key for key in fake.data if key.endswith(":fresh")}
+        assert fresh == {users_page_key(CURSOR_OLD, USERS_PAGE_SIZE) + ":fresh"}
+
+
+class TestStampedeProtection:
+    """Tests para la protección contra estampidas de la caché"""
+
+    @patch("app.get_redis")
+    def test_cold_miss_waits_for_rebuild(self, mock_get_redis):
+        """Test: Sin lock, se espera a que otro worker rellene la caché"""
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        page = {"users": [{"id": 1}], "next_cursor": None}
+        fake.set(f"{key}:lock", "otro-pod")
+
+        def rebuilt(_):
+            fake.data[key] = json.dumps(page)
+
+        with patch("app.time.sleep", side_effect=rebuilt):
+            result, from_cache = get_users_from_cache()
+
+        assert result == page
+        assert from_cache is True
+
+    @patch("app.CACHE_LOCK_WAIT", 0.1)
+    @patch("app.get_redis")
+    def test_cold_miss_gives_up_after_wait(self, mock_get_redis):
+        """Test: Si nadie rellena la caché a tiempo, se consulta la BD"""
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        fake.set(users_page_key(None, USERS_PAGE_SIZE) + ":lock", "otro-pod")
+
+        result, from_cache = get_users_from_cache()
+
+        assert result is None
+        assert from_cache is False
+
+
+class TestL1Cache:
+    """Tests para la caché L1 en memoria y su invalidación por pub/sub"""
+
+    def setup_method(self):
+        l1_cache.clear()
+
+    def teardown_method(self):
+        l1_cache.clear()
+
+    def test_lru_evicts_least_recently_used(self):
+        """Test: Al superar el tamaño se expulsa la entrada menos usada"""
+        cache = LRUCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_lru_entries_expire(self):
+        """Test: Las entradas caducan al superar el TTL"""
+        cache = LRUCache(2, 0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_lru_evict_from_score(self):
+        """Test: La invalidación por rango solo afecta a las páginas posteriores"""
+        cache = LRUCache(10, 60)
+        cache.set("first", 1)
+        cache.set("old", 2, score=100.0)
+
+        cache.evict_from(200.0)
+
+        assert cache.get("first") is None
+        assert cache.get("old") == 2
+
+    @patch("app._l1_active")
+    @patch("app.get_redis")
+    def test_l1_hit_skips_redis(self, mock_get_redis, mock_active):
+        """Test: Un acierto en L1 no consulta Redis"""
+        mock_active.is_set.return_value = True
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        page = {"users": [{"id": 1}], "next_cursor": None}
+        save_users_to_cache(page)
+        fake.data.clear()
+
+        assert get_users_from_cache() == (page, True)
+
+    @patch("app._l1_active")
+    @patch("app.get_redis")
+    def test_l1_ignores_older_version(self, mock_get_redis, mock_active):
+        """Test: Una página de L1 guardada con otra versión de datos no se usa"""
+        mock_active.is_set.return_value = True
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        page = {"users": [{"id": 1}], "next_cursor": None}
+        fake.hset(USERS_VERSION_KEY, "n", 1)
+        fake.hset(USERS_VERSION_KEY, "ts", 1000)
+        save_users_to_cache(page, version=(1, 1000))
+        fake.data.clear()
+
+        assert get_users_from_cache(version=(1, 1000)) == (page, True)
+        # Otro pod ha escrito y la invalidación aún no ha llegado por pub/sub
+        assert get_users_from_cache(version=(2, 2000)) == (None, False)
+
+    @patch("app._l1_active")
+    @patch("app.get_redis")
+    def test_page_from_older_version_saved_stale(self, mock_get_redis, mock_active):
+        """Test: Si la versión cambió durante la consulta la página queda obsoleta"""
+        mock_active.is_set.return_value = True
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        fake.hset(USERS_VERSION_KEY, "n", 2)
+        fake.hset(USERS_VERSION_KEY, "ts", 2000)
+        page = {"users": [{"id": 1}], "next_cursor": None}
+
+        save_users_to_cache(page, version=(1, 1000))
+
+        key = users_page_key(None, USERS_PAGE_SIZE)
+        assert key in fake.data and f"{key}:fresh" not in fake.data
+        assert len(l1_cache) == 0
+        fake.set(f"{key}:lock", "otro-pod")
+        assert get_users_from_cache(version=(2, 2000)) == (page, CACHE_STALE)
+
+    @patch("app._l1_active")
+    @patch("app.get_redis")
+    def test_invalidation_is_published(self, mock_get_redis, mock_active):
+        """Test: La invalidación limpia la L1 local y se publica al resto de pods"""
+        mock_active.is_set.return_value = True
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        save_users_to_cache({"users": [], "next_cursor": None})
+
+        invalidate_users_cache(datetime(2025, 3, 1))
+
+        assert len(l1_cache) == 0
+        channel, message = fake.published[0]
+        assert channel == CACHE_INVALIDATION_CHANNEL
+        assert float(message) == datetime(2025, 3, 1).timestamp()
+
+    def test_apply_remote_invalidation(self):
+        """Test: Un mensaje de otro pod vacía las páginas afectadas"""
+        l1_cache.set("first", 1)
+        l1_cache.set("old", 2, score=100.0)
+
+        apply_cache_invalidation("-inf")
+
+        assert len(l1_cache) == 0
+
+
+def make_user(user_id, day):
+    return {
+        "id": user_id,
+        "name": f"U{user_id}",
+        "created_at": f"2025-01-{day:02d}T00:00:00",
+    }
+
+
+class TestWriteThrough:
+    """Tests para la actualización incremental de la caché"""
+
+    def test_added_user_goes_to_first_page(self):
+        """Test: Un alta se inserta en orden y desplaza la última fila"""
+        page = {"users": [make_user(3, 3), make_user(2, 2)], "next_cursor": None}
+        page["next_cursor"] = encode_cursor("2025-01-02T00:00:00", 2)
+
+        changed = patch_users_page(page, 2, added=make_user(4, 4))
+
+        assert changed is True
+        assert [u["id"] for u in page["users"]] == [4, 3]
+        assert decode_cursor(page["next_cursor"]) == (datetime(2025, 1, 3), 3)
+
+    def test_added_user_outside_page_range(self):
+        """Test: Un alta anterior al final de la página no la modifica"""
+        page = {
+            "users": [make_user(3, 3), make_user(2, 2)],
+            "next_cursor": encode_cursor("2025-01-02T00:00:00", 2),
+        }
+
+        assert patch_users_page(page, 2, added=make_user(1, 1)) is False
+        assert [u["id"] for u in page["users"]] == [3, 2]
+
+    def test_deleted_user_is_removed(self):
+        """Test: Una baja elimina la fila sin recalcular la página"""
+        page = {"users": [make_user(3, 3), make_user(2, 2)], "next_cursor": None}
+
+        assert patch_users_page(page, 2, deleted_id=3) is True
+        assert [u["id"] for u in page["users"]] == [2]
+        assert patch_users_page(page, 2, deleted_id=99) is False
+
+    @patch("app.get_redis")
+    def test_write_through_updates_cached_pages(self, mock_get_redis):
+        """Test: Las altas y bajas actualizan Redis sin invalidar la página"""
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        save_users_to_cache({"users": [make_user(1, 1)], "next_cursor": None})
+
+        write_through_users_cache(added=make_user(2, 2))
+        page, from_cache = get_users_from_cache()
+        assert [u["id"] for u in page["users"]] == [2, 1]
+        assert from_cache is True
+
+        write_through_users_cache(deleted=make_user(1, 1))
+        page, from_cache = get_users_from_cache()
+        assert [u["id"] for u in page["users"]] == [2]
+        assert from_cache is True
+        assert len(fake.published) == 2
+
+    @patch("app.get_redis")
+    def test_write_through_keeps_invalidated_pages_stale(self, mock_get_redis):
+        """Test: Un alta no vuelve a marcar como fresca una página invalidada"""
+        fake = FakeRedis()
+        mock_get_redis.return_value = fake
+        save_users_to_cache({"users": [make_user(1, 1)], "next_cursor": None})
+        invalidate_users_cache()
+
+        write_through_users_cache(added=make_user(2, 2))
+        write_through_users_cache(added=make_user(3, 3))
+
+        assert not [key for key in fake.data if key.endswith(":fresh")]
+        page, from_cache = get_users_from_cache()
+        assert page is None and from_cache is False
+
+    @patch("app.invalidate_users_cache")
+    @patch("app.get_redis")
+    def test_write_through_without_date_invalidates(
+        self, mock_get_redis, mock_invalidate
+    ):
+        """Test: Sin fecha de creación no se puede ubicar la fila y se invalida todo"""
+        write_through_users_cache(added={"id": 1, "created_at": None})
+
+        mock_invalidate.assert_called_once_with()
+
+
+class TestPagination:
+    """Tests para los cursores de paginación keyset"""
+
+    def test_cursor_roundtrip(self):
+        """Test: El cursor codifica y decodifica (created_at, id)"""
+        cursor = encode_cursor(datetime(2025, 1, 1, 10, 0), 42)
+
+        assert decode_cursor(cursor) == (datetime(2025, 1, 1, 10, 0), 42)
+
+    def test_invalid_cursor(self):
+        """Test: Un cursor manipulado se rechaza"""
+        with pytest.raises(ValueError):
+            decode_cursor("no-es-un-cursor")
+
+    def test_parse_page_size_bounds(self):
+        """Test: El tamaño de página se limita a valores válidos"""
+        assert parse_page_size(None) == USERS_PAGE_SIZE
+        assert parse_page_size("abc") == USERS_PAGE_SIZE
+        assert parse_page_size("0") == 1
+        assert parse_page_size("100000") == USERS_PAGE_SIZE_MAX
+
+
+class TestCacheSerialization:
+    """Tests para la serialización de las páginas cacheadas"""
+
+    PAGE = {
+        "users": [
+            {"id": i, "name": f"Usuario {i}", "email": f"u{i}@example.com"}
+            for i in range(100)
+        ],
+        "next_cursor": None,
+    }
+
+    @pytest.mark.parametrize("serializer", sorted(CACHE_CODECS))
+    def test_round_trip(self, serializer):
+        """Test: Cada serializador disponible recupera la misma página"""
+        data = encode_cache_value(self.PAGE, serializer)
+
+        assert isinstance(data, bytes)
+        assert decode_cache_value(data) == self.PAGE
+
+    def test_large_values_are_compressed(self):
+        """Test: Los valores grandes se comprimen y los pequeños no"""
+        small = {"users": [], "next_cursor": None}
+        with patch("app.CACHE_COMPRESS_MIN", 1024):
+            large_data = encode_cache_value(self.PAGE, "json")
+            small_data = encode_cache_value(small, "json")
+
+        assert large_data[2:3] == b"z"
+        assert len(large_data) < len(json.dumps(self.PAGE))
+        assert small_data[2:3] == b"-"
+        assert decode_cache_value(large_data) == self.PAGE
+        assert decode_cache_value(small_data) == small
+
+    def test_plain_json_is_accepted(self):
+        """Test: Se leen también valores en JSON plano (str o bytes)"""
+        assert decode_cache_value(json.dumps(self.PAGE)) == self.PAGE
+        assert decode_cache_value(json.dumps(self.PAGE).encode()) == self.PAGE
+
+    def test_unknown_serializer_fails(self):
+        """Test: Un valor de un serializador no instalado da error (fallo de caché)"""
+        with pytest.raises(ValueError):
+            decode_cache_value(b"\x00?-datos")
+
+    def test_display_urls_precomputed(self):
+        """Test: Las URLs de imagen se calculan al construir la página"""
+        rows = [
+            {"id": 2, "image_url": "abc_foto.png", "created_at": datetime(2025, 1, 2)},
+            {"id": 1, "image_url": None, "created_at": datetime(2025, 1, 1)},
+        ]
 
-        users_data = [{"id": 1, "name": "Test"}]
-        save_users_to_cache(users_data)
+        page = build_users_page(rows, 10)
 
-        # Verificar que se llamó setex con el TTL correcto
-        call_args = mock_redis.setex.call_args
-        assert call_args[0][0] == USERS_CACHE_KEY
-        assert call_args[0][1] == CACHE_TTL
-        assert call_args[0][2] == json.dumps(users_data)
+        with_image, without_image = page["users"]
+        assert with_image["image_display_url"].endswith("/user-images/abc_foto.png")
+        assert with_image["thumbnail_url"].endswith("/thumbnails/120/abc_foto.jpg")
+        assert with_image["thumbnail_fallback_url"] == "/users/thumbnail/abc_foto.png"
+        assert without_image["thumbnail_url"] is None